@@ -0,0 +1,180 @@
+# Content-addressed storage for receipts and other financeiro attachments
+import hashlib
+import mimetypes
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import db
+import store
+
+CHUNK_SIZE = 1024 * 1024
+PREVIEW_SIZE = (256, 256)
+
+# Leading bytes of the formats receipts usually arrive in; the file name is
+# only consulted when none of these match.
+SIGNATURES = (
+    (b'%PDF', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+)
+
+
+def store_dir():
+    """Root of the store: SCHOOL_ATTACHMENTS_DIR, or 'anexos' next to the database.
+
+    Workstations sharing a data server should all point the variable at the
+    same network folder.
+    """
+    return os.environ.get('SCHOOL_ATTACHMENTS_DIR') or os.path.join(os.path.dirname(db.DB_PATH), 'anexos')
+
+
+def is_digest(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def path_for(sha256):
+    """Where the content with this digest lives (fanned out by its first byte)."""
+    return os.path.join(store_dir(), sha256[:2], sha256)
+
+
+def sniff_mime(head, name):
+    for signature, mime in SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def ingest(path, chunk_size=CHUNK_SIZE):
+    """Copy ``path`` into the store and return its metadata.
+
+    The file is hashed while it is copied, one chunk at a time, so even large
+    scans are read once and never held in memory. Content already in the
+    store is not written again. Blocks; call off the UI thread.
+    """
+    root = store_dir()
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    fd, tmp = tempfile.mkstemp(dir=root, prefix='.incoming-')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            while chunk := src.read(chunk_size):
+                if not head:
+                    head = chunk[:16]
+                digest.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        sha256 = digest.hexdigest()
+        target = path_for(sha256)
+        if os.path.exists(target):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    name = os.path.basename(path)
+    return {'sha256': sha256, 'size': size, 'mime': sniff_mime(head, name), 'nome': name}
+
+
+def _render_image(src, dst, size):
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    with Image.open(src) as im:
+        # draft() lets the JPEG decoder downscale while reading, so a large
+        # scan is never decoded at full resolution.
+        im.draft('RGB', size)
+        im.thumbnail(size)
+        im.convert('RGB').save(dst, 'PNG')
+    return True
+
+
+def _render_pdf(src, dst, size):
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        return False
+    prefix = dst[:-len('.png')]
+    subprocess.run([pdftoppm, '-png', '-singlefile', '-f', '1', '-l', '1', '-scale-to', str(max(size)),
+                    src, prefix], check=True, capture_output=True, timeout=60)
+    return True
+
+
+def preview(sha256, mime, size=PREVIEW_SIZE):
+    """Path of a PNG thumbnail, rendered on first request and cached; None
+    when the format (or the library it needs) is not available.
+
+    Images need Pillow and PDFs the pdftoppm tool. Blocks; call off the UI
+    thread.
+    """
+    cache = os.path.join(store_dir(), 'previews')
+    target = os.path.join(cache, f'{sha256}-{size[0]}x{size[1]}.png')
+    if os.path.exists(target):
+        return target
+    if mime.startswith('image/'):
+        render = _render_image
+    elif mime == 'application/pdf':
+        render = _render_pdf
+    else:
+        return None
+    os.makedirs(cache, exist_ok=True)
+    tmp = os.path.join(cache, f'.{sha256}-{os.getpid()}.png')
+    try:
+        if not render(path_for(sha256), tmp, size):
+            return None
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return target
+
+
+def open_external(path):
+    """Open a file with the system's default application."""
+    if sys.platform.startswith('win'):
+        os.startfile(path)
+    else:
+        subprocess.Popen(['open' if sys.platform == 'darwin' else 'xdg-open', path])
+
+
+def import_legacy(progress=None):
+    """Move financeiro rows that still hold a file path into the store.
+
+    Returns (moved, missing): rows converted and paths that no longer exist.
+    """
+    conn = db.get_conn()
+    rows = conn.execute("SELECT id, anexo FROM financeiro WHERE ifnull(anexo, '') <> ''").fetchall()
+    moved, missing = 0, []
+    for id_, anexo in rows:
+        if is_digest(anexo):
+            continue
+        if not os.path.isfile(anexo):
+            missing.append(anexo)
+            continue
+        meta = ingest(anexo)
+        store.add_attachment(meta)
+        with db.transaction(conn):
+            conn.execute('UPDATE financeiro SET anexo = ? WHERE id = ?', (meta['sha256'], id_))
+        moved += 1
+        if progress is not None:
+            progress(moved)
+    return moved, missing
+
+
+if __name__ == '__main__':
+    moved, missing = import_legacy()
+    print(f'{moved} anexos copiados para {store_dir()}')
+    for path in missing:
+        print(f'não encontrado: {path}')
@@ -0,0 +1,117 @@
+# Background writer for the audit log
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from db import get_conn
+
+log = logging.getLogger(__name__)
+
+# Durability modes: 'strict' commits every entry before log() returns;
+# 'batched' queues entries and commits them in groups from a worker thread,
+# so a crash can lose at most the last flush interval of audit rows.
+STRICT = 'strict'
+BATCHED = 'batched'
+
+INSERT_SQL = '''INSERT INTO logs(username, action, table_name, record_id, timestamp)
+                VALUES(?,?,?,?,?)'''
+
+# A batch that fails to commit (a lock held too long, a full disk) is tried
+# again after RETRY_DELAY, doubling each time; after MAX_ATTEMPTS its rows
+# are logged in full and reported through AuditWriter.on_loss.
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 0.2
+
+
+class AuditWriter:
+    def __init__(self, mode=BATCHED, max_queue=10000, batch_size=500, flush_interval=0.5):
+        if mode not in (STRICT, BATCHED):
+            raise ValueError(f'Modo de auditoria desconhecido: {mode}')
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stop = threading.Event()
+        self._flushing = threading.Event()
+        self._start_lock = threading.Lock()
+        self.lost = 0
+        # Called on the writer thread with (rows lost, exception).
+        self.on_loss = None
+
+    def log(self, user, action, table_name, record_id):
+        row = (user, action, table_name, str(record_id), datetime.datetime.now().isoformat())
+        if self.mode == STRICT:
+            self._write([row])
+            return
+        self._ensure_started()
+        # put() blocks when the queue is full, which throttles callers rather
+        # than growing memory without bound if the disk falls behind.
+        self.queue.put(row)
+
+    def flush(self):
+        """Block until every queued entry has been committed."""
+        if self._thread is not None:
+            self._flushing.set()
+            self.queue.join()
+            self._flushing.clear()
+
+    def close(self):
+        self.flush()
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._stop.clear()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Keep collecting for up to one interval so bursts share a commit.
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = 0 if self._flushing.is_set() else deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_retrying(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_retrying(self, batch):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                error = e
+                log.warning('Falha ao gravar %d registros de auditoria (tentativa %d de %d): %s',
+                            len(batch), attempt, MAX_ATTEMPTS, e)
+                if attempt < MAX_ATTEMPTS:
+                    time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+        self.lost += len(batch)
+        log.error('Registros de auditoria perdidos: %r', batch)
+        if self.on_loss is not None:
+            try:
+                self.on_loss(len(batch), error)
+            except Exception:
+                log.exception('Falha ao avisar sobre registros de auditoria perdidos')
+
+    def _write(self, rows):
+        conn = get_conn()
+        with conn:
+            conn.executemany(INSERT_SQL, rows)
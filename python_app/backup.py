@@ -0,0 +1,313 @@
+# Online backups of the live database: compressed, verified and rotated
+import datetime
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import db
+
+log = logging.getLogger(__name__)
+
+# Pages copied per backup step. Larger steps finish sooner; smaller ones keep
+# each step (and the read lock it holds) short. See the stats snapshot() returns.
+STEP_PAGES = int(os.environ.get('SCHOOL_BACKUP_STEP_PAGES', 1024))
+STEP_PAUSE = 0.005              # seconds between steps, to leave the disk to the app
+# The copy reads one pinned snapshot, so commits by other connections should
+# not make the backup API start over; if they still do this many times, the
+# rest is copied in a single step.
+MAX_RESTARTS = 3
+# gzip level: 1 is about 3x faster than 6 for a few percent larger files.
+COMPRESS_LEVEL = 1
+KEEP = int(os.environ.get('SCHOOL_BACKUP_KEEP', 14))
+INTERVAL_HOURS = float(os.environ.get('SCHOOL_BACKUP_HOURS', 24))     # 0 = no scheduled backups
+COPY_CHUNK = 1024 * 1024
+PREFIX = 'school-'
+
+
+def backup_dir():
+    """SCHOOL_BACKUP_DIR, or 'backups' next to the database."""
+    return os.environ.get('SCHOOL_BACKUP_DIR') or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)),
+                                                                 'backups')
+
+
+def snapshots(directory=None):
+    """Snapshot files, oldest first (names sort by time)."""
+    return sorted(glob.glob(os.path.join(directory or backup_dir(), f'{PREFIX}*.db.gz')))
+
+
+def _reserve(directory):
+    """A new snapshot path, claimed by creating its .tmp file.
+
+    Two snapshots never share a name, so none overwrites another; restore()
+    takes its safety snapshot right before reading the one restored.
+    """
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    target = os.path.join(directory, f'{PREFIX}{stamp}.db.gz')
+    counter = 0
+    while True:
+        if not os.path.exists(target):
+            try:
+                open(target + '.tmp', 'xb').close()
+                return target
+            except FileExistsError:
+                pass
+        counter += 1
+        target = os.path.join(directory, f'{PREFIX}{stamp}-{counter}.db.gz')
+
+
+def integrity(path):
+    """PRAGMA integrity_check of an uncompressed database file; 'ok' when sound."""
+    if os.path.getsize(path) == 0:
+        return 'arquivo vazio'      # SQLite would take it for a new, empty database
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return '; '.join(row[0] for row in conn.execute('PRAGMA integrity_check'))
+    finally:
+        conn.close()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(src, dst, pages, pause):
+    """Copy the live database into ``dst`` step by step; returns timing stats."""
+    steps, restarts = [], 0
+    remaining_before = None
+    last = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal last, remaining_before, restarts
+        steps.append(time.perf_counter() - last)
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts
+        remaining_before = remaining
+        time.sleep(pause)
+        last = time.perf_counter()
+
+    t0 = time.perf_counter()
+    # An open read transaction pins the source to one WAL snapshot for every
+    # step; otherwise each commit elsewhere restarts the copy from page 1.
+    # In WAL mode readers never block writers, so the app carries on.
+    src.execute('BEGIN')
+    src.execute('SELECT count(*) FROM sqlite_master').fetchone()
+    try:
+        src.backup(dst, pages=pages, progress=progress)
+    except _TooManyRestarts:
+        log.warning('Backup reiniciado %d vezes por gravações concorrentes; copiando de uma vez', restarts)
+        last = time.perf_counter()
+        src.backup(dst, pages=-1)
+        steps.append(time.perf_counter() - last)
+    finally:
+        src.rollback()
+    seconds = time.perf_counter() - t0
+    page_count = dst.execute('PRAGMA page_count').fetchone()[0]
+    size = page_count * dst.execute('PRAGMA page_size').fetchone()[0]
+    step_ms = sorted(s * 1000 for s in steps) or [0.0]
+    return {
+        'pages': page_count,
+        'bytes': size,
+        'step_pages': pages,
+        'steps': len(steps),
+        'restarts': restarts,
+        'seconds': round(seconds, 3),
+        'mb_per_s': round(size / 1e6 / seconds, 1) if seconds else None,
+        # Each step holds the source's read lock; between steps writers run.
+        'step_ms_median': round(statistics.median(step_ms), 3),
+        'step_ms_max': round(step_ms[-1], 3),
+    }
+
+
+def snapshot(directory=None, pages=STEP_PAGES, pause=STEP_PAUSE, keep=KEEP, source=None):
+    """Take a verified, gzip-compressed snapshot of the live database.
+
+    The sqlite3 backup API copies ``pages`` pages per step from its own
+    connection and a single read snapshot; in WAL mode that never blocks the
+    UI or other writers. The copy must pass PRAGMA integrity_check before
+    it is compressed and becomes visible under its final name. Older
+    snapshots beyond ``keep`` are then removed. ``source`` defaults to the
+    app's database. Returns the stats dict (timings, throughput, file) that
+    is also logged.
+    """
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    target = _reserve(directory)
+    fd, raw = tempfile.mkstemp(dir=directory, prefix='.backup-', suffix='.db')
+    os.close(fd)
+    try:
+        src = db.connect(source)
+        dst = sqlite3.connect(raw)
+        try:
+            stats = _copy(src, dst, pages, pause)
+            # A self-contained file: no -wal needed to read the snapshot.
+            dst.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            dst.close()
+            src.close()
+        t0 = time.perf_counter()
+        result = integrity(raw)
+        if result != 'ok':
+            raise RuntimeError(f'Cópia de segurança corrompida: {result}')
+        stats['verify_seconds'] = round(time.perf_counter() - t0, 3)
+        t0 = time.perf_counter()
+        with open(raw, 'rb') as f, gzip.open(target + '.tmp', 'wb', compresslevel=COMPRESS_LEVEL) as gz:
+            shutil.copyfileobj(f, gz, COPY_CHUNK)
+        os.replace(target + '.tmp', target)
+        stats.update(file=target, compressed_bytes=os.path.getsize(target),
+                     compress_seconds=round(time.perf_counter() - t0, 3))
+    finally:
+        for path in (raw, target + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+    stats['removed'] = rotate(directory, keep)
+    log.info('Backup %s: %s', os.path.basename(target), stats)
+    return stats
+
+
+def rotate(directory=None, keep=KEEP):
+    """Delete all but the newest ``keep`` snapshots (0 keeps them all); returns
+    the removed paths."""
+    old = snapshots(directory)[:-keep] if keep > 0 else []
+    for path in old:
+        os.remove(path)
+    return old
+
+
+def _decompress(snapshot_path, directory):
+    fd, raw = tempfile.mkstemp(dir=directory, prefix='.restore-', suffix='.db')
+    try:
+        # gzip checks the CRC of the whole stream once it reaches the end.
+        with os.fdopen(fd, 'wb') as f, gzip.open(snapshot_path, 'rb') as gz:
+            shutil.copyfileobj(gz, f, COPY_CHUNK)
+    except BaseException:
+        os.remove(raw)
+        raise
+    return raw
+
+
+def verify(snapshot_path):
+    """Decompress a snapshot and run integrity_check on it; 'ok' when sound."""
+    raw = _decompress(snapshot_path, os.path.dirname(os.path.abspath(snapshot_path)))
+    try:
+        return integrity(raw)
+    finally:
+        os.remove(raw)
+
+
+def restore(snapshot_path, target=None):
+    """Replace the contents of ``target`` (the live database) with a snapshot.
+
+    The snapshot is verified first and the current database is itself backed
+    up, so a restore can be undone. The copy goes through the backup API on
+    a normal connection, so the -wal file and other open connections stay
+    consistent; they see the restored data on their next read. Returns the
+    path of the safety snapshot.
+    """
+    target = target or db.DB_PATH
+    raw = _decompress(snapshot_path, os.path.dirname(os.path.abspath(target)))
+    try:
+        result = integrity(raw)
+        if result != 'ok':
+            raise RuntimeError(f'Cópia de segurança corrompida: {result}')
+        # keep=0: rotating now could delete the very snapshot being restored.
+        safety = snapshot(keep=0, source=target) if os.path.exists(target) else None
+        src = sqlite3.connect(raw)
+        dst = db.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        os.remove(raw)
+    log.info('Banco restaurado de %s (estado anterior em %s)', snapshot_path, safety and safety['file'])
+    return safety and safety['file']
+
+
+class BackupService:
+    """Takes a snapshot every ``interval_hours`` on a daemon thread.
+
+    The age of the newest snapshot decides when the next one is due, so
+    restarting the app does not trigger a backup each time.
+    """
+
+    def __init__(self, interval_hours=INTERVAL_HOURS):
+        self.interval = interval_hours * 3600
+        self.last_stats = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due_in(self):
+        existing = snapshots()
+        if not existing:
+            return 0
+        return max(0.0, os.path.getmtime(existing[-1]) + self.interval - time.time())
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name='backup', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.due_in()):
+            try:
+                self.last_stats = snapshot()
+            except Exception:
+                log.exception('Falha no backup automático')
+                self._stop.wait(600)    # retry later rather than spin
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Cópias de segurança do banco do sistema escolar')
+    parser.add_argument('--db', help='arquivo do banco (padrão: school.db ao lado do programa)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    snap = sub.add_parser('snapshot', help='criar uma cópia agora')
+    snap.add_argument('--step-pages', type=int, default=STEP_PAGES)
+    snap.add_argument('--pause-ms', type=float, default=STEP_PAUSE * 1000)
+    snap.add_argument('--keep', type=int, default=KEEP)
+    sub.add_parser('list', help='listar as cópias')
+    check = sub.add_parser('verify', help='verificar a integridade de uma cópia')
+    check.add_argument('file')
+    back = sub.add_parser('restore', help='restaurar uma cópia (feche o sistema antes)')
+    back.add_argument('file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.db:
+        db.set_db_path(args.db)
+    if args.command == 'snapshot':
+        stats = snapshot(pages=args.step_pages, pause=args.pause_ms / 1000, keep=args.keep)
+        for key, value in stats.items():
+            print(f'{key}: {value}')
+    elif args.command == 'list':
+        for path in snapshots():
+            print(f'{path}  {os.path.getsize(path) / 1e6:.1f} MB')
+    elif args.command == 'verify':
+        try:
+            result = verify(args.file)
+        except (OSError, EOFError) as e:    # truncated or bad gzip data
+            result = f'arquivo danificado: {e}'
+        print(result)
+        return 0 if result == 'ok' else 1
+    elif args.command == 'restore':
+        safety = restore(args.file)
+        print(f'Restaurado de {args.file}' + (f'; estado anterior salvo em {safety}' if safety else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1 @@
+# Synthetic datasets and headless benchmarks for the school app
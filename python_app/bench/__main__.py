@@ -0,0 +1,76 @@
+# python -m bench run [--db PATH] [--output results.json]
+# python -m bench compare base.json new.json
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench.generate import SIZES, generate
+from bench.suite import compare, run
+
+
+def cmd_run(args):
+    tmp = None
+    path = args.db
+    if path is None:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'bench.db')
+    try:
+        if not os.path.exists(path):
+            t0 = time.perf_counter()
+            generate(path, args.cadastro, args.financeiro, args.logs, args.seed,
+                     progress=lambda table, rows: print(f'\rgerando {table}: {rows}', end='', file=sys.stderr,
+                                                        flush=True))
+            print(f'\nbanco gerado em {time.perf_counter() - t0:.1f} s', file=sys.stderr)
+        report = run(path, args.repeat, args.only)
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    for name, result in report['results'].items():
+        print(f'{name:32} {result["median_ms"]:10.2f} ms  (p95 {result["p95_ms"]:.2f})', file=sys.stderr)
+
+
+def cmd_compare(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    regressed = False
+    for name, old_ms, new_ms, ratio, worse in compare(base, new, args.threshold):
+        regressed |= worse
+        print(f'{name:32} {old_ms:10.2f} {new_ms:10.2f} {ratio:6.2f}x{"  REGRESSÃO" if worse else ""}')
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Benchmarks do sistema escolar')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='gera um banco sintético (se preciso) e mede os caminhos da aplicação')
+    p.add_argument('--db', help='banco a usar; é gerado se não existir (padrão: temporário)')
+    for table, size in SIZES.items():
+        p.add_argument(f'--{table}', type=int, default=size, help=f'linhas em {table} (padrão {size})')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--repeat', type=int, default=20)
+    p.add_argument('--only', nargs='*', help='prefixos dos casos a medir, ex.: logs login')
+    p.add_argument('--output', '-o', help='arquivo JSON de resultados (padrão: saída padrão)')
+    p.set_defaults(func=cmd_run)
+    p = sub.add_parser('compare', help='compara dois resultados JSON pela mediana')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=1.2, help='razão acima da qual o caso regrediu')
+    p.set_defaults(func=cmd_compare)
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# Builds synthetic school databases of a chosen size
+import datetime
+import random
+
+import db
+from schema import migrate
+from store import CADASTRO_COLUMNS
+
+FIRST_NAMES = ('Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela',
+               'João', 'Larissa', 'Lucas', 'Mariana', 'Mateus', 'Natália', 'Pedro', 'Rafaela', 'Samuel',
+               'Tatiane', 'Vitor', 'Yasmin', 'Maria', 'José', 'Antônio', 'Francisca', 'Júlia', 'Gustavo')
+LAST_NAMES = ('Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima',
+              'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes',
+              'Vieira', 'Barbosa', 'Rocha', 'Dias', 'Nascimento', 'Andrade', 'Moreira', 'Nunes', 'Araújo')
+BAIRROS = ('Centro', 'Jardim América', 'Vila Nova', 'Boa Vista', 'Santa Cruz', 'São José', 'Industrial',
+           'Planalto', 'Bela Vista', 'Jardim das Flores')
+CIDADES = ('São Paulo', 'Campinas', 'Santos', 'Sorocaba', 'Ribeirão Preto')
+CURSOS = ('Inglês', 'Espanhol', 'Informática', 'Matemática', 'Redação', 'Música', 'Robótica', 'Francês')
+PAYMENT_METHODS = ('pix', 'dinheiro', 'cartão', 'boleto')
+USERS = ('master', 'secretaria', 'financeiro', 'coordenacao', 'recepcao')
+ACTIONS = ('add', 'edit', 'add', 'login', 'import')
+LOG_TABLES = ('cadastro', 'financeiro', 'turmas', 'users', 'estoque')
+
+SIZES = {'cadastro': 100_000, 'financeiro': 1_000_000, 'logs': 5_000_000}
+CHUNK = 10_000
+CPF_STEP = 7_391_245_683
+
+
+def _digits(rng, n):
+    return ''.join(rng.choice('0123456789') for _ in range(n))
+
+
+def _cpf(number):
+    # Multiplying by a step coprime with 10 permutes the 11-digit numbers, so
+    # distinct students get distinct CPFs (cpf_norm is unique) that still
+    # look random.
+    digits = f'{number * CPF_STEP % 10 ** 11:011d}'
+    return f'{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}'
+
+
+def _person(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def student(rng, today, number, turmas=40, cursos=len(CURSOS)):
+    """One cadastro record as the CadastroTab form would save it; ``number``
+    (the matricula it will get) picks a CPF no other number gets."""
+    birth = today - datetime.timedelta(days=rng.randint(6 * 365, 60 * 365))
+    tel, cep = _digits(rng, 9), _digits(rng, 8)
+    nome = _person(rng)
+    return {
+        'data_matricula': (today - datetime.timedelta(days=rng.randint(0, 5 * 365))).isoformat(),
+        'nome': nome,
+        'data_nascimento': birth.strftime('%d/%m/%Y'),
+        'idade': (today - birth).days // 365,
+        'responsavel': _person(rng),
+        'cpf': _cpf(number),
+        'rg': '',
+        'tel_principal': f'(11) {tel[:5]}-{tel[5:]}',
+        'tel_recado': '',
+        'cep': f'{cep[:5]}-{cep[5:]}',
+        'logradouro': f'Rua {rng.choice(LAST_NAMES)}',
+        'numero': str(rng.randint(1, 3000)),
+        'complemento': '',
+        'bairro': rng.choice(BAIRROS),
+        'cidade': rng.choice(CIDADES),
+        'email': nome.split()[0].lower() + _digits(rng, 4) + '@example.com',
+        'instagram': '',
+        'turma_id': rng.randint(1, turmas),
+        'curso_id': rng.randint(1, cursos),
+        'material_id': rng.randint(1, 10),
+        'vencimento': str(rng.choice((5, 10, 15, 20))),
+        'valor_id': rng.randint(1, 5),
+    }
+
+
+def _students(rng, n, today):
+    cols = [c for c in CADASTRO_COLUMNS if c != 'matricula']
+    for number in range(1, n + 1):
+        record = student(rng, today, number)
+        yield tuple(record[c] for c in cols)
+
+
+def _charges(rng, n, students, today):
+    for _ in range(n):
+        due = today - datetime.timedelta(days=rng.randint(-60, 3 * 365))
+        # Older charges are almost always paid; recent ones often are not.
+        paid = rng.random() < (0.97 if due < today - datetime.timedelta(days=60) else 0.5)
+        yield (rng.randint(1, students), rng.choice((180.0, 220.0, 250.0, 320.0)), due.strftime('%d/%m/%Y'),
+               rng.choice(PAYMENT_METHODS) if paid else '', '')
+
+
+def _log_entries(rng, n, students, today):
+    # Spread over two years and written in time order, as the app appends them.
+    start = datetime.datetime.combine(today, datetime.time()) - datetime.timedelta(days=730)
+    step = 730 * 86400 / max(n, 1)
+    for i in range(n):
+        ts = start + datetime.timedelta(seconds=i * step + rng.random() * step)
+        yield (rng.choice(USERS), rng.choice(ACTIONS), rng.choice(LOG_TABLES), str(rng.randint(1, students)),
+               ts.isoformat())
+
+
+def _insert_many(conn, sql, rows, progress, label):
+    chunk = []
+    done = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            conn.executemany(sql, chunk)
+            done += len(chunk)
+            chunk.clear()
+            if progress:
+                progress(label, done)
+    if chunk:
+        conn.executemany(sql, chunk)
+        done += len(chunk)
+    if progress:
+        progress(label, done)
+
+
+def generate(path, cadastro=SIZES['cadastro'], financeiro=SIZES['financeiro'], logs=SIZES['logs'],
+             seed=1, today=None, progress=None):
+    """Create a migrated database at ``path`` filled with synthetic rows.
+
+    Rows go through the real schema, so the search index and the financial
+    summaries are maintained by their triggers exactly as in production.
+    The same seed always produces the same data. ``progress(table, rows)``
+    is called after each chunk.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    conn = db.connect(path)
+    try:
+        migrate(conn)
+        # A throwaway file: durability does not matter while filling it.
+        conn.execute('PRAGMA synchronous=OFF')
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO users(username, password) VALUES ('master', 'master')")
+            conn.executemany('INSERT INTO users(username, password) VALUES (?, ?)',
+                             [(u, u) for u in USERS if u != 'master'])
+            conn.executemany('INSERT INTO turmas(nome, horario) VALUES (?, ?)',
+                             [(f'Turma {i}', f'{8 + i % 12:02d}:00') for i in range(1, 41)])
+            conn.executemany('INSERT INTO cursos(nome) VALUES (?)', [(c,) for c in CURSOS])
+            conn.executemany('INSERT INTO materiais(nome, valor) VALUES (?, ?)',
+                             [(f'Apostila {i}', 40.0 + i * 5) for i in range(1, 11)])
+            conn.executemany('INSERT INTO valores(descricao, valor) VALUES (?, ?)',
+                             [(f'Plano {i}', 150.0 + i * 50) for i in range(1, 6)])
+            cols = [c for c in CADASTRO_COLUMNS if c != 'matricula']
+            _insert_many(conn, f'INSERT INTO cadastro({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))})',
+                         _students(rng, cadastro, today), progress, 'cadastro')
+            _insert_many(conn, 'INSERT INTO financeiro(matricula, valor, vencimento, forma_pagamento, anexo) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                         _charges(rng, financeiro, max(cadastro, 1), today), progress, 'financeiro')
+            _insert_many(conn, 'INSERT INTO logs(username, action, table_name, record_id, timestamp) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                         _log_entries(rng, logs, max(cadastro, 1), today), progress, 'logs')
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Gera um banco de dados sintético')
+    parser.add_argument('path')
+    for table, size in SIZES.items():
+        parser.add_argument(f'--{table}', type=int, default=size)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, args.cadastro, args.financeiro, args.logs, args.seed,
+             progress=lambda table, rows: print(f'\r{table}: {rows}', end='', flush=True))
+    print()
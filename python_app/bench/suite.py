@@ -0,0 +1,181 @@
+# Headless timings of the app's real data paths
+import datetime
+import itertools
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+import reports
+import store
+from audit import BATCHED, STRICT, AuditWriter
+from schema import check_query_plans
+
+from bench.generate import student
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stats(samples):
+    """Summary of a list of durations in seconds, reported in milliseconds."""
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        'n': len(ms),
+        'min_ms': round(ms[0], 3),
+        'median_ms': round(statistics.median(ms), 3),
+        'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        'max_ms': round(ms[-1], 3),
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def table_sizes(conn):
+    return {t: conn.execute(f'SELECT count(*) FROM {t}').fetchone()[0] for t in ('cadastro', 'financeiro', 'logs')}
+
+
+def _middle_cursor(conn, view_name, table, order_by):
+    """Cursor of the row halfway through a view, for deep-page timings."""
+    n = conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+    view = store.VIEWS[view_name]
+    key = conn.execute(f'SELECT {view.key} FROM {table} ORDER BY {order_by} LIMIT 1 OFFSET ?',
+                       (n // 2,)).fetchone()
+    return view.cursor(store.fetch_row(view_name, key[0])) if key else None
+
+
+def _cases(conn, repeat):
+    """(name, callable, repeat) for every read/write path; runs against db.DB_PATH."""
+    today = datetime.date.today()
+    month_ago = (today - datetime.timedelta(days=30)).isoformat()
+    mid_cadastro = _middle_cursor(conn, 'matriculas', 'cadastro', 'matricula')
+    mid_logs = _middle_cursor(conn, 'logs', 'logs', 'timestamp DESC, id DESC')
+    rng = random.Random(2)
+    numbers = itertools.count(conn.execute('SELECT ifnull(max(matricula), 0) + 1 FROM cadastro').fetchone()[0])
+
+    def save_with(writer):
+        def save():
+            row = store.add_cadastro(student(rng, today, next(numbers)))
+            writer.log('master', 'add', 'cadastro', row[0])
+        return save
+
+    strict, batched = AuditWriter(STRICT), AuditWriter(BATCHED)
+    cases = [
+        ('login', lambda: store.check_login('master', 'master'), repeat),
+        ('matriculas.first_page', lambda: store.fetch_page('matriculas'), repeat),
+        ('matriculas.deep_page', lambda: store.fetch_page('matriculas', after=mid_cadastro), repeat),
+        ('matriculas.search_name', lambda: store.search_matriculas('silva ana'), repeat),
+        ('matriculas.search_digits', lambda: store.search_matriculas('123'), repeat),
+        ('financeiro.first_page', lambda: store.fetch_page('financeiro'), repeat),
+        ('logs.first_page', lambda: store.fetch_page('logs'), repeat),
+        ('logs.deep_page', lambda: store.fetch_page('logs', after=mid_logs), repeat),
+        ('logs.filter_user', lambda: store.fetch_page('logs', filters=[('username', '=', 'secretaria')]), repeat),
+        ('logs.filter_action_range', lambda: store.fetch_page('logs', filters=[
+            ('action', '=', 'edit'), ('timestamp', '>=', month_ago)]), repeat),
+        ('logs.filter_table', lambda: store.fetch_page('logs', filters=[('table_name', '=', 'financeiro')]), repeat),
+        ('dashboard.refresh', lambda: (reports.totals(), reports.monthly(), reports.overdue(),
+                                       reports.revenue('turma'), reports.revenue('curso')), repeat),
+        ('cadastro.save_strict_audit', save_with(strict), repeat),
+        ('cadastro.save_batched_audit', save_with(batched), repeat),
+    ]
+    return cases, (strict, batched)
+
+
+def _time_init_db(repeat):
+    """init_db() on the benchmark database (cold connection) and on a new file."""
+    import school_app
+    existing = measure(lambda: (db.close_all(), school_app.init_db()), repeat)
+    path = db.DB_PATH
+    tmp = tempfile.mkdtemp()
+    fresh = []
+    try:
+        for i in range(repeat):
+            db.set_db_path(os.path.join(tmp, f'fresh{i}.db'))
+            t0 = time.perf_counter()
+            school_app.init_db()
+            fresh.append(time.perf_counter() - t0)
+    finally:
+        db.set_db_path(path)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {'init_db.existing': stats(existing), 'init_db.fresh': stats(fresh)}
+
+
+def _time_import(repeat):
+    """Interpreter start plus importing the app module, as a user launch pays it."""
+    samples = measure(lambda: subprocess.run([sys.executable, '-c', 'import school_app'], cwd=APP_DIR,
+                                             check=True), max(1, repeat // 4), warmup=0)
+    return {'startup.import': stats(samples)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(path, repeat=20, only=None):
+    """Time every case against the database at ``path`` and return a report dict.
+
+    The write cases add rows to that database. ``only`` limits the run to
+    cases whose name starts with one of the given prefixes.
+    """
+    old_path = db.DB_PATH
+    db.set_db_path(path)
+    try:
+        conn = db.get_conn()
+        check_query_plans(conn)
+        results = {}
+        cases, writers = _cases(conn, repeat)
+        for name, fn, n in cases:
+            if only and not name.startswith(tuple(only)):
+                continue
+            results[name] = stats(measure(fn, n))
+        for writer in writers:
+            writer.close()
+        for prefix, group in (('init_db', _time_init_db), ('startup', _time_import)):
+            if only and not any(p.split('.')[0] == prefix for p in only):
+                continue
+            results.update({k: v for k, v in group(repeat).items() if not only or k.startswith(tuple(only))})
+        return {
+            'meta': {
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'repeat': repeat,
+                'rows': table_sizes(db.get_conn()),
+            },
+            'results': results,
+        }
+    finally:
+        db.set_db_path(old_path)
+
+
+def compare(base, new, threshold=1.2):
+    """[(name, base median, new median, ratio, regressed)] for cases in both reports."""
+    rows = []
+    for name, result in new['results'].items():
+        if name not in base['results']:
+            continue
+        old_ms, new_ms = base['results'][name]['median_ms'], result['median_ms']
+        ratio = new_ms / old_ms if old_ms else float('inf')
+        rows.append((name, old_ms, new_ms, ratio, ratio > threshold))
+    return rows
@@ -0,0 +1,85 @@
+# Monthly billing: one financeiro charge per active student and month
+#
+# A student is billed when their cadastro has a plan (valor_id pointing at
+# valores) and they enrolled by the end of the month. The charge is due on
+# the day of the month stored in cadastro.vencimento, moved back to the last
+# day of short months. financeiro(matricula, competencia) is unique for
+# generated charges (schema migration 11), so running a month twice only
+# adds the students that were missing.
+import datetime
+import re
+
+from db import get_conn, transaction
+from schema import iso_date
+
+DEFAULT_DAY = 10    # when cadastro.vencimento is empty or not a day of the month
+
+_DAY = 'CAST(c.vencimento AS INTEGER)'
+# dd/mm/yyyy, the way FinanceiroTab stores a due date.
+_DUE = (f"strftime('%d/%m/%Y', min(date(:inicio, '+' || (CASE WHEN {_DAY} BETWEEN 1 AND 31 "
+        f"THEN {_DAY} ELSE {DEFAULT_DAY} END - 1) || ' days'), date(:inicio, '+1 month', '-1 day')))")
+_STUDENTS = 'FROM cadastro c JOIN valores v ON v.id = c.valor_id'
+_ENROLLED = f"ifnull({iso_date('c.data_matricula')}, '') <= date(:inicio, '+1 month', '-1 day')"
+
+
+def _params(competencia):
+    """Validate a 'yyyy-mm' month and return the query parameters."""
+    if not isinstance(competencia, str) or not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', competencia):
+        raise ValueError(f'Competência inválida: {competencia!r} (use aaaa-mm)')
+    return {'competencia': competencia, 'inicio': f'{competencia}-01'}
+
+
+def current_month(today=None):
+    return (today or datetime.date.today()).isoformat()[:7]
+
+
+def preview(competencia):
+    """What run() would do, without writing anything.
+
+    Returns {'alunos', 'ja_lancados', 'novos', 'total', 'sem_plano'}: billable
+    students, those already billed for the month, the charges and amount a
+    run would add, and students left out for lacking a plan.
+    """
+    params = _params(competencia)
+    conn = get_conn()
+    alunos, ja_lancados, total = conn.execute(f'''
+        SELECT count(*), count(f.id), total(CASE WHEN f.id IS NULL THEN CAST(v.valor AS REAL) END)
+        {_STUDENTS} LEFT JOIN financeiro f ON f.matricula = c.matricula AND f.competencia = :competencia
+        WHERE {_ENROLLED}''', params).fetchone()
+    sem_plano = conn.execute('SELECT count(*) FROM cadastro c WHERE NOT EXISTS '
+                             '(SELECT 1 FROM valores v WHERE v.id = c.valor_id)').fetchone()[0]
+    return {'alunos': alunos, 'ja_lancados': ja_lancados, 'novos': alunos - ja_lancados,
+            'total': round(total, 2), 'sem_plano': sem_plano}
+
+
+def run(competencia, user):
+    """Create the month's charges in one transaction and record the run.
+
+    Returns the faturamentos row (id, competencia, usuario, executado_em,
+    lancamentos, total); lancamentos is 0 when the month was already billed.
+    """
+    params = _params(competencia)
+    with transaction() as conn:
+        last = conn.execute('SELECT ifnull(max(id), 0) FROM financeiro').fetchone()[0]
+        # The unique index skips students already billed for the month.
+        conn.execute(f'''INSERT OR IGNORE INTO financeiro(matricula, valor, vencimento, forma_pagamento, competencia)
+            SELECT c.matricula, CAST(v.valor AS REAL), {_DUE}, '', :competencia {_STUDENTS} WHERE {_ENROLLED}''',
+            params)
+        count, total = conn.execute('SELECT count(*), total(valor) FROM financeiro WHERE id > ?',
+                                    (last,)).fetchone()
+        run_id = conn.execute(
+            'INSERT INTO faturamentos(competencia, usuario, executado_em, lancamentos, total) VALUES (?, ?, ?, ?, ?)',
+            (competencia, user, datetime.datetime.now().isoformat(timespec='seconds'), count,
+             round(total, 2))).lastrowid
+    return fetch_run(run_id)
+
+
+def fetch_run(run_id):
+    return get_conn().execute('SELECT id, competencia, usuario, executado_em, lancamentos, total '
+                              'FROM faturamentos WHERE id = ?', (run_id,)).fetchone()
+
+
+def runs(limit=50):
+    """The latest billing runs, newest first."""
+    return get_conn().execute('SELECT id, competencia, usuario, executado_em, lancamentos, total '
+                              'FROM faturamentos ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
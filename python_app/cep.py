@@ -0,0 +1,105 @@
+# Cached, non-blocking CEP (postal code) lookups against viaCEP
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import workers
+from db import get_conn
+
+VIACEP_URL = 'https://viacep.com.br/ws/{cep}/json/'
+TIMEOUT = (3.05, 5)            # connect, read (seconds)
+CACHE_TTL = 30 * 24 * 3600     # addresses rarely change; refresh monthly
+MEMORY_CACHE_SIZE = 512
+
+
+class CepNotFound(Exception):
+    pass
+
+
+def normalize_cep(cep):
+    digits = ''.join(filter(str.isdigit, cep))
+    if len(digits) != 8:
+        raise ValueError(f'CEP inválido: {cep}')
+    return digits
+
+
+class CepService:
+    """Resolves CEPs through an in-memory LRU, the cep_cache table and HTTP.
+
+    Entries older than ``ttl`` are refreshed from the network, but a stale
+    entry is still returned when the network is unavailable.
+    """
+
+    def __init__(self, url=VIACEP_URL, timeout=TIMEOUT, ttl=CACHE_TTL, cache_size=MEMORY_CACHE_SIZE):
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers.pool._max_workers,
+                              max_retries=Retry(total=2, backoff_factor=0.3,
+                                                status_forcelist=(502, 503, 504)))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def lookup(self, cep):
+        """Return the address dict for ``cep``. Blocks; call off the UI thread."""
+        cep = normalize_cep(cep)
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(cep)
+            if hit is not None:
+                self._memory.move_to_end(cep)
+        if hit is None:
+            hit = self._load(cep)
+        if hit is not None and now - hit[1] < self.ttl:
+            return hit[0]
+        try:
+            data = self._fetch(cep)
+        except requests.RequestException:
+            if hit is not None:
+                return hit[0]
+            raise
+        self._store(cep, data, now)
+        return data
+
+    def lookup_async(self, cep, callback, errback):
+        """Resolve ``cep`` on a worker; callbacks run on the Tk thread."""
+        return workers.submit(self.lookup, cep, callback=callback, errback=errback)
+
+    def _fetch(self, cep):
+        r = self.session.get(self.url.format(cep=cep), timeout=self.timeout)
+        r.raise_for_status()
+        data = r.json()
+        if data.get('erro'):
+            raise CepNotFound(f'CEP não encontrado: {cep}')
+        return data
+
+    def _load(self, cep):
+        row = get_conn().execute('SELECT data, fetched_at FROM cep_cache WHERE cep=?', (cep,)).fetchone()
+        if row is None:
+            return None
+        hit = (json.loads(row[0]), row[1])
+        self._remember(cep, hit)
+        return hit
+
+    def _store(self, cep, data, fetched_at):
+        conn = get_conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO cep_cache(cep, data, fetched_at) VALUES (?,?,?)',
+                         (cep, json.dumps(data), fetched_at))
+        self._remember(cep, (data, fetched_at))
+
+    def _remember(self, cep, hit):
+        with self._lock:
+            self._memory[cep] = hit
+            self._memory.move_to_end(cep)
+            while len(self._memory) > self.cache_size:
+                self._memory.popitem(last=False)
@@ -0,0 +1,62 @@
+# Tells an open workstation which rows other connections have changed
+#
+# Triggers (schema migration 10) append the key of every inserted, updated or
+# deleted row of the tracked tables to ``alteracoes``. The audit log is only
+# ever appended to, so its own id is the high-water mark instead. A mark is
+# (last alteracoes id, last logs id); since() reports what changed after it.
+from db import get_conn, transaction
+
+TRACKED = ('cadastro', 'financeiro', 'users', 'turmas', 'cursos', 'materiais', 'valores', 'estoque')
+# Beyond this many keys per table a list is cheaper to reload than to patch.
+MAX_KEYS = 500
+KEEP = 100_000
+
+
+def data_version(conn=None):
+    """Changes whenever another connection commits; no disk access needed."""
+    return (conn or get_conn()).execute('PRAGMA data_version').fetchone()[0]
+
+
+def mark():
+    """The current high-water mark."""
+    conn = get_conn()
+    return (conn.execute('SELECT ifnull(max(id), 0) FROM alteracoes').fetchone()[0],
+            conn.execute('SELECT ifnull(max(id), 0) FROM logs').fetchone()[0])
+
+
+def since(last):
+    """(new mark, {table: keys}) for the changes committed after mark ``last``.
+
+    Keys are listed per table, or None when there are more than MAX_KEYS or
+    the change log no longer reaches back to ``last`` (pruned, or the
+    database was restored); the caller should then reload that table.
+    """
+    last_change, last_log = last
+    conn = get_conn()
+    # Every query is bounded by the maximum read first, so commits landing
+    # in between are left for the next call rather than half reported.
+    low, high = conn.execute('SELECT min(id), ifnull(max(id), 0) FROM alteracoes').fetchone()
+    log_high = conn.execute('SELECT ifnull(max(id), 0) FROM logs').fetchone()[0]
+    changed = {}
+    if high < last_change or (low is not None and low > last_change + 1):
+        changed = dict.fromkeys(TRACKED)
+    elif high > last_change:
+        counts = conn.execute('SELECT tabela, count(DISTINCT chave) FROM alteracoes WHERE id > ? AND id <= ? '
+                              'GROUP BY tabela', (last_change, high)).fetchall()
+        for table, count in counts:
+            changed[table] = None if count > MAX_KEYS else [
+                key for key, in conn.execute('SELECT DISTINCT chave FROM alteracoes '
+                                             'WHERE id > ? AND id <= ? AND tabela = ?', (last_change, high, table))]
+    if log_high < last_log or log_high - last_log > MAX_KEYS:
+        changed['logs'] = None
+    elif log_high > last_log:
+        changed['logs'] = [key for key, in conn.execute('SELECT id FROM logs WHERE id > ? AND id <= ?',
+                                                        (last_log, log_high))]
+    return (high, log_high), changed
+
+
+def prune(keep=KEEP):
+    """Drop all but the newest ``keep`` entries; returns how many went."""
+    with transaction() as conn:
+        return conn.execute('DELETE FROM alteracoes WHERE id <= (SELECT max(id) FROM alteracoes) - ?',
+                            (keep,)).rowcount
@@ -0,0 +1,200 @@
+# Client side of the data server: stand-ins for the modules the tabs call
+import itertools
+import json
+import socket
+import sqlite3
+import threading
+
+import store
+import workers
+from cep import CepNotFound
+from importer import ImportResult, parse_file, screen_records
+from refdata import REFERENCE_TABLES, cache as refcache
+
+TIMEOUT = 30
+
+# Exceptions the tabs handle specifically are re-raised as the same type.
+ERRORS = {
+    'ValueError': ValueError,
+    'KeyError': KeyError,
+    'IntegrityError': sqlite3.IntegrityError,
+    'CepNotFound': CepNotFound,
+    'PermissionError': PermissionError,
+}
+
+
+class RemoteError(Exception):
+    pass
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Client:
+    """Blocking JSON-lines client; each thread gets its own connection.
+
+    After login() every connection, including those other threads open
+    later, resumes the session with the token the server returned.
+    """
+
+    def __init__(self, host, port, timeout=TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.token = None
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    def _stream(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            stream = self._local.stream = sock.makefile('rwb')
+            self._local.token = None
+        if self.token is not None and self._local.token != self.token:
+            self._exchange(stream, 'session.resume', self.token)
+            self._local.token = self.token
+        return stream
+
+    def _exchange(self, stream, op, *args, **kwargs):
+        stream.write(json.dumps({'id': next(self._ids), 'op': op, 'args': args, 'kwargs': kwargs},
+                                ensure_ascii=False).encode() + b'\n')
+        stream.flush()
+        return self._result(stream.readline())
+
+    def _result(self, line):
+        if not line:
+            self._drop()
+            raise ConnectionError('O servidor de dados encerrou a conexão')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ERRORS.get(reply.get('type'), RemoteError)(reply['error'])
+        return reply['result']
+
+    def login(self, username, password):
+        """Open a session as ``username``; False when the password is wrong."""
+        token = self.call('session.login', username, password)
+        if token is None:
+            return False
+        self.token = self._local.token = token
+        return True
+
+    def _drop(self):
+        stream = getattr(self._local, 'stream', None)
+        self._local.stream = None
+        if stream is not None:
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def call(self, op, *args, **kwargs):
+        request = json.dumps({'id': next(self._ids), 'op': op, 'args': args, 'kwargs': kwargs},
+                             ensure_ascii=False).encode() + b'\n'
+        reused = getattr(self._local, 'stream', None) is not None
+        try:
+            stream = self._stream()
+            try:
+                stream.write(request)
+                stream.flush()
+            except OSError:
+                if not reused:
+                    raise
+                # The server dropped an idle connection before reading
+                # anything, so sending again cannot repeat the operation.
+                self._drop()
+                stream = self._stream()
+                stream.write(request)
+                stream.flush()
+            line = stream.readline()
+        except OSError as e:
+            self._drop()
+            raise ConnectionError(f'Servidor de dados indisponível: {e}') from e
+        return self._result(line)
+
+    def close(self):
+        self._drop()
+
+
+class RemoteModule:
+    """Calls ``prefix.name`` on the server for each attribute in ``ops``;
+    anything else (constants, views) comes from the local ``module``."""
+
+    def __init__(self, client, prefix, module, ops):
+        self._client = client
+        self._prefix = prefix
+        self._module = module
+        self._ops = set(ops)
+
+    def __getattr__(self, name):
+        if name in self._ops:
+            op = f'{self._prefix}.{name}'
+            return lambda *args, **kwargs: self._client.call(op, *args, **kwargs)
+        return getattr(self._module, name)
+
+
+class RemoteStore(RemoteModule):
+    OPS = ('fetch_page', 'fetch_row', 'fetch_cadastro', 'search_matriculas', 'add_cadastro', 'update_cadastro',
+           'add_financeiro', 'add_user', 'recover_password', 'add_attachment', 'fetch_attachment')
+
+    def __init__(self, client):
+        super().__init__(client, 'store', store, self.OPS)
+
+    def check_login(self, username, password):
+        # Logging in also opens this workstation's session on the server.
+        return self._client.login(username, password)
+
+    def add_crud(self, table, record):
+        # Keep this workstation's reference cache current, as store.add_crud does.
+        row = self._client.call('store.add_crud', table, record)
+        if table in REFERENCE_TABLES:
+            refcache.update(table, row[0], row[1])
+        return row
+
+
+class RemoteAudit:
+    """AuditWriter stand-in: the server queues and batches the entries."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def log(self, user, action, table_name, record_id):
+        self.client.call('audit.log', user, action, table_name, str(record_id))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RemoteImporter:
+    """Parses the spreadsheet locally and sends the rows in one request."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def import_file(self, path, progress=None):
+        records, errors, lines = parse_file(path)
+        records, warnings = screen_records(records, lines, errors,
+                                           lambda rows: self.client.call('dedupe.screen', rows))
+        if progress is not None:
+            progress(0, len(records))
+        inserted = self.client.call('importer.insert_records', records)
+        if progress is not None:
+            progress(len(records), len(records))
+        return ImportResult(inserted, errors, warnings)
+
+
+class RemoteCepService:
+    def __init__(self, client):
+        self.client = client
+
+    def lookup(self, cep):
+        return self.client.call('cep.lookup', cep)
+
+    def lookup_async(self, cep, callback, errback):
+        return workers.submit(self.lookup, cep, callback=callback, errback=errback)
@@ -0,0 +1,111 @@
+# Shared SQLite connection layer for the school app
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'school.db')
+
+# Tuning applied to every connection we open. WAL lets readers proceed while a
+# writer commits, and synchronous=NORMAL is durable across application crashes
+# in WAL mode while avoiding an fsync on every commit.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -32000),       # ~32 MB page cache
+    ('mmap_size', 268435456),     # 256 MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+STATEMENT_CACHE_SIZE = 256
+# Connection class used by connect(); diagnostics swaps in a timing subclass.
+connection_factory = sqlite3.Connection
+
+_local = threading.local()
+_lock = threading.Lock()
+_open_conns = set()
+_generation = 0
+
+
+def connect(path=None):
+    """Open a new tuned connection. Most callers want get_conn() instead."""
+    conn = sqlite3.connect(path or DB_PATH, cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False, factory=connection_factory)
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+def get_conn():
+    """Return this thread's persistent connection, opening it on first use.
+
+    sqlite3 keeps a per-connection cache of prepared statements, so reusing
+    one connection per thread also means repeated queries skip re-parsing.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'generation', None) != _generation:
+        conn = connect()
+        _local.conn = conn
+        _local.generation = _generation
+        with _lock:
+            _open_conns.add(conn)
+    return conn
+
+
+def set_db_path(path):
+    """Point the app at another database file, closing existing connections."""
+    global DB_PATH
+    close_all()
+    DB_PATH = path
+
+
+def close_all():
+    """Close every connection handed out by get_conn(), on any thread."""
+    global _generation
+    with _lock:
+        conns = list(_open_conns)
+        _open_conns.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+
+
+@contextmanager
+def transaction(conn=None):
+    """Commit on success and roll back on error, like ``with conn:``.
+
+    Inside batch() the write becomes a savepoint instead, so a failing
+    operation is undone on its own and the whole batch commits once.
+    """
+    conn = conn or get_conn()
+    if not getattr(_local, 'batch', False):
+        with conn:
+            yield conn
+        return
+    conn.execute('SAVEPOINT op')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK TO op')
+        conn.execute('RELEASE op')
+        raise
+    conn.execute('RELEASE op')
+
+
+@contextmanager
+def batch():
+    """Group the transaction() writes made on this thread into one commit."""
+    conn = get_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    _local.batch = True
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _local.batch = False
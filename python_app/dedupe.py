@@ -0,0 +1,294 @@
+# Duplicate students: candidate lookup through blocking keys, fuzzy scoring
+#
+# Comparing a student with every other one is quadratic, so each cadastro row
+# gets a few blocking keys in cadastro_chaves (schema migration 12): its
+# normalized full name, and each name token combined with the birth date and
+# with the phone. Only students sharing a key are scored. The CPF needs no
+# scoring: cadastro.cpf_norm holds its digits under a unique index.
+import difflib
+import unicodedata
+from collections import defaultdict, namedtuple
+
+from db import get_conn, transaction
+
+# Name particles too common to tell two students apart.
+PARTICLES = frozenset({'de', 'da', 'do', 'das', 'dos', 'di', 'du', 'del', 'e'})
+# A score weighs name similarity, then an equal birth date and phone.
+NAME_WEIGHT, BIRTH_WEIGHT, PHONE_WEIGHT = 0.7, 0.2, 0.1
+# The form warns about any exact name; imports and the report also need a
+# birth date or phone in common, or they would list every common name.
+THRESHOLD = NAME_WEIGHT
+BATCH_THRESHOLD = 0.75
+# Keys shared by more students than this (a very common name on its own) are
+# ignored: they would cost many comparisons and say little.
+MAX_BLOCK = 50
+CHUNK_SIZE = 5000
+# The reason given when the CPF digits match; name, birth date and phone
+# together also score 1.0, so only this reason means "already registered".
+SAME_CPF = 'mesmo CPF'
+
+Student = namedtuple('Student', 'matricula nome data_nascimento tel_principal cpf')
+Candidate = namedtuple('Candidate', 'matricula nome score motivos')
+
+_COLUMNS = ', '.join(Student._fields)
+
+
+def cpf_digits(cpf):
+    """The CPF as schema._digits() stores it in cpf_norm."""
+    cpf = cpf or ''
+    for ch in '.-()/ ':
+        cpf = cpf.replace(ch, '')
+    return cpf
+
+
+def name_tokens(nome):
+    text = unicodedata.normalize('NFKD', nome or '').encode('ascii', 'ignore').decode().lower()
+    words = ''.join(ch if ch.isalnum() else ' ' for ch in text).split()
+    return [w for w in words if len(w) > 1 and w not in PARTICLES]
+
+
+def _digits(text):
+    return ''.join(filter(str.isdigit, text or ''))
+
+
+def _birth(student):
+    digits = _digits(student.data_nascimento)
+    return digits if len(digits) == 8 else ''
+
+
+def _phone(student):
+    # The last 8 digits, so numbers with and without the area code or the
+    # leading 9 still match.
+    digits = _digits(student.tel_principal)
+    return digits[-8:] if len(digits) >= 8 else ''
+
+
+def keys(student):
+    """The blocking keys of a student."""
+    tokens = name_tokens(student.nome)
+    if not tokens:
+        return set()
+    found = {'n:' + ' '.join(tokens)}
+    birth, phone = _birth(student), _phone(student)
+    for token in tokens:
+        if birth:
+            found.add(f'd:{token}:{birth}')
+        if phone:
+            found.add(f't:{token}:{phone}')
+    return found
+
+
+def _prepare(student):
+    """What score() compares, computed once per student in a batch."""
+    tokens = name_tokens(student.nome)
+    return cpf_digits(student.cpf), ' '.join(tokens), ' '.join(sorted(tokens)), _birth(student), _phone(student)
+
+
+def score(a, b, threshold=0.0):
+    """(score from 0 to 1, reasons) for two students being the same person.
+
+    Pairs that cannot reach ``threshold`` may be cut short with a lower score.
+    """
+    return _score(_prepare(a), _prepare(b), threshold)
+
+
+def _score(a, b, threshold):
+    cpf, name_a, sorted_a, birth, phone = a
+    other_cpf, name_b, sorted_b, other_birth, other_phone = b
+    if cpf and cpf == other_cpf:
+        return 1.0, [SAME_CPF]
+    total, reasons = 0.0, []
+    if birth and birth == other_birth:
+        total += BIRTH_WEIGHT
+        reasons.append('mesma data de nascimento')
+    if phone and phone == other_phone:
+        total += PHONE_WEIGHT
+        reasons.append('mesmo telefone')
+    # Also compare with the tokens sorted, for names typed in another order.
+    if sorted_a == sorted_b:
+        similarity = 1.0
+    else:
+        matcher = difflib.SequenceMatcher(None, name_a, name_b)
+        # Both quick ratios bound ratio() in either token order.
+        if (total + NAME_WEIGHT * matcher.real_quick_ratio() < threshold
+                or total + NAME_WEIGHT * matcher.quick_ratio() < threshold):
+            return round(total, 3), reasons
+        similarity = max(matcher.ratio(), difflib.SequenceMatcher(None, sorted_a, sorted_b).ratio())
+    reasons.insert(0, f'nome {similarity:.0%} igual')
+    return round(total + NAME_WEIGHT * similarity, 3), reasons
+
+
+def _fetch(conn, matriculas):
+    matriculas = list(matriculas)
+    students = {}
+    for start in range(0, len(matriculas), CHUNK_SIZE):
+        chunk = matriculas[start:start + CHUNK_SIZE]
+        for row in conn.execute(f'SELECT {_COLUMNS} FROM cadastro WHERE matricula IN ({", ".join("?" * len(chunk))})',
+                                chunk):
+            students[row[0]] = Student(*row)
+    return students
+
+
+def _blocked(conn, student, threshold):
+    """Matriculas sharing the CPF or a (not too common) key with ``student``."""
+    found = set()
+    cpf = cpf_digits(student.cpf)
+    if cpf:
+        found.update(m for m, in conn.execute('SELECT matricula FROM cadastro WHERE cpf_norm = ?', (cpf,)))
+    wanted = [key for key in keys(student) if threshold <= NAME_WEIGHT or not key.startswith('n:')]
+    if wanted:
+        blocks = defaultdict(list)
+        for key, matricula in conn.execute('SELECT chave, matricula FROM cadastro_chaves WHERE chave IN '
+                                           f'({", ".join("?" * len(wanted))})', wanted):
+            blocks[key].append(matricula)
+        for members in blocks.values():
+            if len(members) <= MAX_BLOCK:
+                found.update(members)
+    found.discard(student.matricula)
+    return found
+
+
+def candidates(record, matricula=None, threshold=THRESHOLD, limit=10):
+    """Students that ``record`` (a cadastro dict) may duplicate, best first.
+
+    ``matricula`` is the record's own, when editing an existing student.
+    """
+    conn = get_conn()
+    student = Student(matricula, *(record.get(f) for f in Student._fields[1:]))
+    found = []
+    for other in _fetch(conn, _blocked(conn, student, threshold)).values():
+        value, reasons = score(student, other, threshold)
+        if value >= threshold:
+            found.append(Candidate(other.matricula, other.nome, value, reasons))
+    found.sort(key=lambda c: -c.score)
+    return found[:limit]
+
+
+def screen(rows, threshold=BATCH_THRESHOLD):
+    """Check import rows of [nome, data_nascimento, tel_principal, cpf].
+
+    Returns (rejected, warnings), both [(row index, message)]: rejected rows
+    repeat a CPF already registered or seen earlier in the file, warnings
+    look like a student already there or earlier in the file. Each row costs
+    a few index lookups, so this stays linear in the size of the file.
+    """
+    conn = get_conn()
+    students = [Student(None, *row) for row in rows]
+    prepared = [_prepare(s) for s in students]
+    rejected, warnings = [], []
+    seen_cpf = {}
+    seen_keys = defaultdict(list)
+    for index, student in enumerate(students):
+        cpf = cpf_digits(student.cpf)
+        if cpf:
+            known = conn.execute('SELECT matricula, nome FROM cadastro WHERE cpf_norm = ?', (cpf,)).fetchone()
+            if known:
+                rejected.append((index, f'CPF já cadastrado na matrícula {known[0]} ({known[1]})'))
+                continue
+            if cpf in seen_cpf:
+                rejected.append((index, f'CPF repetido na planilha ({students[seen_cpf[cpf]].nome})'))
+                continue
+            seen_cpf[cpf] = index
+        best = (0, None)
+        for other in _fetch(conn, _blocked(conn, student, threshold)).values():
+            best = max(best, (_score(prepared[index], _prepare(other), threshold)[0],
+                              f'matrícula {other.matricula} ({other.nome})'))
+        student_keys = keys(student)
+        for i in {i for key in student_keys if threshold <= NAME_WEIGHT or not key.startswith('n:')
+                  for i in seen_keys[key][:MAX_BLOCK]}:
+            best = max(best, (_score(prepared[index], prepared[i], threshold)[0],
+                              f'{students[i].nome}, também na planilha'))
+        if best[0] >= threshold:
+            warnings.append((index, f'Possível duplicado de {best[1]}: {best[0]:.0%}'))
+        for key in student_keys:
+            seen_keys[key].append(index)
+    return rejected, warnings
+
+
+def report(threshold=BATCH_THRESHOLD):
+    """Likely duplicate pairs already in cadastro, best first.
+
+    Returns [(score, matricula, nome, other matricula, other nome, reasons)].
+    Only students sharing a CPF or a blocking key are compared, so the work
+    grows with the number of students rather than with its square.
+    """
+    conn = get_conn()
+    pairs = set()
+    # Rows that already shared a CPF before migration 12 were left without
+    # cpf_norm; the first of each group holds it.
+    legacy = defaultdict(list)
+    for matricula, cpf in conn.execute("SELECT matricula, cpf FROM cadastro WHERE cpf_norm IS NULL AND cpf <> ''"):
+        if cpf_digits(cpf):
+            legacy[cpf_digits(cpf)].append(matricula)
+    for cpf, members in legacy.items():
+        members.extend(m for m, in conn.execute('SELECT matricula FROM cadastro WHERE cpf_norm = ?', (cpf,)))
+        members.sort()
+        pairs.update((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+    # Above NAME_WEIGHT a pair must share a birth date or phone, and so a
+    # d: or t: key; the (larger) name-only blocks can be skipped. _blocked()
+    # and screen() do the same.
+    where = "WHERE chave NOT LIKE 'n:%'" if threshold > NAME_WEIGHT else ''
+    members, last = [], None
+    # The primary key order (no sort needed) reads each block in one run.
+    for key, matricula in conn.execute(f'SELECT chave, matricula FROM cadastro_chaves {where} ORDER BY chave'):
+        if key != last:
+            _pairs(members, pairs)
+            members, last = [], key
+        members.append(matricula)
+    _pairs(members, pairs)
+    students = _fetch(conn, {m for pair in pairs for m in pair})
+    prepared = {m: _prepare(s) for m, s in students.items()}
+    found = []
+    for a, b in pairs:
+        value, reasons = _score(prepared[a], prepared[b], threshold)
+        if value >= threshold:
+            found.append((value, a, students[a].nome, b, students[b].nome, reasons))
+    found.sort(key=lambda f: (-f[0], f[1], f[3]))
+    return found
+
+
+def _pairs(members, pairs):
+    if 1 < len(members) <= MAX_BLOCK:
+        members.sort()
+        pairs.update((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+
+
+def index(conn, students):
+    """Add the blocking keys of ``students`` (with their matricula)."""
+    conn.executemany('INSERT OR IGNORE INTO cadastro_chaves(chave, matricula) VALUES (?, ?)',
+                     ((key, s.matricula) for s in students for key in keys(s)))
+
+
+def reindex(conn, matriculas):
+    """Recompute the keys of existing students after an edit."""
+    conn.executemany('DELETE FROM cadastro_chaves WHERE matricula = ?', ((m,) for m in matriculas))
+    index(conn, _fetch(conn, matriculas).values())
+
+
+def index_after(conn, last):
+    """Index the students with a matricula above ``last`` (a bulk insert)."""
+    rows = conn.execute(f'SELECT {_COLUMNS} FROM cadastro WHERE matricula > ?', (last,))
+    while chunk := rows.fetchmany(CHUNK_SIZE):
+        index(conn, (Student(*row) for row in chunk))
+
+
+def backfill():
+    """Fill cadastro_chaves for a database migrated with students already in
+    it; a quick no-op afterwards. Returns the number of keys written."""
+    conn = get_conn()
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM cadastro_chaves) "
+                    "OR NOT EXISTS (SELECT 1 FROM cadastro WHERE nome <> '')").fetchone()[0]:
+        return 0
+    with transaction(conn):
+        index_after(conn, 0)
+    return conn.execute('SELECT count(*) FROM cadastro_chaves').fetchone()[0]
+
+
+if __name__ == '__main__':
+    import sys
+    import db
+    if len(sys.argv) > 1:
+        db.set_db_path(sys.argv[1])
+    backfill()
+    for value, a, nome_a, b, nome_b, reasons in report():
+        print(f'{value:.0%}\t{a}\t{nome_a}\t{b}\t{nome_b}\t{", ".join(reasons)}')
@@ -0,0 +1,259 @@
+# Opt-in timing of SQL statements, UI handlers and Tk event-loop stalls
+import bisect
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import sqlite3
+import threading
+import time
+from tkinter import TclError
+
+import db
+
+LOG_PATH = os.path.join(os.path.dirname(__file__), 'diagnostics.log')
+# Set SCHOOL_DIAGNOSTICS=1 to have the app call enable() at startup.
+REQUESTED = os.environ.get('SCHOOL_DIAGNOSTICS', '') not in ('', '0')
+ENABLED = False
+
+# Histogram bucket upper bounds, in milliseconds (the last bucket is open).
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_MS = {'sql': 50, 'handler': 100, 'layout': 100, 'stall': 200}
+HEARTBEAT_MS = 100
+DUMP_INTERVAL_S = 60
+
+log = logging.getLogger('school_app.diagnostics')
+log.propagate = False
+
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        target = self.count * p / 100
+        seen = 0
+        for bound, n in zip(BUCKETS_MS + (self.max_ms,), self.counts):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self):
+        return {'count': self.count, 'total_ms': round(self.total_ms, 3), 'max_ms': round(self.max_ms, 3),
+                'buckets': self.counts}
+
+
+class Recorder:
+    """Per-(kind, name) histograms, shared by every thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self._dirty = False
+
+    def record(self, kind, name, ms):
+        with self._lock:
+            hist = self.histograms.get((kind, name))
+            if hist is None:
+                hist = self.histograms[(kind, name)] = Histogram()
+            hist.add(ms)
+            self._dirty = True
+        if ms >= SLOW_MS.get(kind, float('inf')):
+            log.warning(json.dumps({'slow': kind, 'name': name, 'ms': round(ms, 3)}, ensure_ascii=False))
+
+    def top(self, n=50):
+        """(kind, name, count, total, mean, p95, max) by total time, largest first."""
+        with self._lock:
+            items = list(self.histograms.items())
+        rows = [(kind, name, h.count, h.total_ms, h.total_ms / h.count, h.percentile(95), h.max_ms)
+                for (kind, name), h in items]
+        return sorted(rows, key=lambda r: r[3], reverse=True)[:n]
+
+    def dump(self):
+        """Write all histograms to the log as one JSON line, if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {f'{kind}:{name}': h.as_dict() for (kind, name), h in self.histograms.items()}
+        log.info(json.dumps({'buckets_ms': BUCKETS_MS, 'histograms': data}, ensure_ascii=False))
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self._dirty = False
+
+
+recorder = Recorder()
+
+
+def _statement(sql):
+    return ' '.join(sql.split())[:200]
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Accumulates the time spent executing a statement and stepping its rows.
+
+    The total is recorded once the rows are exhausted, the cursor is reused
+    or closed, or it is garbage collected.
+    """
+    _sql = None
+    _elapsed = 0.0
+
+    def _finish(self):
+        if self._sql is not None:
+            ms = self._elapsed * 1000
+            recorder.record('sql', self._sql, ms)
+            _local.sql_ms = getattr(_local, 'sql_ms', 0.0) + ms
+            self._sql = None
+
+    def _timed(self, method, *args):
+        t0 = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - t0
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._elapsed = _statement(sql), 0.0
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        self._sql, self._elapsed = _statement(sql), 0.0
+        result = self._timed(super().executemany, sql, seq_of_parameters)
+        self._finish()
+        return result
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute() does not go through cursor(), so route it here.
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def timed(fn):
+    """Record a UI handler's duration, its SQL share and the layout after it.
+
+    A no-op wrapper unless instrumentation is enabled.
+    """
+    name = fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if not ENABLED:
+            return fn(self, *args, **kwargs)
+        sql_before = getattr(_local, 'sql_ms', 0.0)
+        t0 = time.perf_counter()
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            ms = (end - t0) * 1000
+            recorder.record('handler', name, ms)
+            # 'ui' is the handler time not spent in SQL: Python and Treeview work.
+            recorder.record('ui', name, ms - (getattr(_local, 'sql_ms', 0.0) - sql_before))
+            # Geometry and redraw run as idle callbacks queued by the handler,
+            # so an idle callback queued now runs right after them.
+            try:
+                self.after_idle(lambda: recorder.record('layout', name, (time.perf_counter() - end) * 1000))
+            except TclError:
+                pass    # the handler destroyed its window
+    return wrapper
+
+
+class Heartbeat:
+    """Detects event-loop stalls: an after() tick that fires late means the
+    Tk thread was busy for the difference."""
+
+    def __init__(self, root, interval_ms=HEARTBEAT_MS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.last_dump = time.monotonic()
+        self.expected = time.perf_counter() + interval_ms / 1000
+        root.after(interval_ms, self.tick)
+
+    def tick(self):
+        now = time.perf_counter()
+        lag_ms = max(0.0, (now - self.expected) * 1000)
+        recorder.record('stall', 'Tk event loop', lag_ms)
+        if time.monotonic() - self.last_dump >= DUMP_INTERVAL_S:
+            recorder.dump()
+            self.last_dump = time.monotonic()
+        self.expected = now + self.interval_ms / 1000
+        self.root.after(self.interval_ms, self.tick)
+
+
+def enable(path=LOG_PATH):
+    """Turn instrumentation on: later connections are timed and handlers recorded."""
+    global ENABLED
+    ENABLED = True
+    if not log.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=1_000_000, backupCount=3, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+    db.connection_factory = TimedConnection
+    db.close_all()
+
+
+def watch(root):
+    """Start the stall detector on ``root`` if instrumentation is enabled."""
+    return Heartbeat(root) if ENABLED else None
+
+
+def shutdown():
+    if ENABLED:
+        recorder.dump()
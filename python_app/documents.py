@@ -0,0 +1,294 @@
+# Enrollment declarations and payment receipts, rendered in batches
+#
+# The documents to print are picked here (a turma, a month or a list of
+# keys) and split into chunks that a pool of worker processes renders, so a
+# large batch uses every core while the app stays responsive. Each worker
+# opens the database read-only and writes its documents straight to disk,
+# one file per student or payment.
+import datetime
+import html
+import multiprocessing
+import os
+import pathlib
+import re
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from string import Template
+
+import db
+from schema import iso_date, iso_text
+
+CHUNK_SIZE = 50         # documents per worker task
+FORMATS = ('pdf', 'html')
+SCHOOL_NAME = os.environ.get('SCHOOL_NAME', 'Escola')
+SCHOOL_CITY = os.environ.get('SCHOOL_CITY', '')
+# <kind>.html files here replace the built-in HTML layout; they may use
+# $titulo, $corpo, $escola, $cidade, $data and any column of the document's row.
+TEMPLATES_DIR = os.environ.get('SCHOOL_TEMPLATES_DIR')
+
+_PAID = "trim(ifnull(f.forma_pagamento, '')) <> ''"
+
+# rows: the document's data for a list of keys; by_turma/by_month: its keys.
+Kind = namedtuple('Kind', 'label key rows by_turma by_month')
+
+KINDS = {
+    'declaracao': Kind(
+        'Declaração de matrícula', 'matricula',
+        '''SELECT c.matricula, c.nome, c.data_nascimento, c.cpf, c.responsavel, c.data_matricula,
+                  t.nome AS turma, t.horario, cu.nome AS curso
+           FROM cadastro c LEFT JOIN turmas t ON t.id = c.turma_id LEFT JOIN cursos cu ON cu.id = c.curso_id
+           WHERE c.matricula IN ({})''',
+        'SELECT matricula FROM cadastro WHERE turma_id = ? ORDER BY nome, matricula',
+        f"SELECT matricula FROM cadastro WHERE substr({iso_date('data_matricula')}, 1, 7) = ? ORDER BY matricula"),
+    'recibo': Kind(
+        'Recibo de pagamento', 'id',
+        '''SELECT f.id, f.matricula, c.nome, c.cpf, c.responsavel, f.valor, f.vencimento, f.forma_pagamento,
+                  f.competencia
+           FROM financeiro f LEFT JOIN cadastro c ON c.matricula = f.matricula
+           WHERE f.id IN ({})''',
+        f'''SELECT f.id FROM financeiro f JOIN cadastro c ON c.matricula = f.matricula
+            WHERE c.turma_id = ? AND {_PAID} ORDER BY f.id''',
+        f"SELECT f.id FROM financeiro f WHERE substr({iso_date('f.vencimento')}, 1, 7) = ? AND {_PAID} ORDER BY f.id"),
+}
+
+HTML = Template('''<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<title>$titulo</title>
+<style>
+body { font-family: sans-serif; max-width: 40em; margin: 3em auto; line-height: 1.5; }
+h1 { font-size: 1.4em; text-align: center; margin-bottom: 2em; }
+.assinatura { margin-top: 5em; text-align: center; }
+</style>
+</head>
+<body>
+<h1>$titulo</h1>
+$corpo
+<p>$cidade$data</p>
+<p class="assinatura">______________________________<br>$escola</p>
+</body>
+</html>
+''')
+
+
+def _money(value):
+    try:
+        text = f'{float(value):,.2f}'
+    except (TypeError, ValueError):
+        return str(value or '')
+    return 'R$ ' + text.replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def _date(text):
+    """dd/mm/yyyy for an ISO date; anything else as typed."""
+    match = re.fullmatch(r'(\d{4})-(\d{2})-(\d{2})', (text or '')[:10])
+    return f'{match[3]}/{match[2]}/{match[1]}' if match else (text or '')
+
+
+def _month(row):
+    """mm/yyyy billed by a charge: its competencia, or else its due month."""
+    month = row['competencia'] or (iso_text(row['vencimento']) or '')[:7]
+    return f'{month[5:7]}/{month[:4]}' if len(month) == 7 else ''
+
+
+def content(kind, row):
+    """(title, paragraphs) of one document."""
+    if kind == 'declaracao':
+        who = row['nome'] or ''
+        if row['data_nascimento']:
+            who += f", nascido(a) em {row['data_nascimento']}"
+        if row['cpf']:
+            who += f", CPF {row['cpf']}"
+        course = f" no curso {row['curso']}" if row['curso'] else ''
+        if row['turma']:
+            course += f", turma {row['turma']}" + (f" ({row['horario']})" if row['horario'] else '')
+        since = f", desde {_date(row['data_matricula'])}" if row['data_matricula'] else ''
+        return KINDS[kind].label, [
+            f"Declaramos, para os devidos fins, que {who}, está regularmente matriculado(a) nesta "
+            f"instituição sob a matrícula nº {row['matricula']}{since}{course}.",
+        ]
+    payer = row['responsavel'] or row['nome'] or ''
+    month = _month(row)
+    return f"Recibo nº {row['id']}", [
+        f"Recebemos de {payer} a importância de {_money(row['valor'])}"
+        + (f" referente à mensalidade de {month}" if month else '')
+        + f" do(a) aluno(a) {row['nome'] or ''}, matrícula nº {row['matricula']}.",
+        f"Forma de pagamento: {row['forma_pagamento'] or ''}. Vencimento: {_date(row['vencimento'])}.",
+    ]
+
+
+_templates = {}
+
+
+def _template(kind):
+    if kind not in _templates:
+        path = TEMPLATES_DIR and os.path.join(TEMPLATES_DIR, f'{kind}.html')
+        if path and os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                _templates[kind] = Template(f.read())
+        else:
+            _templates[kind] = HTML
+    return _templates[kind]
+
+
+def render_html(kind, row, path):
+    title, paragraphs = content(kind, row)
+    fields = {name: html.escape(str(row[name] if row[name] is not None else '')) for name in row.keys()}
+    fields.update(
+        titulo=html.escape(title),
+        corpo='\n'.join(f'<p>{html.escape(p)}</p>' for p in paragraphs),
+        escola=html.escape(SCHOOL_NAME),
+        cidade=html.escape(f'{SCHOOL_CITY}, ') if SCHOOL_CITY else '',
+        data=datetime.date.today().strftime('%d/%m/%Y'),
+    )
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(_template(kind).safe_substitute(fields))
+
+
+def render_pdf(kind, row, path):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfgen import canvas
+    title, paragraphs = content(kind, row)
+    width, height = A4
+    margin = 72
+    pdf = canvas.Canvas(path, pagesize=A4)
+    pdf.setTitle(title)
+    y = height - 2 * margin
+    pdf.setFont('Helvetica-Bold', 16)
+    pdf.drawCentredString(width / 2, y, title)
+    y -= 48
+    pdf.setFont('Helvetica', 12)
+    for paragraph in paragraphs:
+        for line in simpleSplit(paragraph, 'Helvetica', 12, width - 2 * margin):
+            pdf.drawString(margin, y, line)
+            y -= 18
+        y -= 12
+    place = f'{SCHOOL_CITY}, ' if SCHOOL_CITY else ''
+    pdf.drawString(margin, y - 12, place + datetime.date.today().strftime('%d/%m/%Y'))
+    pdf.line(width / 2 - 120, y - 96, width / 2 + 120, y - 96)
+    pdf.drawCentredString(width / 2, y - 112, SCHOOL_NAME)
+    pdf.showPage()
+    pdf.save()
+
+
+RENDERERS = {'html': render_html, 'pdf': render_pdf}
+
+
+def file_name(kind, key, fmt):
+    return f'{kind}-{key}.{fmt}'
+
+
+def select(kind, turma=None, mes=None):
+    """Keys of the documents for a turma id or a 'yyyy-mm' month.
+
+    Receipts are only selected for charges that were paid.
+    """
+    spec = KINDS[kind]
+    if turma is not None:
+        sql, param = spec.by_turma, turma
+    elif mes is not None:
+        if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', mes):
+            raise ValueError(f'Mês inválido: {mes!r} (use aaaa-mm)')
+        sql, param = spec.by_month, mes
+    else:
+        raise ValueError('Escolha uma turma ou um mês')
+    return [key for key, in db.get_conn().execute(sql, (param,))]
+
+
+# --- worker processes ---
+_conn = None
+
+
+def _init_worker(path):
+    global _conn
+    _conn = sqlite3.connect(pathlib.Path(path).absolute().as_uri() + '?mode=ro', uri=True)
+    _conn.row_factory = sqlite3.Row
+
+
+def _render_chunk(kind, keys, directory, fmt):
+    """Render the documents of ``keys``; returns how many were written."""
+    spec = KINDS[kind]
+    rows = _conn.execute(spec.rows.format(', '.join('?' * len(keys))), keys).fetchall()
+    for row in rows:
+        path = os.path.join(directory, file_name(kind, row[spec.key], fmt))
+        tmp = path + '.part'
+        try:
+            RENDERERS[fmt](kind, row, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return len(rows)
+
+
+def generate(kind, directory, fmt='pdf', turma=None, mes=None, keys=None, progress=None, cancel=None,
+             max_workers=None):
+    """Write one document per student or payment into ``directory``.
+
+    The documents are those of ``keys``, or else of select(kind, turma, mes).
+    Chunks of CHUNK_SIZE are rendered by up to ``max_workers`` processes (all
+    cores by default). ``progress(done, total)`` is called from this thread
+    as chunks finish; setting the ``cancel`` event stops after the chunks
+    already running. Blocks; call off the UI thread. Returns the number of
+    documents written.
+    """
+    if kind not in KINDS:
+        raise ValueError(f'Documento desconhecido: {kind}')
+    if fmt not in FORMATS:
+        raise ValueError(f'Formato não suportado: {fmt}')
+    if fmt == 'pdf':
+        try:
+            import reportlab  # noqa: F401
+        except ImportError:
+            raise ValueError('Instale o pacote reportlab para gerar PDF, ou escolha HTML')
+    keys = list(keys) if keys is not None else select(kind, turma, mes)
+    if progress is not None:
+        progress(0, len(keys))
+    if not keys:
+        return 0
+    os.makedirs(directory, exist_ok=True)
+    chunks = [keys[i:i + CHUNK_SIZE] for i in range(0, len(keys), CHUNK_SIZE)]
+    done = 0
+    # spawn rather than fork: the app's threads (Tk, workers, audit) must not
+    # be copied mid-flight into the children.
+    with ProcessPoolExecutor(min(max_workers or os.cpu_count() or 1, len(chunks)),
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(os.path.abspath(db.DB_PATH),)) as pool:
+        futures = [pool.submit(_render_chunk, kind, chunk, directory, fmt) for chunk in chunks]
+        pending = set(futures)
+        try:
+            for future in as_completed(futures):
+                pending.discard(future)
+                done += future.result()
+                if progress is not None:
+                    progress(done, len(keys))
+                if cancel is not None and cancel.is_set():
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+    # After a cancel, chunks the pool had already started were still written.
+    return done + sum(f.result() for f in pending if not f.cancelled() and f.exception() is None)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Gera declarações de matrícula e recibos')
+    parser.add_argument('kind', choices=sorted(KINDS))
+    parser.add_argument('directory')
+    parser.add_argument('--db', help='arquivo do banco (padrão: school.db ao lado do programa)')
+    parser.add_argument('--format', choices=FORMATS, default='pdf')
+    parser.add_argument('--turma', type=int)
+    parser.add_argument('--mes', help='aaaa-mm')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+    if args.db:
+        db.set_db_path(args.db)
+    t0 = time.perf_counter()
+    count = generate(args.kind, args.directory, args.format, args.turma, args.mes, max_workers=args.workers,
+                     progress=lambda done, total: print(f'\r{done}/{total}', end='', flush=True))
+    print(f'\n{count} documentos em {time.perf_counter() - t0:.1f}s')
@@ -0,0 +1,156 @@
+# Streaming export of cadastro, financeiro and logs to CSV, JSON lines or XLSX
+import csv
+import datetime
+import json
+import os
+
+import retention
+from db import get_conn
+from schema import iso_date
+from store import CADASTRO_COLUMNS
+
+CHUNK_SIZE = 2000
+
+
+class Dataset:
+    def __init__(self, table, columns, date_column, date_expr=None, archived=False):
+        self.table = table
+        self.columns = columns
+        self.date_column = date_column
+        # Columns always stored as ISO text are compared directly so their
+        # indexes stay usable; free-form dates go through iso_date().
+        self.date_expr = date_expr or date_column
+        # Older rows live in retention's monthly archive tables.
+        self.archived = archived
+
+
+DATASETS = {
+    # The form stores ISO dates, but older and hand-edited rows may hold dd/mm/yyyy.
+    'cadastro': Dataset('cadastro', CADASTRO_COLUMNS, 'data_matricula', iso_date('data_matricula')),
+    'financeiro': Dataset('financeiro', ['id', 'matricula', 'valor', 'vencimento', 'forma_pagamento', 'anexo'],
+                          'vencimento', iso_date('vencimento')),
+    'logs': Dataset('logs', ['id', 'username', 'action', 'table_name', 'record_id', 'timestamp'], 'timestamp',
+                    archived=True),
+}
+
+FORMATS = ('.csv', '.jsonl', '.xlsx')
+
+
+def iter_rows(name, columns=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yield chunks of rows (lists of tuples) from one dataset.
+
+    ``start``/``end`` are inclusive datetime.date bounds on the dataset's date
+    column. Rows are pulled with fetchmany, so memory stays flat however
+    many rows match.
+    """
+    ds = DATASETS[name]
+    columns = columns or ds.columns
+    unknown = set(columns) - set(ds.columns)
+    if unknown:
+        raise ValueError(f'Colunas desconhecidas: {", ".join(sorted(unknown))}')
+    where, params = [], []
+    lower = start.isoformat() if start is not None else None
+    upper = (end + datetime.timedelta(days=1)).isoformat() if end is not None else None
+    if lower is not None:
+        where.append(f'{ds.date_expr} >= ?')
+        params.append(lower)
+    if upper is not None:
+        where.append(f'{ds.date_expr} < ?')
+        params.append(upper)
+    sql = f'SELECT {", ".join(columns)} FROM {ds.table}'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    yield from _chunks(sql, params, chunk_size)
+    if not ds.archived:
+        return
+    months = retention.archived_months(lower, upper)
+    if not months or not retention.attach_archive(get_conn()):
+        return
+    # A month being archived can briefly sit in both databases.
+    where.append(f'id NOT IN (SELECT id FROM main.{ds.table})')
+    for month in months:
+        sql = f'SELECT {", ".join(columns)} FROM archive.{retention.month_table(month)} WHERE ' + ' AND '.join(where)
+        yield from _chunks(sql, params, chunk_size)
+
+
+def _chunks(sql, params, chunk_size):
+    # A dedicated cursor on this thread's connection; WAL keeps the read
+    # snapshot consistent without blocking writers.
+    cur = get_conn().cursor()
+    try:
+        cur.execute(sql, params)
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        cur.close()
+
+
+def write_csv(f, columns, chunks):
+    writer = csv.writer(f, delimiter=';')
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield len(chunk)
+
+
+def write_jsonl(f, columns, chunks):
+    for chunk in chunks:
+        f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in chunk)
+        yield len(chunk)
+
+
+def write_xlsx(path, columns, chunks):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError('Instale o pacote openpyxl para exportar planilhas .xlsx')
+    # write_only workbooks stream rows to a temporary file instead of
+    # keeping every cell object in memory.
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(columns)
+    for chunk in chunks:
+        for row in chunk:
+            ws.append(row)
+        yield len(chunk)
+    wb.save(path)
+
+
+def export(name, path, columns=None, start=None, end=None, progress=None):
+    """Export a dataset to ``path``; the format follows the file extension.
+
+    The file is written under a temporary name and renamed at the end, so a
+    failed export never leaves a truncated file behind. ``progress(rows)`` is
+    called after each chunk. Returns the number of rows written.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f'Formato não suportado: {ext}')
+    columns = list(columns or DATASETS[name].columns)
+    chunks = iter_rows(name, columns, start, end)
+    tmp = path + '.part'
+    total = 0
+
+    def drain(counts):
+        nonlocal total
+        for n in counts:
+            total += n
+            if progress is not None:
+                progress(total)
+
+    try:
+        if ext == '.xlsx':
+            drain(write_xlsx(tmp, columns, chunks))
+        else:
+            with open(tmp, 'w', newline='', encoding='utf-8-sig' if ext == '.csv' else 'utf-8') as f:
+                drain((write_csv if ext == '.csv' else write_jsonl)(f, columns, chunks))
+        os.replace(tmp, path)
+    except BaseException:
+        chunks.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return total
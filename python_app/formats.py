@@ -0,0 +1,36 @@
+# Input masks and derived values shared by the forms and the importer
+import datetime
+
+DATE_MASK = '##/##/####'
+CPF_MASK = '###.###.###-##'
+PHONE_MASK = '(##) #####-####'
+CEP_MASK = '#####-###'
+
+
+def format_mask(text, pattern):
+    """Lay the digits of ``text`` out over ``pattern`` ('#' = one digit)."""
+    digits = ''.join(filter(str.isdigit, text))
+    result = ''
+    di = 0
+    for ch in pattern:
+        if ch == '#':
+            if di < len(digits):
+                result += digits[di]
+                di += 1
+            else:
+                break
+        else:
+            if di < len(digits):
+                result += ch
+            else:
+                break
+    return result
+
+
+def calc_idade(nasc, today=None):
+    try:
+        d = datetime.datetime.strptime(nasc, '%d/%m/%Y').date()
+        today = today or datetime.date.today()
+        return today.year - d.year - ((today.month, today.day) < (d.month, d.day))
+    except ValueError:
+        return 0
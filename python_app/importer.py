@@ -0,0 +1,226 @@
+# Bulk import of students from CSV or XLSX spreadsheets
+import csv
+import datetime
+import os
+import unicodedata
+
+import dedupe
+from db import get_conn
+from formats import CEP_MASK, CPF_MASK, DATE_MASK, PHONE_MASK, calc_idade, format_mask
+from refdata import cache as refcache
+from store import CADASTRO_COLUMNS
+
+CHUNK_SIZE = 1000
+
+IMPORT_COLUMNS = [c for c in CADASTRO_COLUMNS if c != 'matricula']
+
+# Common spreadsheet headings (normalised by normalize_header) that differ
+# from the cadastro column names.
+HEADER_ALIASES = {
+    'nome_completo': 'nome',
+    'aluno': 'nome',
+    'nascimento': 'data_nascimento',
+    'data_de_nascimento': 'data_nascimento',
+    'telefone': 'tel_principal',
+    'telefone_principal': 'tel_principal',
+    'celular': 'tel_principal',
+    'telefone_recado': 'tel_recado',
+    'endereco': 'logradouro',
+    'rua': 'logradouro',
+    'e_mail': 'email',
+    'turma': 'turma_id',
+    'curso': 'curso_id',
+    'material': 'material_id',
+    'material_didatico': 'material_id',
+    'valor': 'valor_id',
+}
+
+MASKS = {
+    'data_nascimento': DATE_MASK,
+    'cpf': CPF_MASK,
+    'tel_principal': PHONE_MASK,
+    'tel_recado': PHONE_MASK,
+    'cep': CEP_MASK,
+}
+
+REFERENCES = {
+    'turma_id': 'turmas',
+    'curso_id': 'cursos',
+    'material_id': 'materiais',
+    'valor_id': 'valores',
+}
+
+
+class ImportResult:
+    def __init__(self, inserted, errors, warnings=()):
+        self.inserted = inserted
+        self.errors = errors        # [(line number, message)], rows not imported
+        self.warnings = warnings    # [(line number, message)], imported anyway
+
+
+def normalize_header(text):
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode()
+    return '_'.join(''.join(ch if ch.isalnum() else ' ' for ch in text.lower()).split())
+
+
+def read_rows(path):
+    """Yield the rows of a .csv or .xlsx file as lists, header first."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.xlsx':
+        try:
+            import openpyxl
+        except ImportError:
+            raise ValueError('Instale o pacote openpyxl para importar planilhas .xlsx')
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for row in wb.active.iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            wb.close()
+    elif ext == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            try:
+                dialect = csv.Sniffer().sniff(f.read(4096), delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            f.seek(0)
+            yield from csv.reader(f, dialect)
+    else:
+        raise ValueError(f'Formato não suportado: {ext}')
+
+
+def map_columns(header):
+    """Return the cadastro column for each header cell (None = ignored)."""
+    columns = []
+    for cell in header:
+        name = normalize_header(cell)
+        name = HEADER_ALIASES.get(name, name)
+        columns.append(name if name in IMPORT_COLUMNS else None)
+    if 'nome' not in columns:
+        raise ValueError('A planilha precisa de uma coluna "nome"')
+    return columns
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.strftime('%d/%m/%Y')
+    return str(value).strip()
+
+
+def _iso_date(value):
+    """A dd/mm/yyyy or ISO date as yyyy-mm-dd, the way the form stores it."""
+    for fmt in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value[:10], fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f'data de matrícula inválida: {value!r} (use dd/mm/aaaa)')
+
+
+def _reference(table, value):
+    if value == '':
+        return None
+    names = refcache.names(table)
+    if value.isdigit() and int(value) in names:
+        return int(value)
+    wanted = value.casefold()
+    for id_, name in names.items():
+        if str(name).casefold() == wanted:
+            return id_
+    raise ValueError(f'{value!r} não encontrado em {table}')
+
+
+def build_record(values, today):
+    """Validate one spreadsheet row and return it in IMPORT_COLUMNS order."""
+    if not values.get('nome'):
+        raise ValueError('nome em branco')
+    for col, mask in MASKS.items():
+        if values.get(col):
+            digits = ''.join(filter(str.isdigit, values[col]))
+            if col == 'cpf':
+                digits = digits.zfill(11)   # spreadsheets drop leading zeros
+            values[col] = format_mask(digits, mask)
+    values['idade'] = calc_idade(values.get('data_nascimento', ''), today)
+    matriculado = values.get('data_matricula')
+    values['data_matricula'] = _iso_date(matriculado) if matriculado else today.isoformat()
+    for col, table in REFERENCES.items():
+        values[col] = _reference(table, values.get(col, ''))
+    return tuple(values.get(col) for col in IMPORT_COLUMNS)
+
+
+def parse_file(path, today=None):
+    """Read and validate a spreadsheet: returns (records, errors, lines),
+    ``lines`` holding the line number of each record."""
+    today = today or datetime.date.today()
+    rows = read_rows(path)
+    columns = map_columns(next(rows, []))
+    records, errors, lines = [], [], []
+    for line, row in enumerate(rows, start=2):
+        values = {col: _text(v) for col, v in zip(columns, row) if col}
+        if not any(values.values()):
+            continue
+        try:
+            records.append(build_record(values, today))
+            lines.append(line)
+        except ValueError as e:
+            errors.append((line, str(e)))
+    return records, errors, lines
+
+
+SCREEN_COLUMNS = [IMPORT_COLUMNS.index(c) for c in dedupe.Student._fields[1:]]
+
+
+def screen_records(records, lines, errors, screen=dedupe.screen):
+    """Drop the records whose CPF is already registered or repeated, adding
+    them to ``errors``; returns (records kept, warnings about likely
+    duplicates). ``screen`` is dedupe.screen or its remote stand-in."""
+    rejected, warnings = screen([[r[i] for i in SCREEN_COLUMNS] for r in records])
+    errors.extend((lines[i], message) for i, message in rejected)
+    errors.sort()
+    dropped = {i for i, _ in rejected}
+    return ([r for i, r in enumerate(records) if i not in dropped],
+            [(lines[i], message) for i, message in warnings])
+
+
+def insert_records(records, progress=None, chunk_size=CHUNK_SIZE):
+    """Insert validated records in one transaction, one executemany per chunk.
+
+    The per-row search index trigger is paused for the transaction and the new
+    rows are indexed with a single INSERT ... SELECT at the end, which is
+    several times faster. ``progress(done, total)`` is called after each
+    chunk, from this thread.
+    """
+    placeholders = ', '.join('?' * len(IMPORT_COLUMNS))
+    sql = f'INSERT INTO cadastro({", ".join(IMPORT_COLUMNS)}) VALUES ({placeholders})'
+    conn = get_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        last = conn.execute('SELECT ifnull(max(matricula), 0) FROM cadastro').fetchone()[0]
+        conn.execute('INSERT INTO cadastro_fts_pause VALUES (1)')
+        for start in range(0, len(records), chunk_size):
+            conn.executemany(sql, records[start:start + chunk_size])
+            if progress is not None:
+                progress(min(start + chunk_size, len(records)), len(records))
+        conn.execute('''INSERT INTO cadastro_fts(rowid, nome, responsavel, cpf, email, tel_principal, bairro, digitos)
+            SELECT * FROM cadastro_busca WHERE matricula > ?''', (last,))
+        dedupe.index_after(conn, last)
+        conn.execute('DELETE FROM cadastro_fts_pause')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(records)
+
+
+def import_file(path, progress=None):
+    """Import a CSV/XLSX file into cadastro. All valid rows are written, or
+    none; rows repeating a registered CPF count as invalid."""
+    records, errors, lines = parse_file(path)
+    records, warnings = screen_records(records, lines, errors)
+    return ImportResult(insert_records(records, progress), errors, warnings)
@@ -0,0 +1,65 @@
+# Process-wide cache of the small lookup tables (turmas, cursos, ...)
+import threading
+
+from db import get_conn
+
+# Lookup table -> column shown to the user.
+REFERENCE_TABLES = {
+    'turmas': 'nome',
+    'cursos': 'nome',
+    'materiais': 'nome',
+    'valores': 'descricao',
+}
+
+
+def load_names(table):
+    """(id, name) pairs of one reference table, in id order."""
+    col = REFERENCE_TABLES[table]
+    return get_conn().execute(f'SELECT id, {col} FROM {table} ORDER BY id').fetchall()
+
+
+class ReferenceCache:
+    """Loads each reference table once and serves id -> name maps from memory.
+
+    Writes to a table must call update() (or invalidate()) so every screen
+    sees the change without re-querying. ``loader`` fetches a table's
+    (id, name) pairs; client mode points it at the data server.
+    """
+
+    def __init__(self, loader=load_names):
+        self.loader = loader
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def names(self, table):
+        with self._lock:
+            names = self._maps.get(table)
+        if names is None:
+            names = dict(self.loader(table))
+            with self._lock:
+                names = self._maps.setdefault(table, names)
+        return names
+
+    def name(self, table, id_):
+        return None if id_ is None else self.names(table).get(id_)
+
+    def choices(self, table):
+        """Combobox values in the 'id - name' form CadastroTab.get_id() parses."""
+        return [f'{id_} - {name}' for id_, name in self.names(table).items()]
+
+    def update(self, table, id_, name):
+        """Record an inserted or renamed row; a table not yet loaded is left alone."""
+        with self._lock:
+            names = self._maps.get(table)
+            if names is not None:
+                self._maps[table] = {**names, id_: name}
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._maps.clear()
+            else:
+                self._maps.pop(table, None)
+
+
+cache = ReferenceCache()
@@ -0,0 +1,98 @@
+# Financial dashboard queries over the trigger-maintained summary tables
+import datetime
+
+from db import get_conn
+from schema import SUMMARIES
+
+# Key columns of each summary table; the remaining columns are totals.
+SUMMARY_KEYS = {
+    'resumo_mensal': 1,
+    'resumo_aluno': 1,
+    'resumo_aluno_mes': 2,
+    'resumo_turma': 1,
+    'resumo_curso': 1,
+}
+
+
+def monthly(months=12):
+    """(mes, lancamentos, total, recebido, em_aberto) for the latest due months."""
+    return get_conn().execute(
+        'SELECT * FROM resumo_mensal ORDER BY mes DESC LIMIT ?', (months,)).fetchall()
+
+
+def totals():
+    """(total, recebido, em_aberto) over all charges."""
+    return get_conn().execute(
+        'SELECT total(total), total(recebido), total(em_aberto) FROM resumo_mensal').fetchone()
+
+
+def overdue(today=None, limit=50):
+    """(matricula, nome, em_aberto) of the students owing most.
+
+    A charge is overdue once its due month has ended; resumo_aluno_mes only
+    holds months that are still open, so this stays small. Charges without a
+    due date (mes '') are never overdue.
+    """
+    month = (today or datetime.date.today()).isoformat()[:7]
+    return get_conn().execute('''
+        SELECT m.matricula, c.nome, total(m.em_aberto) AS devido
+        FROM resumo_aluno_mes m LEFT JOIN cadastro c ON c.matricula = m.matricula
+        WHERE m.mes <> '' AND m.mes < ? GROUP BY m.matricula ORDER BY devido DESC LIMIT ?''', (month, limit)).fetchall()
+
+
+def revenue(dim):
+    """(id, lancamentos, recebido, em_aberto) per turma or curso; id 0 = none."""
+    if dim not in ('turma', 'curso'):
+        raise ValueError(f'Dimensão inválida: {dim}')
+    return get_conn().execute(
+        f'SELECT * FROM resumo_{dim} ORDER BY recebido DESC').fetchall()
+
+
+def _rounded(rows, keys):
+    return {row[:keys]: tuple(round(v or 0, 2) for v in row[keys:]) for row in rows}
+
+
+def check(conn=None):
+    """Recompute every summary from financeiro and diff it with the stored one.
+
+    Returns [(table, key, stored, expected)], empty when the triggers agree
+    with a full rebuild. Both sides are read from the same snapshot.
+    """
+    conn = conn or get_conn()
+    differences = []
+    conn.execute('BEGIN')
+    try:
+        for table, sql in SUMMARIES.items():
+            keys = SUMMARY_KEYS[table]
+            stored = _rounded(conn.execute(f'SELECT * FROM {table}'), keys)
+            expected = _rounded(conn.execute(sql), keys)
+            for key in sorted(stored.keys() | expected.keys(), key=repr):
+                if stored.get(key) != expected.get(key):
+                    differences.append((table, key, stored.get(key), expected.get(key)))
+    finally:
+        conn.rollback()
+    return differences
+
+
+def rebuild(conn=None):
+    """Replace every summary table with a fresh computation."""
+    conn = conn or get_conn()
+    with conn:
+        for table, sql in SUMMARIES.items():
+            conn.execute(f'DELETE FROM {table}')
+            conn.execute(f'INSERT INTO {table} {sql}')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Verifica os resumos financeiros')
+    parser.add_argument('--rebuild', action='store_true', help='reconstrói os resumos se divergirem')
+    args = parser.parse_args()
+    differences = check()
+    for table, key, stored, expected in differences:
+        print(f'{table} {key}: gravado {stored}, esperado {expected}')
+    if differences and args.rebuild:
+        rebuild()
+        print('Resumos reconstruídos')
+    elif not differences:
+        print('Resumos consistentes')
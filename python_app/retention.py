@@ -0,0 +1,177 @@
+# Moves old audit log rows out of the hot logs table into an archive database
+import datetime
+import logging
+import os
+import threading
+import time
+
+import db
+
+log = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.environ.get('SCHOOL_LOG_RETENTION_DAYS', 90))
+DELETE_CHUNK = 5000
+
+ARCHIVE_COLUMNS = 'id, username, action, table_name, record_id, timestamp'
+
+
+def archive_path():
+    """The archive file sits next to the live database: school.db -> school_archive.db."""
+    root, ext = os.path.splitext(db.DB_PATH)
+    return f'{root}_archive{ext}'
+
+
+def month_table(month):
+    """Archive table for a 'yyyy-mm' month, e.g. logs_2024_01."""
+    return 'logs_' + month.replace('-', '_')
+
+
+def _next_month(month):
+    year, mon = map(int, month.split('-'))
+    return f'{year + mon // 12:04d}-{mon % 12 + 1:02d}'
+
+
+def archive_logs(days=RETENTION_DAYS, today=None, path=None):
+    """Move log rows older than ``days`` into monthly tables of the archive DB.
+
+    Each month is first copied (INSERT OR IGNORE) and committed, then deleted
+    from ``logs`` in small transactions, and only rows already present in the
+    archive are deleted. A commit spanning two WAL databases is not atomic, so
+    this ordering is what makes an interrupted run safe to repeat. The copy
+    only writes the archive file and never blocks writers of the live DB.
+    Returns {month: rows moved}.
+    """
+    today = today or datetime.date.today()
+    cutoff = (today - datetime.timedelta(days=days)).isoformat()
+    conn = db.connect()
+    moved = {}
+    try:
+        conn.execute('ATTACH DATABASE ? AS archive', (path or archive_path(),))
+        months = [m for (m,) in conn.execute(
+            'SELECT DISTINCT substr(timestamp, 1, 7) FROM logs WHERE timestamp < ?', (cutoff,))]
+        for month in months:
+            table = f'archive.{month_table(month)}'
+            bounds = (month, min(_next_month(month), cutoff))
+            with conn:
+                conn.execute(f'''CREATE TABLE IF NOT EXISTS {table}(
+                    id INTEGER PRIMARY KEY, username TEXT, action TEXT,
+                    table_name TEXT, record_id TEXT, timestamp TEXT)''')
+                # The logs tab pages archived months by timestamp too.
+                conn.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{month_table(month)}_timestamp '
+                             f'ON {month_table(month)}(timestamp)')
+                conn.execute(f'''INSERT OR IGNORE INTO {table} SELECT {ARCHIVE_COLUMNS} FROM logs
+                                 WHERE timestamp >= ? AND timestamp < ?''', bounds)
+            moved[month] = 0
+            last = 0
+            while True:
+                with conn:
+                    ids = [i for (i,) in conn.execute(
+                        f'SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?', (last, DELETE_CHUNK))]
+                    if not ids:
+                        break
+                    last = ids[-1]
+                    moved[month] += conn.execute(
+                        f'DELETE FROM logs WHERE id IN ({", ".join("?" * len(ids))})', ids).rowcount
+        # The day of the last run, so ArchiveService runs once a day.
+        conn.execute(f'PRAGMA archive.user_version = {today.toordinal()}')
+        if moved:
+            # Hand the freed pages back to the WAL and refresh planner stats
+            # now that the logs table shrank.
+            conn.execute('PRAGMA main.wal_checkpoint(PASSIVE)')
+            conn.execute('PRAGMA main.optimize')
+            log.info('Logs arquivados: %s', moved)
+    finally:
+        conn.close()
+    return moved
+
+
+def last_run(path=None):
+    """The date archive_logs() last ran, or None if it never did."""
+    path = path or archive_path()
+    if not os.path.exists(path):
+        return None
+    conn = db.connect(path)
+    try:
+        (day,) = conn.execute('PRAGMA user_version').fetchone()
+    finally:
+        conn.close()
+    return datetime.date.fromordinal(day) if day else None
+
+
+def archived_months(start=None, end=None, path=None):
+    """The 'yyyy-mm' months present in the archive, newest first.
+
+    ``start``/``end`` are ISO timestamps (end exclusive); when given, only
+    the months overlapping that range are returned.
+    """
+    path = path or archive_path()
+    if not os.path.exists(path):
+        return []
+    conn = db.connect(path)
+    try:
+        names = [n for (n,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'logs\\_%' ESCAPE '\\'")]
+    finally:
+        conn.close()
+    months = (n[5:].replace('_', '-') for n in names)
+    return sorted((m for m in months if (start is None or m >= start[:7]) and (end is None or f'{m}-01' < end)),
+                  reverse=True)
+
+
+def attach_archive(conn):
+    """Attach the archive to ``conn`` as ``archive``; False if there is none yet."""
+    if any(name == 'archive' for _, name, _ in conn.execute('PRAGMA database_list')):
+        return True
+    path = archive_path()
+    if not os.path.exists(path):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    return True
+
+
+class ArchiveService:
+    """Runs archive_logs() once a day on a daemon thread.
+
+    The archive records the day of its last run, so restarting the app does
+    not archive again the same day.
+    """
+
+    def __init__(self, days=RETENTION_DAYS):
+        self.days = days
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due_in(self):
+        last = last_run()
+        if last is None or last < datetime.date.today():
+            return 0
+        tomorrow = datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time())
+        return max(0.0, tomorrow.timestamp() - time.time())
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name='archive-logs', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.due_in()):
+            try:
+                archive_logs(self.days)
+            except Exception:
+                log.exception('Falha ao arquivar logs')
+                self._stop.wait(600)    # retry later rather than spin
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Arquiva logs antigos')
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    moved = archive_logs(args.days)
+    print(f'{sum(moved.values())} registros arquivados em {archive_path()}')
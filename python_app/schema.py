@@ -0,0 +1,483 @@
+# Versioned schema migrations for the school database
+import sqlite3
+
+
+def _digits(expr):
+    """SQL expression stripping the punctuation the input masks add."""
+    for ch in '.-()/ ':
+        expr = f"replace({expr}, '{ch}', '')"
+    return f"ifnull({expr}, '')"
+
+
+def iso_date(col):
+    """SQL expression reading a date typed as dd/mm/yyyy or ISO as yyyy-mm-dd."""
+    return (f"CASE WHEN {col} LIKE '__/__/____' "
+            f"THEN substr({col}, 7, 4) || '-' || substr({col}, 4, 2) || '-' || substr({col}, 1, 2) "
+            f"ELSE substr({col}, 1, 10) END")
+
+
+def iso_text(value):
+    """What iso_date() gives for one stored value."""
+    if value is None:
+        return None
+    text = str(value)
+    if len(text) == 10 and text[2] == text[5] == '/':
+        return f'{text[6:10]}-{text[3:5]}-{text[:2]}'
+    return text[:10]
+
+
+# Financial summaries. A financeiro row is a charge: it counts as received
+# once a payment method is filled in and as open until then. Amounts go
+# through CAST so the triggers and the rebuild queries agree on odd input.
+def _amount(ref):
+    return f'ifnull(CAST({ref}.valor AS REAL), 0)'
+
+
+def _paid(ref):
+    return f"trim(ifnull({ref}.forma_pagamento, '')) <> ''"
+
+
+def _month(ref):
+    # '' for a charge without a due date: mes is part of primary keys.
+    return f"ifnull(substr({iso_date(ref + '.vencimento')}, 1, 7), '')"
+
+
+def _received(ref, sign=''):
+    return f'CASE WHEN {_paid(ref)} THEN {sign}{_amount(ref)} ELSE 0 END'
+
+
+def _open(ref, sign=''):
+    return f'CASE WHEN {_paid(ref)} THEN 0 ELSE {sign}{_amount(ref)} END'
+
+
+def _dimension(dim, ref):
+    return f'ifnull((SELECT {dim}_id FROM cadastro WHERE matricula = {ref}.matricula), 0)'
+
+
+# Summary table -> query recomputing it from scratch, in column order. Used to
+# fill the tables and by reports.check() to verify what the triggers keep.
+SUMMARIES = {
+    'resumo_mensal': f'''SELECT {_month('f')}, count(*), total({_amount('f')}), total({_received('f')}),
+        total({_open('f')}) FROM financeiro f GROUP BY 1''',
+    'resumo_aluno': f'''SELECT ifnull(f.matricula, 0), count(*), total({_received('f')}), total({_open('f')})
+        FROM financeiro f GROUP BY 1''',
+    'resumo_aluno_mes': f'''SELECT ifnull(f.matricula, 0), {_month('f')}, total({_amount('f')})
+        FROM financeiro f WHERE NOT ({_paid('f')}) GROUP BY 1, 2 HAVING round(total({_amount('f')}), 2) <> 0''',
+    **{f'resumo_{dim}': f'''SELECT ifnull(c.{dim}_id, 0), count(*), total({_received('f')}), total({_open('f')})
+        FROM financeiro f LEFT JOIN cadastro c ON c.matricula = f.matricula GROUP BY 1'''
+       for dim in ('turma', 'curso')},
+}
+
+
+def _add(table, keys, values, source='WHERE true'):
+    """Upsert adding ``values`` (column -> expression) to the row at ``keys``."""
+    cols = list(keys) + list(values)
+    exprs = list(keys.values()) + list(values.values())
+    updates = ', '.join(f'{c} = {c} + excluded.{c}' for c in values)
+    # The WHERE keeps "SELECT ... ON CONFLICT" from being parsed as a join.
+    return (f'INSERT INTO {table}({", ".join(cols)}) SELECT {", ".join(exprs)} {source} '
+            f'ON CONFLICT({", ".join(keys)}) DO UPDATE SET {updates};')
+
+
+def _financeiro_delta(ref, sign=''):
+    """Trigger body adding (sign '') or removing (sign '-') one charge."""
+    student = f'ifnull({ref}.matricula, 0)'
+    totals = {'lancamentos': f'{sign}1', 'recebido': _received(ref, sign), 'em_aberto': _open(ref, sign)}
+    statements = [
+        _add('resumo_mensal', {'mes': _month(ref)}, {**totals, 'total': f'{sign}{_amount(ref)}'}),
+        f'DELETE FROM resumo_mensal WHERE mes = {_month(ref)} AND lancamentos = 0;',
+        _add('resumo_aluno', {'matricula': student}, totals),
+        f'DELETE FROM resumo_aluno WHERE matricula = {student} AND lancamentos = 0;',
+        _add('resumo_aluno_mes', {'matricula': student, 'mes': _month(ref)},
+             {'em_aberto': f'{sign}{_amount(ref)}'}, f'WHERE NOT ({_paid(ref)})'),
+        f'DELETE FROM resumo_aluno_mes WHERE matricula = {student} AND mes = {_month(ref)} '
+        f'AND round(em_aberto, 2) = 0;',
+    ]
+    for dim in ('turma', 'curso'):
+        statements += [
+            _add(f'resumo_{dim}', {f'{dim}_id': _dimension(dim, ref)}, totals),
+            f'DELETE FROM resumo_{dim} WHERE {dim}_id = {_dimension(dim, ref)} AND lancamentos = 0;',
+        ]
+    return '\n'.join(statements)
+
+
+def _financeiro_triggers():
+    yield f'CREATE TRIGGER financeiro_resumo_ai AFTER INSERT ON financeiro BEGIN {_financeiro_delta("new")} END'
+    yield f'CREATE TRIGGER financeiro_resumo_ad AFTER DELETE ON financeiro BEGIN {_financeiro_delta("old", "-")} END'
+    yield f'''CREATE TRIGGER financeiro_resumo_au AFTER UPDATE OF matricula, valor, vencimento, forma_pagamento
+        ON financeiro BEGIN {_financeiro_delta("old", "-")} {_financeiro_delta("new")} END'''
+
+
+def _move_student(dim, src, dst, ref='new'):
+    """Trigger body moving a student's totals from one turma or curso to another."""
+    source = f'FROM resumo_aluno a WHERE a.matricula = {ref}.matricula'
+    return '\n'.join([
+        _add(f'resumo_{dim}', {f'{dim}_id': dst},
+             {'lancamentos': 'a.lancamentos', 'recebido': 'a.recebido', 'em_aberto': 'a.em_aberto'}, source),
+        _add(f'resumo_{dim}', {f'{dim}_id': src},
+             {'lancamentos': '-a.lancamentos', 'recebido': '-a.recebido', 'em_aberto': '-a.em_aberto'}, source),
+        f'DELETE FROM resumo_{dim} WHERE {dim}_id = {src} AND lancamentos = 0;',
+    ])
+
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records
+# how many have been applied. Never edit a shipped migration, append a new one.
+def _change_triggers(keys):
+    """Triggers recording the key of each changed row of ``keys`` ({table: key column})."""
+    for table, key in keys.items():
+        record = f"INSERT INTO alteracoes(tabela, chave) VALUES ('{table}', {{}}.{key});"
+        yield f'DROP TRIGGER IF EXISTS {table}_alteracoes_ai'
+        yield f'CREATE TRIGGER {table}_alteracoes_ai AFTER INSERT ON {table} BEGIN {record.format("new")} END'
+        yield f'DROP TRIGGER IF EXISTS {table}_alteracoes_au'
+        # A changed key reports both the old and the new one.
+        yield f'''CREATE TRIGGER {table}_alteracoes_au AFTER UPDATE ON {table} BEGIN
+            {record.format("new")}
+            INSERT INTO alteracoes(tabela, chave) SELECT '{table}', old.{key} WHERE old.{key} IS NOT new.{key};
+        END'''
+        yield f'DROP TRIGGER IF EXISTS {table}_alteracoes_ad'
+        yield f'CREATE TRIGGER {table}_alteracoes_ad AFTER DELETE ON {table} BEGIN {record.format("old")} END'
+
+
+MIGRATIONS = [
+    # 1: the original tables (IF NOT EXISTS so databases created before
+    # versioning was introduced upgrade cleanly)
+    (
+        '''CREATE TABLE IF NOT EXISTS users(
+            username TEXT PRIMARY KEY,
+            password TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS turmas(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT,
+            horario TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS cursos(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS materiais(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT,
+            valor REAL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS valores(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao TEXT,
+            valor REAL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS estoque(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT,
+            quantidade INTEGER
+        )''',
+        '''CREATE TABLE IF NOT EXISTS cadastro(
+            matricula INTEGER PRIMARY KEY AUTOINCREMENT,
+            data_matricula TEXT,
+            nome TEXT,
+            data_nascimento TEXT,
+            idade INTEGER,
+            responsavel TEXT,
+            cpf TEXT,
+            rg TEXT,
+            tel_principal TEXT,
+            tel_recado TEXT,
+            cep TEXT,
+            logradouro TEXT,
+            numero TEXT,
+            complemento TEXT,
+            bairro TEXT,
+            cidade TEXT,
+            email TEXT,
+            instagram TEXT,
+            turma_id INTEGER,
+            curso_id INTEGER,
+            material_id INTEGER,
+            vencimento TEXT,
+            valor_id INTEGER
+        )''',
+        '''CREATE TABLE IF NOT EXISTS financeiro(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            matricula INTEGER,
+            valor REAL,
+            vencimento TEXT,
+            forma_pagamento TEXT,
+            anexo TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS logs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            action TEXT,
+            table_name TEXT,
+            record_id TEXT,
+            timestamp TEXT
+        )''',
+    ),
+    # 2: indexes for the hot query paths
+    (
+        'CREATE INDEX IF NOT EXISTS idx_logs_username ON logs(username)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_username_timestamp ON logs(username, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_financeiro_matricula_vencimento ON financeiro(matricula, vencimento)',
+        'CREATE INDEX IF NOT EXISTS idx_cadastro_turma ON cadastro(turma_id)',
+        'CREATE INDEX IF NOT EXISTS idx_cadastro_curso ON cadastro(curso_id)',
+    ),
+    # 3: persistent cache for CEP lookups
+    (
+        '''CREATE TABLE IF NOT EXISTS cep_cache(
+            cep TEXT PRIMARY KEY,
+            data TEXT,
+            fetched_at REAL
+        )''',
+    ),
+    # 4: full-text search over students. cadastro_busca adds a digits-only
+    # copy of CPF and phone so '12345678900' matches '123.456.789-00'.
+    (
+        f'''CREATE VIEW IF NOT EXISTS cadastro_busca AS
+            SELECT matricula, nome, responsavel, cpf, email, tel_principal, bairro,
+                   {_digits('cpf')} || ' ' || {_digits('tel_principal')} AS digitos
+            FROM cadastro''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS cadastro_fts USING fts5(
+            nome, responsavel, cpf, email, tel_principal, bairro, digitos,
+            content='cadastro_busca', content_rowid='matricula',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )''',
+        f'''CREATE TRIGGER IF NOT EXISTS cadastro_fts_ai AFTER INSERT ON cadastro BEGIN
+            INSERT INTO cadastro_fts(rowid, nome, responsavel, cpf, email, tel_principal, bairro, digitos)
+            VALUES (new.matricula, new.nome, new.responsavel, new.cpf, new.email, new.tel_principal, new.bairro,
+                    {_digits('new.cpf')} || ' ' || {_digits('new.tel_principal')});
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS cadastro_fts_ad AFTER DELETE ON cadastro BEGIN
+            INSERT INTO cadastro_fts(cadastro_fts, rowid, nome, responsavel, cpf, email, tel_principal, bairro, digitos)
+            VALUES ('delete', old.matricula, old.nome, old.responsavel, old.cpf, old.email, old.tel_principal, old.bairro,
+                    {_digits('old.cpf')} || ' ' || {_digits('old.tel_principal')});
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS cadastro_fts_au AFTER UPDATE OF nome, responsavel, cpf, email, tel_principal, bairro ON cadastro BEGIN
+            INSERT INTO cadastro_fts(cadastro_fts, rowid, nome, responsavel, cpf, email, tel_principal, bairro, digitos)
+            VALUES ('delete', old.matricula, old.nome, old.responsavel, old.cpf, old.email, old.tel_principal, old.bairro,
+                    {_digits('old.cpf')} || ' ' || {_digits('old.tel_principal')});
+            INSERT INTO cadastro_fts(rowid, nome, responsavel, cpf, email, tel_principal, bairro, digitos)
+            VALUES (new.matricula, new.nome, new.responsavel, new.cpf, new.email, new.tel_principal, new.bairro,
+                    {_digits('new.cpf')} || ' ' || {_digits('new.tel_principal')});
+        END''',
+        "INSERT INTO cadastro_fts(cadastro_fts) VALUES ('rebuild')",
+    ),
+    # 5: let bulk imports skip the per-row FTS trigger. While a row exists in
+    # cadastro_fts_pause (only ever inside the importer's own transaction) new
+    # rows are not indexed one by one; the importer indexes them in one pass.
+    (
+        'CREATE TABLE IF NOT EXISTS cadastro_fts_pause(active INTEGER)',
+        'DROP TRIGGER IF EXISTS cadastro_fts_ai',
+        f'''CREATE TRIGGER cadastro_fts_ai AFTER INSERT ON cadastro
+            WHEN NOT EXISTS (SELECT 1 FROM cadastro_fts_pause) BEGIN
+            INSERT INTO cadastro_fts(rowid, nome, responsavel, cpf, email, tel_principal, bairro, digitos)
+            VALUES (new.matricula, new.nome, new.responsavel, new.cpf, new.email, new.tel_principal, new.bairro,
+                    {_digits('new.cpf')} || ' ' || {_digits('new.tel_principal')});
+        END''',
+    ),
+    # 6: LogsTab pages by (timestamp, id) under optional user, action or table
+    # filters; paging by id alone is gone.
+    (
+        'CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_action_timestamp ON logs(action, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_table_timestamp ON logs(table_name, timestamp)',
+        'DROP INDEX IF EXISTS idx_logs_username',
+    ),
+    # 7: financial summaries, kept current by triggers on financeiro and on
+    # each student's turma/curso, then filled from the existing rows
+    (
+        '''CREATE TABLE IF NOT EXISTS resumo_mensal(
+            mes TEXT PRIMARY KEY, lancamentos INTEGER, total REAL, recebido REAL, em_aberto REAL
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS resumo_aluno(
+            matricula PRIMARY KEY, lancamentos INTEGER, recebido REAL, em_aberto REAL
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS resumo_aluno_mes(
+            matricula, mes TEXT, em_aberto REAL, PRIMARY KEY(matricula, mes)
+        ) WITHOUT ROWID''',
+        *(f'''CREATE TABLE IF NOT EXISTS resumo_{dim}(
+            {dim}_id PRIMARY KEY, lancamentos INTEGER, recebido REAL, em_aberto REAL
+        ) WITHOUT ROWID''' for dim in ('turma', 'curso')),
+        *_financeiro_triggers(),
+        # Charges entered before their student existed are counted under id 0.
+        f'''CREATE TRIGGER cadastro_resumo_ai AFTER INSERT ON cadastro
+            WHEN EXISTS (SELECT 1 FROM resumo_aluno WHERE matricula = new.matricula) BEGIN
+            {_move_student('turma', '0', 'ifnull(new.turma_id, 0)')}
+            {_move_student('curso', '0', 'ifnull(new.curso_id, 0)')}
+        END''',
+        *(f'''CREATE TRIGGER cadastro_resumo_{dim}_au AFTER UPDATE OF {dim}_id ON cadastro
+            WHEN old.{dim}_id IS NOT new.{dim}_id BEGIN
+            {_move_student(dim, f'ifnull(old.{dim}_id, 0)', f'ifnull(new.{dim}_id, 0)')}
+        END''' for dim in ('turma', 'curso')),
+        f'''CREATE TRIGGER cadastro_resumo_ad AFTER DELETE ON cadastro
+            WHEN EXISTS (SELECT 1 FROM resumo_aluno WHERE matricula = old.matricula) BEGIN
+            {_move_student('turma', 'ifnull(old.turma_id, 0)', '0', 'old')}
+            {_move_student('curso', 'ifnull(old.curso_id, 0)', '0', 'old')}
+        END''',
+        *(f'INSERT INTO {table} {sql}' for table, sql in SUMMARIES.items()),
+    ),
+    # 8: metadata of the content-addressed attachment store; financeiro.anexo
+    # now holds a sha256 digest instead of a file path
+    (
+        '''CREATE TABLE IF NOT EXISTS anexos(
+            sha256 TEXT PRIMARY KEY,
+            nome TEXT,
+            mime TEXT,
+            tamanho INTEGER,
+            criado_em TEXT
+        ) WITHOUT ROWID''',
+    ),
+    # 9: clickable-header sorting (store.View.ordering). A sorted column is
+    # followed by the view's default order, so the logs columns reuse their
+    # (column, timestamp) indexes and only the others need one. vencimento
+    # holds both dd/mm/yyyy and ISO text and sorts through iso_date().
+    (
+        'CREATE INDEX IF NOT EXISTS idx_cadastro_nome ON cadastro(nome)',
+        'CREATE INDEX IF NOT EXISTS idx_financeiro_matricula ON financeiro(matricula)',
+        'CREATE INDEX IF NOT EXISTS idx_financeiro_valor ON financeiro(valor)',
+        f"CREATE INDEX IF NOT EXISTS idx_financeiro_vencimento_iso ON financeiro({iso_date('vencimento')})",
+        'CREATE INDEX IF NOT EXISTS idx_financeiro_forma ON financeiro(forma_pagamento)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_record_timestamp ON logs(record_id, timestamp)',
+    ),
+    # 10: change log read by open workstations (see changes.py). chave has no
+    # declared type so integer and text keys keep their type.
+    (
+        '''CREATE TABLE IF NOT EXISTS alteracoes(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            chave
+        )''',
+        *_change_triggers({'cadastro': 'matricula', 'financeiro': 'id', 'users': 'username', 'turmas': 'id',
+                           'cursos': 'id', 'materiais': 'id', 'valores': 'id', 'estoque': 'id'}),
+    ),
+    # 11: monthly billing runs (billing.py). competencia is the month a
+    # generated charge bills; hand-entered charges leave it NULL.
+    (
+        'ALTER TABLE financeiro ADD COLUMN competencia TEXT',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_financeiro_competencia ON financeiro(matricula, competencia)
+            WHERE competencia IS NOT NULL''',
+        '''CREATE TABLE IF NOT EXISTS faturamentos(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            competencia TEXT NOT NULL,
+            usuario TEXT,
+            executado_em TEXT,
+            lancamentos INTEGER,
+            total REAL
+        )''',
+    ),
+    # 12: duplicate students (dedupe.py). cpf_norm holds the CPF digits under
+    # a unique index; students that already shared a CPF keep it NULL, except
+    # the first of each group, and are listed by dedupe.report(). The blocking
+    # keys need Python to normalize names, so dedupe.backfill() fills them.
+    (
+        'ALTER TABLE cadastro ADD COLUMN cpf_norm TEXT',
+        f'''UPDATE cadastro SET cpf_norm = {_digits('cpf')} WHERE matricula IN (
+            SELECT min(matricula) FROM cadastro WHERE {_digits('cpf')} <> '' GROUP BY {_digits('cpf')})''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cadastro_cpf ON cadastro(cpf_norm)',
+        f'''CREATE TRIGGER cadastro_cpf_ai AFTER INSERT ON cadastro WHEN {_digits('new.cpf')} <> '' BEGIN
+            UPDATE cadastro SET cpf_norm = {_digits('new.cpf')} WHERE matricula = new.matricula;
+        END''',
+        f'''CREATE TRIGGER cadastro_cpf_au AFTER UPDATE OF cpf ON cadastro
+            WHEN {_digits('new.cpf')} <> {_digits('old.cpf')} BEGIN
+            UPDATE cadastro SET cpf_norm = nullif({_digits('new.cpf')}, '') WHERE matricula = new.matricula;
+        END''',
+        '''CREATE TABLE IF NOT EXISTS cadastro_chaves(
+            chave TEXT NOT NULL,
+            matricula INTEGER NOT NULL,
+            PRIMARY KEY (chave, matricula)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_cadastro_chaves_matricula ON cadastro_chaves(matricula)',
+        '''CREATE TRIGGER cadastro_chaves_ad AFTER DELETE ON cadastro BEGIN
+            DELETE FROM cadastro_chaves WHERE matricula = old.matricula;
+        END''',
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Queries the app runs on large tables, with the index each must use. None of
+# them may fall back to sorting in a temporary B-tree.
+HOT_QUERIES = (
+    ('SELECT id FROM logs WHERE timestamp <= ? AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT 200',
+     ('2024-01-01', '2024-01-01', 1000), 'idx_logs_timestamp'),
+    ('SELECT id FROM logs WHERE username = ? AND timestamp <= ? AND (timestamp, id) < (?, ?) '
+     'ORDER BY timestamp DESC, id DESC LIMIT 200', ('master', '2024-01-01', '2024-01-01', 1000),
+     'idx_logs_username_timestamp'),
+    ('SELECT id FROM logs WHERE action = ? AND timestamp >= ? ORDER BY timestamp DESC, id DESC LIMIT 200',
+     ('add', '2024-01-01'), 'idx_logs_action_timestamp'),
+    ('SELECT id FROM logs WHERE table_name = ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 200',
+     ('cadastro', '2024-01-01'), 'idx_logs_table_timestamp'),
+    ("SELECT id FROM logs WHERE username = ? AND timestamp >= ? ORDER BY timestamp",
+     ('master', '2024-01-01'), 'idx_logs_username_timestamp'),
+    ('SELECT id, vencimento FROM financeiro WHERE matricula = ? ORDER BY vencimento',
+     (1,), 'idx_financeiro_matricula_vencimento'),
+    ('SELECT matricula FROM cadastro WHERE turma_id = ?', (1,), 'idx_cadastro_turma'),
+    ('SELECT matricula FROM cadastro WHERE curso_id = ?', (1,), 'idx_cadastro_curso'),
+    ('SELECT matricula FROM cadastro WHERE nome >= ? AND (nome, matricula) > (?, ?) ORDER BY nome, matricula LIMIT 200',
+     ('Ana', 'Ana', 1), 'idx_cadastro_nome'),
+    ('SELECT matricula FROM cadastro WHERE nome IS NULL AND matricula > ? ORDER BY nome, matricula LIMIT 200',
+     (1,), 'idx_cadastro_nome'),
+    (f'SELECT id FROM financeiro WHERE {iso_date("vencimento")} <= ? AND ({iso_date("vencimento")}, id) < (?, ?) '
+     f'ORDER BY {iso_date("vencimento")} DESC, id DESC LIMIT 200', ('2024-01-01', '2024-01-01', 1000),
+     'idx_financeiro_vencimento_iso (<expr><?)'),
+    (f'SELECT id FROM financeiro WHERE {iso_date("vencimento")} >= ? AND {iso_date("vencimento")} < ?',
+     ('2024-01-01', '2024-02-01'), 'idx_financeiro_vencimento_iso'),
+    ('SELECT id FROM financeiro WHERE matricula >= ? AND (matricula, id) > (?, ?) ORDER BY matricula, id LIMIT 200',
+     (1, 1, 1000), 'idx_financeiro_matricula'),
+    ('SELECT id FROM logs WHERE action >= ? AND (action, timestamp, id) > (?, ?, ?) '
+     'ORDER BY action, timestamp, id LIMIT 200', ('add', 'add', '2024-01-01', 1000), 'idx_logs_action_timestamp'),
+    ('SELECT id FROM logs WHERE record_id = ? ORDER BY timestamp DESC, id DESC LIMIT 200',
+     ('1',), 'idx_logs_record_timestamp'),
+    ('SELECT matricula FROM cadastro WHERE cpf_norm = ?', ('12345678900',), 'idx_cadastro_cpf'),
+    ('SELECT chave, matricula FROM cadastro_chaves WHERE chave IN (?, ?)', ('n:a', 'n:b'), 'PRIMARY KEY'),
+    ('SELECT chave, matricula FROM cadastro_chaves ORDER BY chave', (), 'cadastro_chaves'),
+)
+
+
+def user_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Bring the database up to SCHEMA_VERSION; a no-op when it is current.
+
+    Each migration runs in its own IMMEDIATE transaction and re-checks the
+    version once it holds the write lock, so two workstations starting at
+    the same time cannot apply the same step twice.
+    """
+    if user_version(conn) >= SCHEMA_VERSION:
+        return
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if user_version(conn) >= version:
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def query_plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_query_plans(conn):
+    """Raise AssertionError if a hot query no longer uses its index."""
+    failures = []
+    for sql, params, index in HOT_QUERIES:
+        plan = query_plan(conn, sql, params)
+        if not any(index in step for step in plan):
+            failures.append(f'{sql!r} does not use {index}: {plan}')
+        elif any('TEMP B-TREE' in step for step in plan):
+            failures.append(f'{sql!r} sorts in a temporary B-tree: {plan}')
+    assert not failures, '\n'.join(failures)
+
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    check_query_plans(conn)
+    print(f'schema v{user_version(conn)}: {len(HOT_QUERIES)} query plans OK')
@@ -1,101 +1,50 @@
 # Basic School Management App in Tkinter
-import sqlite3
 import os
 import datetime
 from tkinter import *
 from tkinter import ttk, messagebox, filedialog
 import json
-import requests
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque, namedtuple
+
+import attachments
+import backup
+import billing
+import changes
+import client
+import dedupe
+import diagnostics
+import documents
+import export
+import importer
+import refdata
+import reports
+import retention
+import store
+import workers
+from audit import AuditWriter
+from cep import CepNotFound, CepService
+from db import close_all
+from diagnostics import timed
+from formats import CEP_MASK, CPF_MASK, DATE_MASK, PHONE_MASK, calc_idade, format_mask
+from store import CADASTRO_COLUMNS, MASTER_USER, init_db
+
+log = logging.getLogger('school_app')
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'school.db')
 LAST_USER_FILE = os.path.join(os.path.dirname(__file__), 'last_user.txt')
 DEFAULT_W, DEFAULT_H = 500, 400
-MASTER_USER = 'master'
-MASTER_PASS = 'master'
-
-CADASTRO_COLUMNS = [
-    'matricula', 'data_matricula', 'nome', 'data_nascimento', 'idade',
-    'responsavel', 'cpf', 'rg', 'tel_principal', 'tel_recado', 'cep',
-    'logradouro', 'numero', 'complemento', 'bairro', 'cidade', 'email',
-    'instagram', 'turma_id', 'curso_id', 'material_id', 'vencimento', 'valor_id'
-]
-
-# --- Database Setup ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('''CREATE TABLE IF NOT EXISTS users(
-        username TEXT PRIMARY KEY,
-        password TEXT
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS turmas(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT,
-        horario TEXT
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS cursos(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS materiais(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT,
-        valor REAL
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS valores(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        descricao TEXT,
-        valor REAL
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS estoque(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nome TEXT,
-        quantidade INTEGER
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS cadastro(
-        matricula INTEGER PRIMARY KEY AUTOINCREMENT,
-        data_matricula TEXT,
-        nome TEXT,
-        data_nascimento TEXT,
-        idade INTEGER,
-        responsavel TEXT,
-        cpf TEXT,
-        rg TEXT,
-        tel_principal TEXT,
-        tel_recado TEXT,
-        cep TEXT,
-        logradouro TEXT,
-        numero TEXT,
-        complemento TEXT,
-        bairro TEXT,
-        cidade TEXT,
-        email TEXT,
-        instagram TEXT,
-        turma_id INTEGER,
-        curso_id INTEGER,
-        material_id INTEGER,
-        vencimento TEXT,
-        valor_id INTEGER
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS financeiro(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        matricula INTEGER,
-        valor REAL,
-        vencimento TEXT,
-        forma_pagamento TEXT,
-        anexo TEXT
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS logs(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT,
-        action TEXT,
-        table_name TEXT,
-        record_id TEXT,
-        timestamp TEXT
-    )''')
-    cur.execute("INSERT OR IGNORE INTO users(username, password) VALUES (?, ?)", (MASTER_USER, MASTER_PASS))
-    conn.commit()
-    conn.close()
+SEARCH_DELAY_MS = 250
+# How often to look for commits made by other workstations.
+CHANGE_POLL_MS = 1000
+LOADING_MARK = '⌛ '
+# 'batched' commits audit entries from a background thread; 'strict' writes
+# each one before the action returns.
+AUDIT_MODE = os.environ.get('SCHOOL_AUDIT_MODE', 'batched')
+# host:port of a data server (server.py); unset = open the database directly.
+SERVER_ADDRESS = os.environ.get('SCHOOL_SERVER')
 
 # --- Helper Functions ---
 def save_last_user(username):
@@ -114,53 +63,45 @@ def is_master(username):
     return username == MASTER_USER
 
 
+cep_service = CepService()
+
+
 def cep_lookup(cep, street_var, bairro_var, cidade_var):
-    try:
-        r = requests.get(f'https://viacep.com.br/ws/{cep}/json/')
-        if r.status_code == 200:
-            data = r.json()
-            street_var.set(data.get('logradouro', ''))
-            bairro_var.set(data.get('bairro', ''))
-            cidade_var.set(data.get('localidade', ''))
-    except Exception as e:
-        messagebox.showerror('Erro', f'Falha ao consultar CEP: {e}')
+    def fill(data):
+        street_var.set(data.get('logradouro', ''))
+        bairro_var.set(data.get('bairro', ''))
+        cidade_var.set(data.get('localidade', ''))
+
+    def failed(e):
+        if isinstance(e, CepNotFound):
+            messagebox.showerror('Erro', 'CEP não encontrado')
+        else:
+            messagebox.showerror('Erro', f'Falha ao consultar CEP: {e}')
+
+    cep_service.lookup_async(cep, fill, failed)
 
 
 def apply_mask(entry, pattern):
-    digits = ''.join(filter(str.isdigit, entry.get()))
-    result = ''
-    di = 0
-    for ch in pattern:
-        if ch == '#':
-            if di < len(digits):
-                result += digits[di]
-                di += 1
-            else:
-                break
-        else:
-            if di < len(digits):
-                result += ch
-            else:
-                break
+    result = format_mask(entry.get(), pattern)
     entry.delete(0, END)
     entry.insert(0, result)
     entry.icursor(len(result))
 
 
 def mask_date(entry):
-    apply_mask(entry, '##/##/####')
+    apply_mask(entry, DATE_MASK)
 
 
 def mask_cpf(entry):
-    apply_mask(entry, '###.###.###-##')
+    apply_mask(entry, CPF_MASK)
 
 
 def mask_phone(entry):
-    apply_mask(entry, '(##) #####-####')
+    apply_mask(entry, PHONE_MASK)
 
 
 def mask_cep(entry):
-    apply_mask(entry, '#####-###')
+    apply_mask(entry, CEP_MASK)
 
 
 def center_window(win, w=DEFAULT_W, h=DEFAULT_H):
@@ -190,18 +131,388 @@ def apply_basic_style(win):
     win.configure(bg='white')
 
 
+def warn_audit_loss(count, error):
+    workers.call_soon(messagebox.showwarning, 'Auditoria',
+                      f'{count} registros de auditoria não puderam ser gravados ({error}). '
+                      'Eles foram copiados para o log do aplicativo.')
+
+
+audit_writer = AuditWriter(AUDIT_MODE)
+audit_writer.on_loss = warn_audit_loss
+
+
 def log_action(user, action, table_name, record_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('''INSERT INTO logs(username, action, table_name, record_id, timestamp)
-                   VALUES(?,?,?,?,?)''', (
-        user, action, table_name, str(record_id), datetime.datetime.now().isoformat()
-    ))
-    conn.commit()
-    conn.close()
+    audit_writer.log(user, action, table_name, record_id)
+
+
+class Upkeep:
+    """Background jobs of a standalone workstation; a data server runs its own.
+
+    MainApp is rebuilt at every login, so the jobs hang off the module-level
+    ``upkeep`` and start once per process.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.archiver = retention.ArchiveService()
+        # Stops with the process (daemon thread); the next start resumes the schedule.
+        self.backups = backup.BackupService()
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        self.archiver.start()
+        workers.submit(changes.prune)
+        self.backups.start()
+
+
+upkeep = Upkeep()
+
+
+def describe_duplicates(found):
+    """One line per dedupe.candidates() entry."""
+    return '\n'.join(f'Matrícula {matricula} - {nome} ({score:.0%}: {", ".join(motivos)})'
+                     for matricula, nome, score, motivos in found[:5])
+
+
+def use_server(address):
+    """Client mode: send every data operation to a data server instead of
+    opening the database file here."""
+    global store, reports, importer, audit_writer, cep_service, changes, billing, dedupe
+    remote = client.Client(*client.parse_address(address))
+    remote.call('ping')
+    store = client.RemoteStore(remote)
+    reports = client.RemoteModule(remote, 'reports', reports,
+                                  ('totals', 'monthly', 'overdue', 'revenue', 'check', 'rebuild'))
+    importer = client.RemoteImporter(remote)
+    audit_writer = client.RemoteAudit(remote)
+    cep_service = client.RemoteCepService(remote)
+    changes = client.RemoteModule(remote, 'changes', changes, ('mark', 'since'))
+    billing = client.RemoteModule(remote, 'billing', billing, ('preview', 'run', 'runs'))
+    dedupe = client.RemoteModule(remote, 'dedupe', dedupe, ('candidates', 'report'))
+    refdata.cache.loader = lambda table: remote.call('refdata.names', table)
+    workers.LatestOnly.interrupter = staticmethod(lambda: None)
 
 
 # --- GUI Classes ---
+class TreePager:
+    """Keeps a sliding window of keyset pages from a store view in a Treeview.
+
+    Only the pages around the visible area live in the widget: scrolling near
+    either edge fetches the adjacent page and drops the one farthest away.
+    Pages hold row cursors (see store.View.cursor); the last cursor value is
+    the row key, which is also the item iid.
+
+    Clicking a column heading sorts by that column and clicking it again
+    reverses the order; both, like the column filters, are done in SQL.
+
+    Pages are fetched on the pager's own worker thread, so a slow query or
+    a lock held by another workstation never freezes the window. A new
+    request cancels the one still running; the tab shows a loading mark
+    meanwhile.
+    """
+
+    def __init__(self, tree, view, page_size=store.PAGE_SIZE, max_pages=5, scrollbar=None):
+        self.tree = tree
+        self.view = view
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.scrollbar = scrollbar
+        self.filters = []
+        self.column_filters = {}
+        self.sort = None
+        self.fixed = False      # showing a result set (show_rows) rather than pages
+        self.pages = deque()
+        self.at_start = self.at_end = True
+        self._pending = False
+        self.loader = workers.LatestOnly(f'pager-{view}')
+        self.indicator = LoadingIndicator.of(tree)
+        tree.configure(yscrollcommand=self.on_scroll)
+        # Tree columns line up with the view's display columns (row[1:]).
+        self.headings = {}
+        for col, (name, _) in zip(tree['columns'], store.VIEWS[view].columns):
+            self.headings[name] = (col, tree.heading(col, 'text'))
+            tree.heading(col, command=lambda n=name: self.sort_by(n))
+
+    def reload(self, filters=None):
+        """Start over from the first page; the current rows stay until it arrives."""
+        if filters is not None:
+            self.filters = filters
+        self._load(self.show_first)
+
+    def show_query(self, fn, *args):
+        """Replace the contents with the rows ``fn(*args)`` returns, e.g. search
+        hits, running it on the pager's worker like a page fetch."""
+        self._pending = True
+        self.indicator.set(self, True)
+        self.loader.submit(fn, *args, callback=self._loaded(self.show_rows), errback=self._failed)
+
+    def _load(self, show, after=None, before=None):
+        # Arguments are taken now, on the Tk thread; the worker only queries.
+        self._pending = True
+        self.indicator.set(self, True)
+        self.loader.submit(store.fetch_page, self.view, after, before, self.page_size, self.all_filters(),
+                           self.sort, callback=self._loaded(show), errback=self._failed)
+
+    def _loaded(self, show):
+        def deliver(rows):
+            self._pending = False
+            self.indicator.set(self, False)
+            show(rows)
+        return deliver
+
+    def _failed(self, exc):
+        self._pending = False
+        self.indicator.set(self, False)
+        messagebox.showerror('Erro', f'Falha ao carregar a lista: {exc}')
+
+    def show_first(self, rows):
+        self.tree.delete(*self.tree.get_children())
+        self.pages.clear()
+        self.fixed = False
+        self.at_start = True
+        self.at_end = False
+        self.append_page(rows)
+
+    def sort_by(self, name):
+        """Sort by a view column; ascending first, then toggling."""
+        descending = self.sort is not None and self.sort[0] == name and not self.sort[1]
+        self.sort = (name, descending)
+        for column, (col, text) in self.headings.items():
+            arrow = (' ▼' if descending else ' ▲') if column == name else ''
+            self.tree.heading(col, text=text + arrow)
+        self.reload()
+
+    def filter_columns(self, values):
+        """Show only rows whose columns contain the given texts ({name: text})."""
+        self.column_filters = {name: text for name, text in values.items() if text}
+        self.reload()
+
+    def all_filters(self):
+        return self.filters + [(name, 'contains', text) for name, text in self.column_filters.items()]
+
+    def load_next(self):
+        self._pending = False
+        if self.at_end:
+            return
+        self._load(self.append_page, after=self.pages[-1][-1] if self.pages else None)
+
+    def append_page(self, rows):
+        self.at_end = len(rows) < self.page_size
+        # A row edited while the page was loading may already be shown.
+        rows = [row for row in rows if not self.tree.exists(row[0])]
+        if not rows:
+            return
+        for row in rows:
+            self.tree.insert('', 'end', iid=row[0], text=row[0], values=row[1:])
+        self.pages.append([self._cursor(row) for row in rows])
+        while len(self.pages) > self.max_pages:
+            dropped = self.pages.popleft()
+            self.tree.delete(*[c[-1] for c in dropped])
+            # Deleting rows above the viewport would make the content jump.
+            self.tree.yview_scroll(-len(dropped), 'units')
+            self.at_start = False
+
+    def load_previous(self):
+        self._pending = False
+        if self.at_start or not self.pages:
+            return
+        self._load(self.prepend_page, before=self.pages[0][0])
+
+    def prepend_page(self, rows):
+        self.at_start = len(rows) < self.page_size
+        rows = [row for row in rows if not self.tree.exists(row[0])]
+        if not rows:
+            return
+        for index, row in enumerate(rows):
+            self.tree.insert('', index, iid=row[0], text=row[0], values=row[1:])
+        self.pages.appendleft([self._cursor(row) for row in rows])
+        self.tree.yview_scroll(len(rows), 'units')
+        while len(self.pages) > self.max_pages:
+            self.tree.delete(*[c[-1] for c in self.pages.pop()])
+            self.at_end = False
+
+    def show_rows(self, rows):
+        """Replace the contents with a fixed result set, e.g. search hits."""
+        self.tree.delete(*self.tree.get_children())
+        self.pages.clear()
+        for row in rows:
+            self.tree.insert('', 'end', iid=row[0], text=row[0], values=row[1:])
+        if rows:
+            self.pages.append([self._cursor(row) for row in rows])
+        self.at_start = self.at_end = True
+        self.fixed = True
+
+    def remove(self, key):
+        """Drop a deleted row from the list."""
+        if not self.tree.exists(key):
+            return
+        self.tree.delete(key)
+        for cursors in self.pages:
+            for i, cursor in enumerate(cursors):
+                if cursor[-1] == key:
+                    del cursors[i]
+                    break
+        self.pages = deque(cursors for cursors in self.pages if cursors)
+
+    def apply_changes(self, changed):
+        """Patch in rows changed elsewhere; ``changed`` is from changes.since()."""
+        table = store.VIEWS[self.view].source
+        if table not in changed:
+            return
+        keys = changed[table]
+        if keys is None:
+            if not self.fixed:
+                self.reload()
+            return
+        workers.submit(self.fetch_rows, self.view, keys, callback=self.apply_rows)
+
+    @staticmethod
+    def fetch_rows(view, keys):
+        return [(key, store.fetch_row(view, key)) for key in keys]
+
+    def apply_rows(self, rows):
+        for key, row in rows:
+            if row is None or (self.tree.exists(key) and not self._matches(row)):
+                self.remove(key)
+            elif self.fixed:
+                # Search hits are a fixed set: refresh them, add nothing.
+                if self.tree.exists(key):
+                    self.tree.item(key, values=row[1:])
+            else:
+                self.upsert(row)
+
+    def upsert(self, row):
+        """Show an inserted or updated row without reloading the list."""
+        key = row[0]
+        if self.tree.exists(key):
+            self.tree.item(key, values=row[1:])
+            return
+        if not self._matches(row):
+            return
+        cursor = self._cursor(row)
+        if not self.pages:
+            if self.at_end:
+                self.pages.append([cursor])
+                self.tree.insert('', 'end', iid=key, text=key, values=row[1:])
+            return
+        if self._precedes(cursor, self.pages[0][0]) and not self.at_start:
+            return  # belongs to a page that is not loaded
+        offset = 0
+        for page_no, cursors in enumerate(self.pages):
+            last_page = page_no == len(self.pages) - 1
+            if self._precedes(cursor, cursors[-1]) or (last_page and self.at_end):
+                pos = next((i for i, c in enumerate(cursors) if self._precedes(cursor, c)), len(cursors))
+                cursors.insert(pos, cursor)
+                self.tree.insert('', offset + pos, iid=key, text=key, values=row[1:])
+                return
+            offset += len(cursors)
+
+    def _cursor(self, row):
+        return store.VIEWS[self.view].cursor(row, self.sort)
+
+    def _precedes(self, a, b):
+        # SQLite sorts NULL before any value.
+        a = tuple((v is not None, v) for v in a)
+        b = tuple((v is not None, v) for v in b)
+        return a > b if store.VIEWS[self.view].ordering(self.sort)[1] else a < b
+
+    def _matches(self, row):
+        index = store.VIEWS[self.view].index
+        for name, op, value in self.all_filters():
+            cell = row[index[name]]
+            if op == 'contains' and (cell is None or value.lower() not in str(cell).lower()):
+                return False
+            if op == '=' and cell != value:
+                return False
+            if op in ('>=', '<') and (cell is None or (cell >= value) != (op == '>=')):
+                return False
+        return True
+
+    def on_scroll(self, first, last):
+        if self.scrollbar is not None:
+            self.scrollbar.set(first, last)
+        if self._pending:
+            return
+        if float(last) >= 0.95 and not self.at_end:
+            self._pending = True
+            self.tree.after_idle(self.load_next)
+        elif float(first) <= 0.05 and not self.at_start:
+            self._pending = True
+            self.tree.after_idle(self.load_previous)
+
+
+class LoadingIndicator:
+    """Marks a notebook tab while any of its background loads is running.
+
+    Sources (pagers, tabs) report themselves busy or idle; the tab title gets
+    LOADING_MARK and the busy cursor shows until all of them are idle.
+    """
+
+    def __init__(self, tab):
+        self.tab = tab
+        self.busy = set()
+
+    @classmethod
+    def of(cls, widget):
+        """The indicator of the notebook tab holding ``widget``, shared by its sources."""
+        tab = widget
+        while tab.master is not None and not isinstance(tab.master, ttk.Notebook):
+            tab = tab.master
+        if not hasattr(tab, 'loading_indicator'):
+            tab.loading_indicator = cls(tab)
+        return tab.loading_indicator
+
+    def set(self, source, busy):
+        was_busy = bool(self.busy)
+        if busy:
+            self.busy.add(source)
+        else:
+            self.busy.discard(source)
+        if bool(self.busy) != was_busy:
+            self.show(bool(self.busy))
+
+    def show(self, busy):
+        try:
+            self.tab.configure(cursor='watch' if busy else '')
+            notebook = self.tab.master
+            if isinstance(notebook, ttk.Notebook):
+                text = notebook.tab(self.tab, 'text').removeprefix(LOADING_MARK)
+                notebook.tab(self.tab, text=LOADING_MARK + text if busy else text)
+        except TclError:
+            pass    # the tab was destroyed while loading
+
+
+class ColumnFilters(Frame):
+    """A filter entry per list column; typing narrows the pager's rows."""
+
+    def __init__(self, master, pager):
+        super().__init__(master)
+        self.pager = pager
+        self.vars = {}
+        self.after_id = None
+        shown = pager.tree['displaycolumns']
+        for i, (name, (col, text)) in enumerate(pager.headings.items()):
+            if shown != ('#all',) and col not in shown:
+                continue
+            Label(self, text=text).grid(row=0, column=2 * i)
+            var = self.vars[name] = StringVar()
+            entry = Entry(self, textvariable=var, width=14)
+            entry.grid(row=0, column=2 * i + 1)
+            entry.bind('<KeyRelease>', self.schedule)
+
+    def schedule(self, event=None):
+        # Debounce like the student search: filter once typing pauses.
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+        self.after_id = self.after(SEARCH_DELAY_MS, self.apply)
+
+    def apply(self):
+        self.after_id = None
+        self.pager.filter_columns({name: var.get().strip() for name, var in self.vars.items()})
+
+
 class LoginWindow(Tk):
     def __init__(self):
         super().__init__()
@@ -228,17 +539,13 @@ class LoginWindow(Tk):
         Button(self, text='Esqueci a senha', command=self.recover).pack()
 
     def login(self):
+        started = time.perf_counter()
         user = self.user_var.get().strip()
         pwd = self.pass_var.get().strip()
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT password FROM users WHERE username=?', (user,))
-        row = cur.fetchone()
-        conn.close()
-        if row and row[0] == pwd:
+        if store.check_login(user, pwd):
             save_last_user(user)
             self.destroy()
-            app = MainApp(user)
+            app = MainApp(user, started)
             app.mainloop()
         else:
             messagebox.showerror('Erro', 'Usuário ou senha inválidos')
@@ -252,56 +559,132 @@ class LoginWindow(Tk):
 
 
 class MainApp(Tk):
-    def __init__(self, user):
+    def __init__(self, user, started=None):
         super().__init__()
         self.user = user
+        self.started = time.perf_counter() if started is None else started
         self.title('Sistema Escolar')
         apply_basic_style(self)
         make_fullscreen(self)
         self.protocol('WM_DELETE_WINDOW', self.on_close)
+        workers.install(self)
+        diagnostics.watch(self)
+        self.bind('<Control-Shift-KeyPress-D>', lambda e: self.show_diagnostics())
 
         Label(self, text=f'Usuário logado: {self.user}').pack(anchor='e')
         Button(self, text='Bloquear', command=self.lock, width=10).pack(anchor='e')
-
-        nb = ttk.Notebook(self)
-        nb.pack(fill='both', expand=True)
-
-        self.cadastro_tab = CadastroTab(nb, self.user)
-        nb.add(self.cadastro_tab, text='Cadastro')
-
-        self.matriculas_tab = MatriculasTab(nb, self.user)
-        nb.add(self.matriculas_tab, text='Matrículas')
-
-        self.turmas_tab = CrudTab(nb, 'turmas', self.user, (('nome', 'Nome'), ('horario', 'Horário')))
-        nb.add(self.turmas_tab, text='Turmas')
-
-        self.cursos_tab = CrudTab(nb, 'cursos', self.user, (('nome', 'Nome'),))
-        nb.add(self.cursos_tab, text='Cursos')
-
-        self.materiais_tab = CrudTab(nb, 'materiais', self.user, (('nome', 'Nome'), ('valor', 'Valor')))
-        nb.add(self.materiais_tab, text='Materiais didáticos')
-
-        self.valores_tab = CrudTab(nb, 'valores', self.user, (('descricao', 'Descrição'), ('valor', 'Valor')))
-        nb.add(self.valores_tab, text='Valores')
-
-        self.estoque_tab = CrudTab(nb, 'estoque', self.user, (('nome', 'Nome'), ('quantidade', 'Qtd')))
-        nb.add(self.estoque_tab, text='Estoque')
-
-        self.financeiro_tab = FinanceiroTab(nb, self.user)
-        nb.add(self.financeiro_tab, text='Financeiro')
-
-        self.users_tab = UsersTab(nb, self.user)
-        nb.add(self.users_tab, text='Gerenciamento de Usuários')
-
-        self.logs_tab = LogsTab(nb)
-        nb.add(self.logs_tab, text='Logs')
+        Button(self, text='Exportar', command=ExportWindow, width=10,
+               state='disabled' if SERVER_ADDRESS else 'normal').pack(anchor='e')
+        # The render processes read the database file directly.
+        Button(self, text='Documentos', command=lambda: DocumentsWindow(self.user), width=10,
+               state='disabled' if SERVER_ADDRESS else 'normal').pack(anchor='e')
+
+        self.nb = ttk.Notebook(self)
+        self.nb.pack(fill='both', expand=True)
+
+        # Tabs are only built (and their data loaded) the first time they are
+        # selected; until then each one is an empty placeholder frame.
+        self.pending_tabs = {}
+        self.tab_attrs = []
+        # Taken before any tab loads, so no later commit can be missed.
+        self.change_mark = changes.mark()
+        for attr, text, factory in (
+            ('cadastro_tab', 'Cadastro', lambda m: CadastroTab(m, self.user)),
+            ('matriculas_tab', 'Matrículas', lambda m: MatriculasTab(m, self.user)),
+            ('turmas_tab', 'Turmas', lambda m: CrudTab(m, 'turmas', self.user, (('nome', 'Nome'), ('horario', 'Horário')))),
+            ('cursos_tab', 'Cursos', lambda m: CrudTab(m, 'cursos', self.user, (('nome', 'Nome'),))),
+            ('materiais_tab', 'Materiais didáticos', lambda m: CrudTab(m, 'materiais', self.user, (('nome', 'Nome'), ('valor', 'Valor')))),
+            ('valores_tab', 'Valores', lambda m: CrudTab(m, 'valores', self.user, (('descricao', 'Descrição'), ('valor', 'Valor')))),
+            ('estoque_tab', 'Estoque', lambda m: CrudTab(m, 'estoque', self.user, (('nome', 'Nome'), ('quantidade', 'Qtd')))),
+            ('financeiro_tab', 'Financeiro', lambda m: FinanceiroTab(m, self.user)),
+            ('dashboard_tab', 'Painel financeiro', lambda m: DashboardTab(m)),
+            ('users_tab', 'Gerenciamento de Usuários', lambda m: UsersTab(m, self.user)),
+            ('logs_tab', 'Logs', lambda m: LogsTab(m)),
+        ):
+            placeholder = Frame(self.nb)
+            self.nb.add(placeholder, text=text)
+            self.pending_tabs[str(placeholder)] = (attr, factory)
+            self.tab_attrs.append(attr)
+            setattr(self, attr, None)
+        self.nb.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.on_tab_changed()
+        self.after_idle(self.report_ready)
+        if SERVER_ADDRESS is None:     # otherwise the server runs them
+            upkeep.start()
+        self.data_version = None
+        self.checking_changes = False
+        self.after(CHANGE_POLL_MS, self.poll_changes)
+
+    def on_tab_changed(self, event=None):
+        name = self.nb.select()
+        if name not in self.pending_tabs:
+            return
+        attr, factory = self.pending_tabs.pop(name)
+        t0 = time.perf_counter()
+        tab = factory(self.nametowidget(name))
+        tab.pack(fill='both', expand=True)
+        setattr(self, attr, tab)
+        log.info('Aba %s construída em %.1f ms', attr, (time.perf_counter() - t0) * 1000)
+
+    def poll_changes(self):
+        """Look for commits by other workstations and patch the open tabs.
+
+        Locally PRAGMA data_version says whether anything was committed at
+        all, so an idle database costs no query; a data server is asked
+        directly.
+        """
+        self.after(CHANGE_POLL_MS, self.poll_changes)
+        if self.checking_changes:
+            return
+        if SERVER_ADDRESS is None:
+            version = changes.data_version()
+            if version == self.data_version:
+                return
+            self.data_version = version
+        self.checking_changes = True
+        workers.submit(changes.since, self.change_mark, callback=self.apply_changes,
+                       errback=self.changes_failed)
+
+    def apply_changes(self, result):
+        self.checking_changes = False
+        self.change_mark, changed = result
+        if not changed:
+            return
+        for table in changed:
+            if table in refdata.REFERENCE_TABLES:
+                refdata.cache.invalidate(table)
+        for attr in self.tab_attrs:
+            tab = getattr(self, attr)
+            if tab is None:
+                continue
+            pager = getattr(tab, 'pager', None)
+            if pager is not None:
+                pager.apply_changes(changed)
+            elif attr == 'dashboard_tab' and tab.winfo_ismapped() and {'cadastro', 'financeiro'} & changed.keys():
+                tab.refresh()
+
+    def changes_failed(self, exc):
+        self.checking_changes = False
+        log.warning('Falha ao consultar alterações: %s', exc)
+
+    def show_diagnostics(self):
+        """Open the hidden diagnostics tab (Ctrl+Shift+D)."""
+        if getattr(self, 'diagnostics_tab', None) is None:
+            self.diagnostics_tab = DiagnosticsTab(self.nb)
+            self.nb.add(self.diagnostics_tab, text='Diagnóstico')
+        self.nb.select(self.diagnostics_tab)
+
+    def report_ready(self):
+        log.info('Tempo até a tela utilizável: %.1f ms', (time.perf_counter() - self.started) * 1000)
 
     def lock(self):
+        audit_writer.flush()
         self.destroy()
         LoginWindow().mainloop()
 
     def on_close(self):
         if messagebox.askyesno('Sair', 'Deseja realmente sair?'):
+            audit_writer.flush()
             self.destroy()
 
 
@@ -312,22 +695,11 @@ class CadastroTab(Frame):
         self.build_form()
 
     def build_form(self):
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT id, nome FROM turmas')
-        turmas = cur.fetchall()
-        cur.execute('SELECT id, nome FROM cursos')
-        cursos = cur.fetchall()
-        cur.execute('SELECT id, nome FROM materiais')
-        mats = cur.fetchall()
-        cur.execute('SELECT id, descricao FROM valores')
-        valores = cur.fetchall()
-        conn.close()
-
         row = 0
         Label(self, text='Nome completo').grid(row=row, column=0, sticky=W)
         self.nome_var = StringVar()
-        Entry(self, textvariable=self.nome_var, width=40).grid(row=row, column=1)
+        self.nome_entry = Entry(self, textvariable=self.nome_var, width=40)
+        self.nome_entry.grid(row=row, column=1)
         row += 1
 
         self.resp_var = StringVar()
@@ -414,25 +786,46 @@ class CadastroTab(Frame):
 
         Label(self, text='Turma').grid(row=row, column=0, sticky=W)
         self.turma_var = StringVar()
-        ttk.Combobox(self, textvariable=self.turma_var, values=[f'{t[0]} - {t[1]}' for t in turmas]).grid(row=row, column=1)
+        self.ref_combobox(self.turma_var, 'turmas').grid(row=row, column=1)
         row += 1
 
         Label(self, text='Curso').grid(row=row, column=0, sticky=W)
         self.curso_var = StringVar()
-        ttk.Combobox(self, textvariable=self.curso_var, values=[f'{c[0]} - {c[1]}' for c in cursos]).grid(row=row, column=1)
+        self.ref_combobox(self.curso_var, 'cursos').grid(row=row, column=1)
         row += 1
 
         Label(self, text='Material didático').grid(row=row, column=0, sticky=W)
         self.mat_var = StringVar()
-        ttk.Combobox(self, textvariable=self.mat_var, values=[f'{m[0]} - {m[1]}' for m in mats]).grid(row=row, column=1)
+        self.ref_combobox(self.mat_var, 'materiais').grid(row=row, column=1)
         row += 1
 
         Label(self, text='Valor').grid(row=row, column=0, sticky=W)
         self.valor_var = StringVar()
-        ttk.Combobox(self, textvariable=self.valor_var, values=[f'{v[0]} - {v[1]}' for v in valores]).grid(row=row, column=1)
+        self.ref_combobox(self.valor_var, 'valores').grid(row=row, column=1)
+        row += 1
+
+        self.save_button = Button(self, text='Salvar', command=self.save)
+        self.save_button.grid(row=row, column=1, pady=10)
+        Button(self, text='Importar planilha', command=self.import_sheet).grid(row=row, column=2, pady=10)
         row += 1
 
-        Button(self, text='Salvar', command=self.save).grid(row=row, column=1, pady=10)
+        # Students this one may duplicate, checked as the identifying fields
+        # are filled in and again on save.
+        self.dup_var = StringVar()
+        Label(self, textvariable=self.dup_var, fg='red', justify=LEFT).grid(row=row, column=0, columnspan=3, sticky=W)
+        self.dup_checker = workers.LatestOnly('dedupe')
+        # (identity, candidates) of the last finished check; save() reuses it
+        # when the identifying fields have not changed since.
+        self.checked = None
+        for entry in (self.nome_entry, self.nasc_entry, self.cpf_entry, self.tel_entry):
+            entry.bind('<FocusOut>', self.check_duplicates, add='+')
+
+    def ref_combobox(self, var, table):
+        # Values are read from the reference cache each time the list opens,
+        # so rows added in the CRUD tabs show up without re-querying.
+        box = ttk.Combobox(self, textvariable=var)
+        box.configure(postcommand=lambda: box.configure(values=refdata.cache.choices(table)))
+        return box
 
     def sync_resp(self):
         if self.resp_chk.get():
@@ -444,52 +837,105 @@ class CadastroTab(Frame):
         self.idade_var.set(str(self.calc_idade(self.nasc_var.get())))
 
     def calc_idade(self, nasc):
-        try:
-            d = datetime.datetime.strptime(nasc, '%d/%m/%Y').date()
-            today = datetime.date.today()
-            return today.year - d.year - ((today.month, today.day) < (d.month, d.day))
-        except ValueError:
-            return 0
+        return calc_idade(nasc)
+
+    def identity(self):
+        return {'nome': self.nome_var.get(), 'data_nascimento': self.nasc_var.get(),
+                'tel_principal': self.tel_var.get(), 'cpf': self.cpf_var.get()}
+
+    def check_duplicates(self, event=None):
+        if not self.nome_var.get().strip() and not self.cpf_var.get().strip():
+            self.dup_var.set('')
+            return
+        identity = self.identity()
+        if self.checked is not None and self.checked[0] == identity:
+            return
+        self.dup_checker.submit(dedupe.candidates, identity,
+                                callback=lambda found: self.show_duplicates(identity, found),
+                                errback=lambda e: log.warning('Falha ao procurar duplicados: %s', e))
+
+    def show_duplicates(self, identity, found):
+        self.checked = (identity, found)
+        self.dup_var.set(f'Possível duplicado:\n{describe_duplicates(found)}' if found else '')
 
     def save(self):
-        idade = self.calc_idade(self.nasc_var.get())
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('''INSERT INTO cadastro(
-            data_matricula, nome, data_nascimento, idade, responsavel, cpf, rg,
-            tel_principal, tel_recado, cep, logradouro, numero, complemento,
-            bairro, cidade, email, instagram, turma_id, curso_id, material_id,
-            valor_id)
-            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', (
-                datetime.date.today().isoformat(),
-                self.nome_var.get(),
-                self.nasc_var.get(),
-                idade,
-                self.resp_var.get(),
-                self.cpf_var.get(),
-                '',  # rg not implemented
-                self.tel_var.get(),
-                self.tel2_var.get(),
-                self.cep_var.get(),
-                self.log_var.get(),
-                self.num_var.get(),
-                self.comp_var.get(),
-                self.bairro_var.get(),
-                self.cidade_var.get(),
-                self.email_var.get(),
-                self.inst_var.get(),
-                self.get_id(self.turma_var.get()),
-                self.get_id(self.curso_var.get()),
-                self.get_id(self.mat_var.get()),
-                self.get_id(self.valor_var.get())
-        ))
-        conn.commit()
-        record_id = cur.lastrowid
-        conn.close()
-        log_action(self.user, 'add', 'cadastro', record_id)
+        # The duplicate search runs off the Tk thread; the save itself
+        # continues in save_checked once its result is in.
+        identity = self.identity()
+        if self.checked is not None and self.checked[0] == identity:
+            self.save_checked(identity, self.checked[1])
+            return
+        self.save_button.configure(state='disabled')
+
+        def failed(e):
+            self.save_button.configure(state='normal')
+            messagebox.showerror('Erro', f'Falha ao procurar duplicados: {e}')
+
+        def checked(found):
+            self.save_button.configure(state='normal')
+            self.show_duplicates(identity, found)
+            self.save_checked(identity, found)
+
+        self.dup_checker.submit(dedupe.candidates, identity, callback=checked, errback=failed)
+
+    @timed
+    def save_checked(self, identity, found):
+        if self.identity() != identity:
+            # Edited while the search ran; check the new values instead.
+            self.save()
+            return
+        same_cpf = [c for c in found if dedupe.SAME_CPF in c[3]]
+        if same_cpf:
+            messagebox.showerror('Erro', f'CPF já cadastrado:\n{describe_duplicates(same_cpf[:1])}')
+            return
+        if found and not messagebox.askyesno('Possível duplicado',
+                                             f'{describe_duplicates(found)}\n\nSalvar mesmo assim?'):
+            return
+        record = {
+            'data_matricula': datetime.date.today().isoformat(),
+            'nome': self.nome_var.get(),
+            'data_nascimento': self.nasc_var.get(),
+            'idade': self.calc_idade(self.nasc_var.get()),
+            'responsavel': self.resp_var.get(),
+            'cpf': self.cpf_var.get(),
+            'rg': '',  # rg not implemented
+            'tel_principal': self.tel_var.get(),
+            'tel_recado': self.tel2_var.get(),
+            'cep': self.cep_var.get(),
+            'logradouro': self.log_var.get(),
+            'numero': self.num_var.get(),
+            'complemento': self.comp_var.get(),
+            'bairro': self.bairro_var.get(),
+            'cidade': self.cidade_var.get(),
+            'email': self.email_var.get(),
+            'instagram': self.inst_var.get(),
+            'turma_id': self.get_id(self.turma_var.get()),
+            'curso_id': self.get_id(self.curso_var.get()),
+            'material_id': self.get_id(self.mat_var.get()),
+            'valor_id': self.get_id(self.valor_var.get()),
+        }
+        try:
+            row = store.add_cadastro(record)
+        except sqlite3.IntegrityError:
+            # Registered by another workstation since the check above.
+            messagebox.showerror('Erro', 'CPF já cadastrado')
+            return
+        log_action(self.user, 'add', 'cadastro', row[0])
         messagebox.showinfo('Sucesso', 'Cadastro salvo')
         self.clear()
-        self.master.master.matriculas_tab.refresh()
+        matriculas_tab = self.winfo_toplevel().matriculas_tab
+        if matriculas_tab is not None:
+            matriculas_tab.pager.upsert(row)
+
+    def import_sheet(self):
+        path = filedialog.askopenfilename(filetypes=[('Planilhas', '*.csv *.xlsx')])
+        if path:
+            ImportWindow(path, self.user, self.imported)
+
+    def imported(self):
+        matriculas_tab = self.winfo_toplevel().matriculas_tab
+        if matriculas_tab is not None:
+            matriculas_tab.refresh()
 
     def get_id(self, value):
         if not value:
@@ -502,15 +948,289 @@ class CadastroTab(Frame):
                     self.num_var, self.comp_var, self.bairro_var,
                     self.cidade_var, self.email_var, self.inst_var,
                     self.turma_var, self.curso_var, self.mat_var,
-                    self.valor_var, self.idade_var]:
+                    self.valor_var, self.idade_var, self.dup_var]:
             var.set('')
         self.resp_chk.set(0)
+        self.dup_checker.cancel()
+        self.checked = None
+
+
+class ImportWindow(Toplevel):
+    def __init__(self, path, user, on_done=None):
+        super().__init__()
+        self.title('Importar alunos')
+        apply_basic_style(self)
+        center_window(self, 420, 140)
+        self.name = os.path.basename(path)
+        self.user = user
+        self.on_done = on_done
+        Label(self, text=self.name).pack(pady=5)
+        self.progress = ttk.Progressbar(self, length=380, mode='determinate')
+        self.progress.pack(pady=5)
+        self.status_var = StringVar(value='Lendo planilha...')
+        Label(self, textvariable=self.status_var).pack()
+        workers.submit(importer.import_file, path, self.report_progress,
+                       callback=self.finished, errback=self.failed)
+
+    def report_progress(self, done, total):
+        # Called on the worker thread.
+        workers.call_soon(self.show_progress, done, total)
+
+    def show_progress(self, done, total):
+        self.progress.configure(maximum=total, value=done)
+        self.status_var.set(f'Gravando {done} de {total}')
+
+    def finished(self, result):
+        log_action(self.user, 'import', 'cadastro', f'{result.inserted} registros de {self.name}')
+        msg = f'{result.inserted} alunos importados.'
+        if result.errors:
+            lines = '\n'.join(f'Linha {line}: {error}' for line, error in result.errors[:10])
+            msg += f'\n{len(result.errors)} linhas ignoradas:\n{lines}'
+        if result.warnings:
+            lines = '\n'.join(f'Linha {line}: {warning}' for line, warning in result.warnings[:10])
+            msg += f'\n{len(result.warnings)} possíveis duplicados importados:\n{lines}'
+        messagebox.showinfo('Importação', msg, parent=self)
+        self.destroy()
+        if self.on_done:
+            self.on_done()
+
+    def failed(self, e):
+        messagebox.showerror('Erro', f'Falha na importação: {e}', parent=self)
+        self.destroy()
+
+
+class ExportWindow(Toplevel):
+    def __init__(self):
+        super().__init__()
+        self.title('Exportar dados')
+        apply_basic_style(self)
+        center_window(self, 420, 420)
+        Label(self, text='Dados').grid(row=0, column=0, sticky=W)
+        self.dataset_var = StringVar(value='cadastro')
+        box = ttk.Combobox(self, textvariable=self.dataset_var, values=list(export.DATASETS), state='readonly')
+        box.grid(row=0, column=1, sticky=W)
+        box.bind('<<ComboboxSelected>>', lambda e: self.load_columns())
+        Label(self, text='Colunas').grid(row=1, column=0, sticky=NW)
+        self.columns_list = Listbox(self, selectmode='multiple', exportselection=False, height=12)
+        self.columns_list.grid(row=1, column=1, sticky=W)
+        Label(self, text='De (dd/mm/aaaa)').grid(row=2, column=0, sticky=W)
+        self.start_entry = Entry(self)
+        self.start_entry.grid(row=2, column=1, sticky=W)
+        self.start_entry.bind('<KeyRelease>', lambda e: mask_date(self.start_entry))
+        Label(self, text='Até (dd/mm/aaaa)').grid(row=3, column=0, sticky=W)
+        self.end_entry = Entry(self)
+        self.end_entry.grid(row=3, column=1, sticky=W)
+        self.end_entry.bind('<KeyRelease>', lambda e: mask_date(self.end_entry))
+        self.export_button = Button(self, text='Exportar', command=self.run)
+        self.export_button.grid(row=4, column=1, sticky=W, pady=10)
+        self.status_var = StringVar()
+        Label(self, textvariable=self.status_var).grid(row=5, column=0, columnspan=2)
+        self.load_columns()
+
+    def load_columns(self):
+        self.columns_list.delete(0, END)
+        for col in export.DATASETS[self.dataset_var.get()].columns:
+            self.columns_list.insert(END, col)
+        self.columns_list.selection_set(0, END)
+
+    def parse_date(self, entry):
+        text = entry.get()
+        return datetime.datetime.strptime(text, '%d/%m/%Y').date() if text else None
+
+    def run(self):
+        try:
+            start, end = self.parse_date(self.start_entry), self.parse_date(self.end_entry)
+        except ValueError:
+            messagebox.showerror('Erro', 'Data inválida', parent=self)
+            return
+        columns = [self.columns_list.get(i) for i in self.columns_list.curselection()]
+        if not columns:
+            messagebox.showerror('Erro', 'Selecione ao menos uma coluna', parent=self)
+            return
+        path = filedialog.asksaveasfilename(parent=self, defaultextension='.csv', filetypes=[
+            ('CSV', '*.csv'), ('JSON lines', '*.jsonl'), ('Excel', '*.xlsx')])
+        if not path:
+            return
+        self.export_button.configure(state='disabled')
+        self.status_var.set('Exportando...')
+        workers.submit(export.export, self.dataset_var.get(), path, columns, start, end, self.report_progress,
+                       callback=self.finished, errback=self.failed)
+
+    def report_progress(self, rows):
+        # Called on the worker thread.
+        workers.call_soon(self.status_var.set, f'{rows} linhas exportadas...')
+
+    def finished(self, rows):
+        self.export_button.configure(state='normal')
+        self.status_var.set(f'Concluído: {rows} linhas')
+
+    def failed(self, e):
+        self.export_button.configure(state='normal')
+        self.status_var.set('')
+        messagebox.showerror('Erro', f'Falha na exportação: {e}', parent=self)
+
+
+class DocumentsWindow(Toplevel):
+    """Declarations or receipts for a whole turma or month, rendered by
+    documents.generate() on a process pool while this window shows progress."""
+
+    def __init__(self, user):
+        super().__init__()
+        self.title('Gerar documentos')
+        apply_basic_style(self)
+        center_window(self, 420, 260)
+        self.user = user
+        self.cancel_event = None
+        self.kinds = {spec.label: kind for kind, spec in documents.KINDS.items()}
+        Label(self, text='Documento').grid(row=0, column=0, sticky=W)
+        self.kind_var = StringVar(value=next(iter(self.kinds)))
+        ttk.Combobox(self, textvariable=self.kind_var, values=list(self.kinds), state='readonly',
+                     width=28).grid(row=0, column=1, sticky=W)
+        Label(self, text='Turma').grid(row=1, column=0, sticky=W)
+        self.turma_var = StringVar()
+        box = ttk.Combobox(self, textvariable=self.turma_var, state='readonly', width=28)
+        box.configure(postcommand=lambda: box.configure(values=refdata.cache.choices('turmas')))
+        box.grid(row=1, column=1, sticky=W)
+        Label(self, text='ou Mês (mm/aaaa)').grid(row=2, column=0, sticky=W)
+        self.mes_var = StringVar()
+        Entry(self, textvariable=self.mes_var).grid(row=2, column=1, sticky=W)
+        Label(self, text='Formato').grid(row=3, column=0, sticky=W)
+        self.format_var = StringVar(value='pdf')
+        formats = Frame(self)
+        formats.grid(row=3, column=1, sticky=W)
+        for fmt in documents.FORMATS:
+            Radiobutton(formats, text=fmt.upper(), variable=self.format_var, value=fmt).pack(side=LEFT)
+        buttons = Frame(self)
+        buttons.grid(row=4, column=1, sticky=W, pady=10)
+        self.run_button = Button(buttons, text='Gerar', command=self.run)
+        self.run_button.pack(side=LEFT)
+        self.cancel_button = Button(buttons, text='Cancelar', command=self.cancel, state='disabled')
+        self.cancel_button.pack(side=LEFT, padx=5)
+        self.progress = ttk.Progressbar(self, length=380, mode='determinate')
+        self.progress.grid(row=5, column=0, columnspan=2, padx=5)
+        self.status_var = StringVar()
+        Label(self, textvariable=self.status_var).grid(row=6, column=0, columnspan=2)
+        self.protocol('WM_DELETE_WINDOW', self.close)
+
+    def run(self):
+        turma = self.turma_var.get()
+        mes = self.mes_var.get().strip()
+        if bool(turma) == bool(mes):
+            messagebox.showerror('Erro', 'Escolha uma turma ou informe um mês', parent=self)
+            return
+        if mes:
+            try:
+                mes = datetime.datetime.strptime(mes, '%m/%Y').strftime('%Y-%m')
+            except ValueError:
+                messagebox.showerror('Erro', 'Mês inválido (use mm/aaaa)', parent=self)
+                return
+        directory = filedialog.askdirectory(parent=self, title='Pasta dos documentos')
+        if not directory:
+            return
+        self.kind = self.kinds[self.kind_var.get()]
+        self.cancel_event = threading.Event()
+        self.run_button.configure(state='disabled')
+        self.cancel_button.configure(state='normal')
+        self.status_var.set('Selecionando...')
+        workers.submit(documents.generate, self.kind, directory, self.format_var.get(),
+                       int(turma.split(' - ')[0]) if turma else None, mes or None, None,
+                       self.report_progress, self.cancel_event,
+                       callback=self.finished, errback=self.failed)
+
+    def report_progress(self, done, total):
+        # Called on the worker thread.
+        workers.call_soon(self.show_progress, done, total)
+
+    def show_progress(self, done, total):
+        if self.winfo_exists():
+            self.progress.configure(maximum=max(total, 1), value=done)
+            self.status_var.set(f'{done} de {total} documentos')
+
+    def cancel(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.status_var.set('Cancelando...')
+
+    def close(self):
+        # Running chunks finish on their own; no new ones are started.
+        self.cancel()
+        self.destroy()
+
+    def finished(self, count):
+        log_action(self.user, 'documents', self.kind, f'{count} documentos')
+        if not self.winfo_exists():
+            return
+        self.run_button.configure(state='normal')
+        self.cancel_button.configure(state='disabled')
+        cancelled = self.cancel_event.is_set()
+        self.cancel_event = None
+        self.status_var.set(f'{"Cancelado" if cancelled else "Concluído"}: {count} documentos gerados')
+
+    def failed(self, e):
+        self.cancel_event = None
+        if self.winfo_exists():
+            self.run_button.configure(state='normal')
+            self.cancel_button.configure(state='disabled')
+            self.status_var.set('')
+            messagebox.showerror('Erro', f'Falha ao gerar documentos: {e}', parent=self)
+
+
+class DuplicatesWindow(Toplevel):
+    """Likely duplicate students already registered (dedupe.report), found
+    on a worker; double-clicking a student of a pair opens it."""
+
+    COLUMNS = (('score', 'Semelhança', 80), ('a', 'Matrícula', 70), ('nome_a', 'Nome', 180),
+               ('b', 'Matrícula', 70), ('nome_b', 'Nome', 180), ('motivos', 'Motivos', 260))
+
+    def __init__(self, open_student):
+        super().__init__()
+        self.title('Possíveis duplicados')
+        apply_basic_style(self)
+        center_window(self, 860, 420)
+        self.open_student = open_student
+        self.status_var = StringVar(value='Procurando duplicados...')
+        Label(self, textvariable=self.status_var).pack(anchor=W, padx=5, pady=5)
+        self.tree = ttk.Treeview(self, columns=[c for c, _, _ in self.COLUMNS], show='headings')
+        for col, label, width in self.COLUMNS:
+            self.tree.heading(col, text=label)
+            self.tree.column(col, width=width)
+        self.tree.pack(fill='both', expand=True)
+        self.tree.bind('<Double-1>', self.open_pair)
+        workers.submit(dedupe.report, callback=self.show, errback=self.failed)
+
+    def show(self, pairs):
+        if not self.winfo_exists():
+            return
+        self.status_var.set(f'{len(pairs)} pares encontrados')
+        for score, a, nome_a, b, nome_b, motivos in pairs:
+            self.tree.insert('', END, iid=f'{a}-{b}', values=(f'{score:.0%}', a, nome_a, b, nome_b, ', '.join(motivos)))
+
+    def failed(self, e):
+        if self.winfo_exists():
+            self.status_var.set(f'Falha ao procurar duplicados: {e}')
+
+    def open_pair(self, event):
+        item = self.tree.identify_row(event.y)
+        if item:
+            a, b = item.split('-')
+            # Clicking the second student's columns opens that one.
+            self.open_student(int(b if self.tree.identify_column(event.x) in ('#4', '#5') else a))
 
 
 class MatriculasTab(Frame):
     def __init__(self, master, user):
         super().__init__(master)
         self.user = user
+        bar = Frame(self)
+        bar.pack(fill='x')
+        Label(bar, text='Buscar aluno').pack(side='left')
+        self.search_var = StringVar()
+        search_entry = Entry(bar, textvariable=self.search_var, width=40)
+        search_entry.pack(side='left')
+        search_entry.bind('<KeyRelease>', self.schedule_search)
+        Button(bar, text='Duplicados', command=lambda: DuplicatesWindow(self.open_student)).pack(side='right')
+        self.search_after = None
+        self.details = None
         self.tree = ttk.Treeview(self, columns=('matricula', 'nome', 'turma', 'curso'))
         self.tree.heading('#0', text='ID')
         self.tree.heading('matricula', text='Matrícula')
@@ -518,94 +1238,198 @@ class MatriculasTab(Frame):
         self.tree.heading('turma', text='Turma')
         self.tree.heading('curso', text='Curso')
         self.tree.column('#0', width=30)
-        self.tree.pack(fill='both', expand=True)
         self.tree.bind('<Double-1>', self.open_details)
+        self.pager = TreePager(self.tree, 'matriculas')
+        ColumnFilters(self, self.pager).pack(fill='x')
+        self.tree.pack(fill='both', expand=True)
         self.refresh()
 
+    @timed
     def refresh(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('''SELECT c.matricula, c.nome, t.nome, s.nome
-            FROM cadastro c LEFT JOIN turmas t ON c.turma_id=t.id
-            LEFT JOIN cursos s ON c.curso_id=s.id''')
-        for row in cur.fetchall():
-            self.tree.insert('', 'end', text=row[0], values=row)
-        conn.close()
+        self.pager.reload()
+
+    def schedule_search(self, event=None):
+        # Debounce: only search once typing pauses for SEARCH_DELAY_MS.
+        if self.search_after is not None:
+            self.after_cancel(self.search_after)
+        self.search_after = self.after(SEARCH_DELAY_MS, self.search)
+
+    @timed
+    def search(self):
+        self.search_after = None
+        text = self.search_var.get().strip()
+        # Both go through the pager's worker, so each cancels the other.
+        if not text:
+            self.refresh()
+            return
+        self.pager.show_query(store.search_matriculas, text)
 
     def open_details(self, event):
-        item = self.tree.selection()[0]
-        matricula = self.tree.item(item, 'text')
-        DetailWindow(matricula, self.user)
-
-
-class DetailWindow(Toplevel):
-    def __init__(self, matricula, user):
+        item = self.tree.identify_row(event.y)
+        if not item:
+            return
+        self.open_student(self.tree.item(item, 'text'))
+
+    def open_student(self, matricula):
+        # One panel per tab, rebound to each student opened.
+        if self.details is None or not self.details.winfo_exists():
+            self.details = CadastroPanel(self.user, self.pager.upsert)
+        self.details.show(matricula)
+
+
+# Layout of the student detail/edit panel. widget is 'entry', 'readonly'
+# (never editable) or 'combo' (an 'id - name' choice from the reference table).
+Field = namedtuple('Field', 'column label mask widget table', defaults=(None, 'entry', None))
+
+CADASTRO_FIELDS = (
+    Field('matricula', 'Matrícula', widget='readonly'),
+    Field('data_matricula', 'Data da matrícula'),
+    Field('nome', 'Nome'),
+    Field('data_nascimento', 'Data de nascimento', mask_date),
+    Field('idade', 'Idade'),
+    Field('responsavel', 'Responsável'),
+    Field('cpf', 'CPF', mask_cpf),
+    Field('rg', 'RG'),
+    Field('tel_principal', 'Telefone principal', mask_phone),
+    Field('tel_recado', 'Telefone recado', mask_phone),
+    Field('cep', 'CEP', mask_cep),
+    Field('logradouro', 'Logradouro'),
+    Field('numero', 'Número'),
+    Field('complemento', 'Complemento'),
+    Field('bairro', 'Bairro'),
+    Field('cidade', 'Cidade'),
+    Field('email', 'E-mail'),
+    Field('instagram', 'Instagram'),
+    Field('turma_id', 'Turma', widget='combo', table='turmas'),
+    Field('curso_id', 'Curso', widget='combo', table='cursos'),
+    Field('material_id', 'Material didático', widget='combo', table='materiais'),
+    Field('vencimento', 'Vencimento'),
+    Field('valor_id', 'Valor', widget='combo', table='valores'),
+)
+
+
+class CadastroPanel(Toplevel):
+    """Details of one student, doubling as its edit form.
+
+    The widgets are built once from CADASTRO_FIELDS; show() rebinds their
+    variables to another student, so browsing creates no new widgets, and
+    editing reuses the row already loaded instead of reading it again.
+    """
+
+    def __init__(self, user, on_change=None):
         super().__init__()
-        self.title(f'Detalhes {matricula}')
+        self.user = user
+        self.on_change = on_change
+        self.data = None
+        self.editing = False
         apply_basic_style(self)
-        make_fullscreen(self)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM cadastro WHERE matricula=?', (matricula,))
-        data = cur.fetchone()
-        conn.close()
-        for i, (col, val) in enumerate(zip(CADASTRO_COLUMNS, data)):
-            Label(self, text=col.replace('_', ' ').title()+':').grid(row=i, column=0, sticky=W)
-            Entry(self, state='readonly', width=40, readonlybackground='white',
-                  fg='black',
-                  textvariable=StringVar(value='' if val is None else str(val))).grid(row=i, column=1)
-        Button(self, text='Editar', command=lambda: self.edit(matricula, user)).grid(row=len(CADASTRO_COLUMNS), column=1, pady=10)
-
-    def edit(self, matricula, user):
-        if not is_master(user):
-            messagebox.showerror('Erro', 'Acesso negado')
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.vars = {}
+        self.widgets = {}
+        for i, field in enumerate(CADASTRO_FIELDS):
+            Label(self, text=field.label + ':').grid(row=i, column=0, sticky=W)
+            var = StringVar()
+            if field.widget == 'combo':
+                widget = ttk.Combobox(self, textvariable=var, width=37)
+                widget.configure(postcommand=lambda w=widget, t=field.table: w.configure(
+                    values=refdata.cache.choices(t)))
+            else:
+                widget = Entry(self, textvariable=var, width=40, readonlybackground='white', fg='black')
+                if field.mask is not None:
+                    widget.bind('<KeyRelease>', lambda e, w=widget, mask=field.mask: mask(w))
+            widget.grid(row=i, column=1, sticky=W)
+            self.vars[field.column] = var
+            self.widgets[field.column] = widget
+        bar = Frame(self, bg='white')
+        bar.grid(row=len(CADASTRO_FIELDS), column=1, pady=10, sticky=W)
+        self.edit_button = Button(bar, text='Editar', command=self.edit)
+        self.edit_button.pack(side='left')
+        self.save_button = Button(bar, text='Salvar', command=self.save)
+        self.save_button.pack(side='left', padx=5)
+        self.cancel_button = Button(bar, text='Cancelar', command=self.cancel)
+        self.cancel_button.pack(side='left')
+
+    def show(self, matricula):
+        if self.editing and not messagebox.askyesno('Editar Cadastro', 'Descartar as alterações?', parent=self):
+            self.lift()
             return
-        EditWindow(matricula, user)
+        data = store.fetch_cadastro(matricula)
+        if data is None:
+            messagebox.showerror('Erro', 'Cadastro não encontrado')
+            return
+        self.data = dict(zip(CADASTRO_COLUMNS, data))
+        self.fill()
+        self.set_editing(False)
+        self.deiconify()
+        self.lift()
+
+    def fill(self):
+        for field in CADASTRO_FIELDS:
+            value = self.data[field.column]
+            if field.widget == 'combo' and value is not None:
+                name = refdata.cache.name(field.table, value)
+                if name is not None:
+                    value = f'{value} - {name}'
+            self.vars[field.column].set('' if value is None else str(value))
+
+    def set_editing(self, editing):
+        self.editing = editing
+        for field in CADASTRO_FIELDS:
+            writable = editing and field.widget != 'readonly'
+            if field.widget == 'combo':
+                self.widgets[field.column].configure(state='normal' if writable else 'disabled')
+            else:
+                self.widgets[field.column].configure(state='normal' if writable else 'readonly')
+        self.edit_button.configure(state='disabled' if editing else 'normal')
+        self.save_button.configure(state='normal' if editing else 'disabled')
+        self.cancel_button.configure(state='normal' if editing else 'disabled')
+        self.title(f'{"Editar Cadastro" if editing else "Detalhes"} {self.data["matricula"]}')
 
+    def edit(self):
+        if not is_master(self.user):
+            messagebox.showerror('Erro', 'Acesso negado', parent=self)
+            return
+        self.set_editing(True)
 
-class EditWindow(Toplevel):
-    def __init__(self, matricula, user):
-        super().__init__()
-        self.title('Editar Cadastro')
-        apply_basic_style(self)
-        make_fullscreen(self)
-        self.matricula = matricula
-        self.user = user
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM cadastro WHERE matricula=?', (matricula,))
-        data = cur.fetchone()
-        conn.close()
-        self.vars = {}
-        for i, (col, val) in enumerate(zip(CADASTRO_COLUMNS[1:], data[1:])):
-            Label(self, text=col.replace('_', ' ').title()+':').grid(row=i, column=0, sticky=W)
-            var = StringVar(value='' if val is None else str(val))
-            ent = Entry(self, textvariable=var)
-            ent.grid(row=i, column=1)
-            if col == 'data_nascimento':
-                ent.bind('<KeyRelease>', lambda e, w=ent: mask_date(w))
-            elif col in ('cpf',):
-                ent.bind('<KeyRelease>', lambda e, w=ent: mask_cpf(w))
-            elif col in ('tel_principal', 'tel_recado'):
-                ent.bind('<KeyRelease>', lambda e, w=ent: mask_phone(w))
-            elif col == 'cep':
-                ent.bind('<KeyRelease>', lambda e, w=ent: mask_cep(w))
-            self.vars[col] = var
-        Button(self, text='Salvar', command=self.save).grid(row=len(self.vars)+1, column=1, pady=10)
+    def cancel(self):
+        self.fill()
+        self.set_editing(False)
+
+    def close(self):
+        if self.editing and not messagebox.askyesno('Editar Cadastro', 'Descartar as alterações?', parent=self):
+            return
+        self.editing = False
+        self.withdraw()
 
+    @timed
     def save(self):
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cols = ', '.join([f"{c}=?" for c in self.vars.keys()])
-        values = [v.get() for v in self.vars.values()] + [self.matricula]
-        cur.execute(f'UPDATE cadastro SET {cols} WHERE matricula=?', values)
-        conn.commit()
-        conn.close()
-        messagebox.showinfo('Sucesso', 'Atualizado')
-        log_action(self.user, 'edit', 'cadastro', self.matricula)
-        self.destroy()
+        record = {}
+        for field in CADASTRO_FIELDS:
+            if field.widget == 'readonly':
+                continue
+            value = self.vars[field.column].get()
+            if field.widget == 'combo':
+                try:
+                    value = int(value.split(' - ')[0]) if value else None
+                except ValueError:
+                    messagebox.showerror('Erro', f'{field.label}: escolha um item da lista', parent=self)
+                    return
+            record[field.column] = value
+        matricula = self.data['matricula']
+        try:
+            row = store.update_cadastro(matricula, record)
+        except sqlite3.IntegrityError:
+            found = [c for c in dedupe.candidates(record, matricula) if dedupe.SAME_CPF in c[3]]
+            messagebox.showerror('Erro', 'CPF já cadastrado' + (f':\n{describe_duplicates(found[:1])}' if found else ''),
+                                 parent=self)
+            return
+        log_action(self.user, 'edit', 'cadastro', matricula)
+        self.data.update(record)
+        self.fill()
+        self.set_editing(False)
+        messagebox.showinfo('Sucesso', 'Atualizado', parent=self)
+        if self.on_change:
+            self.on_change(row)
 
 
 class CrudTab(Frame):
@@ -630,34 +1454,22 @@ class CrudTab(Frame):
         self.tree = ttk.Treeview(self, columns=[f[0] for f in self.fields], show='headings')
         for f in self.fields:
             self.tree.heading(f[0], text=f[1])
-        self.tree.grid(row=row+1, column=0, columnspan=2, sticky='nsew')
+        self.tree.grid(row=row+2, column=0, columnspan=2, sticky='nsew')
+        self.pager = TreePager(self.tree, self.table)
+        ColumnFilters(self, self.pager).grid(row=row+1, column=0, columnspan=2, sticky=W)
         self.refresh()
 
     def add(self):
         if not is_master(self.user):
             messagebox.showerror('Erro', 'Acesso negado')
             return
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cols = ','.join(self.entries.keys())
-        vals = [v.get() for v in self.entries.values()]
-        placeholders = ','.join(['?'] * len(vals))
-        cur.execute(f'INSERT INTO {self.table}({cols}) VALUES ({placeholders})', vals)
-        conn.commit()
-        record_id = cur.lastrowid
-        conn.close()
-        log_action(self.user, 'add', self.table, record_id)
-        self.refresh()
+        row = store.add_crud(self.table, {name: var.get() for name, var in self.entries.items()})
+        log_action(self.user, 'add', self.table, row[0])
+        self.pager.upsert(row)
 
+    @timed
     def refresh(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(f'SELECT rowid, * FROM {self.table}')
-        for row in cur.fetchall():
-            self.tree.insert('', 'end', text=row[0], values=row[1:])
-        conn.close()
+        self.pager.reload()
 
 
 class FinanceiroTab(Frame):
@@ -679,47 +1491,338 @@ class FinanceiroTab(Frame):
         Label(self, text='Forma de pagamento').grid(row=3, column=0)
         self.forma_var = StringVar()
         Entry(self, textvariable=self.forma_var).grid(row=3, column=1)
-        Button(self, text='Anexar Arquivo', command=self.attach).grid(row=4, column=0)
+        self.attach_button = Button(self, text='Anexar Arquivo', command=self.attach)
+        self.attach_button.grid(row=4, column=0)
+        # anexo_var holds the digest that is saved; the entry shows the file name.
         self.anexo_var = StringVar()
-        Entry(self, textvariable=self.anexo_var, state='readonly').grid(row=4, column=1)
-        Button(self, text='Salvar', command=self.save).grid(row=5, column=1)
-        self.tree = ttk.Treeview(self, columns=('matric', 'valor', 'venc', 'forma', 'anexo'))
+        self.anexo_nome_var = StringVar()
+        Entry(self, textvariable=self.anexo_nome_var, state='readonly').grid(row=4, column=1)
+        self.save_button = Button(self, text='Salvar', command=self.save)
+        self.save_button.grid(row=5, column=1)
+        Button(self, text='Gerar Mensalidades', command=self.open_billing).grid(row=5, column=0)
+        self.tree = ttk.Treeview(self, columns=('matric', 'valor', 'venc', 'forma', 'anexo', 'anexo_id'),
+                                 displaycolumns=('matric', 'valor', 'venc', 'forma', 'anexo'))
         for col in ('matric', 'valor', 'venc', 'forma', 'anexo'):
             self.tree.heading(col, text=col)
-        self.tree.grid(row=6, column=0, columnspan=2)
+        self.tree.grid(row=7, column=0, columnspan=2)
+        self.tree.bind('<Double-1>', self.open_attachment)
+        self.pager = TreePager(self.tree, 'financeiro')
+        ColumnFilters(self, self.pager).grid(row=6, column=0, columnspan=2, sticky=W)
         self.refresh()
 
     def attach(self):
         f = filedialog.askopenfilename()
-        if f:
-            self.anexo_var.set(f)
+        if not f:
+            return
+        # Copying and hashing a large scan takes a while; keep the UI responsive
+        # and hold Save until the digest is known.
+        self.anexo_var.set('')
+        self.anexo_nome_var.set(f'Copiando {os.path.basename(f)}...')
+        self.attach_button.configure(state='disabled')
+        self.save_button.configure(state='disabled')
+        workers.submit(lambda: store.add_attachment(attachments.ingest(f)),
+                       callback=self.attached, errback=self.attach_failed)
+
+    def attached(self, meta):
+        self.attach_button.configure(state='normal')
+        self.save_button.configure(state='normal')
+        self.anexo_var.set(meta[0])
+        self.anexo_nome_var.set(meta[1])
+
+    def attach_failed(self, exc):
+        self.attach_button.configure(state='normal')
+        self.save_button.configure(state='normal')
+        self.anexo_nome_var.set('')
+        messagebox.showerror('Erro', f'Falha ao anexar arquivo: {exc}')
+
+    def open_attachment(self, event):
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return
+        anexo = self.tree.set(iid, 'anexo_id')
+        if attachments.is_digest(anexo):
+            AttachmentWindow(anexo)
+        elif anexo:
+            # Rows saved before the store existed still hold a file path.
+            if os.path.isfile(anexo):
+                attachments.open_external(anexo)
+            else:
+                messagebox.showerror('Erro', f'Arquivo não encontrado: {anexo}')
 
+    @timed
     def save(self):
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('''INSERT INTO financeiro(matricula, valor, vencimento, forma_pagamento, anexo)
-            VALUES(?,?,?,?,?)''', (
-            self.matric_var.get(),
-            self.val_var.get(),
-            self.venc_var.get(),
-            self.forma_var.get(),
-            self.anexo_var.get()
-        ))
-        conn.commit()
-        record_id = cur.lastrowid
-        conn.close()
-        log_action(self.user, 'add', 'financeiro', record_id)
+        row = store.add_financeiro({
+            'matricula': self.matric_var.get(),
+            'valor': self.val_var.get(),
+            'vencimento': self.venc_var.get(),
+            'forma_pagamento': self.forma_var.get(),
+            'anexo': self.anexo_var.get(),
+        })
+        log_action(self.user, 'add', 'financeiro', row[0])
+        self.pager.upsert(row)
+        self.anexo_var.set('')
+        self.anexo_nome_var.set('')
+
+    def open_billing(self):
+        if not is_master(self.user):
+            messagebox.showerror('Erro', 'Somente o master pode gerar mensalidades')
+            return
+        BillingWindow(self.user, on_done=self.refresh)
+
+    @timed
+    def refresh(self):
+        self.pager.reload()
+
+
+class BillingWindow(Toplevel):
+    """Generates a month's charges for every student with a plan (see
+    billing.py); the preview shows what a run would add before it is confirmed."""
+
+    def __init__(self, user, on_done=None):
+        super().__init__()
+        self.title('Gerar mensalidades')
+        apply_basic_style(self)
+        center_window(self, 460, 360)
+        self.user = user
+        self.on_done = on_done
+        self.competencia = None
+        Label(self, text='Competência (mm/aaaa)').grid(row=0, column=0, sticky=W)
+        self.month_var = StringVar(value=datetime.date.today().strftime('%m/%Y'))
+        Entry(self, textvariable=self.month_var, width=10).grid(row=0, column=1, sticky=W)
+        Button(self, text='Pré-visualizar', command=self.preview).grid(row=0, column=2, padx=5)
+        self.status_var = StringVar()
+        Label(self, textvariable=self.status_var, justify=LEFT).grid(row=1, column=0, columnspan=3, sticky=W,
+                                                                     pady=5)
+        self.run_button = Button(self, text='Gerar', command=self.run, state='disabled')
+        self.run_button.grid(row=2, column=2, pady=5)
+        Label(self, text='Execuções anteriores').grid(row=3, column=0, columnspan=3, sticky=W)
+        self.runs_tree = ttk.Treeview(self, columns=('competencia', 'usuario', 'data', 'lancamentos', 'total'),
+                                      show='headings', height=8)
+        for col, label, width in (('competencia', 'Competência', 80), ('usuario', 'Usuário', 80),
+                                  ('data', 'Data', 130), ('lancamentos', 'Lançamentos', 80),
+                                  ('total', 'Total', 80)):
+            self.runs_tree.heading(col, text=label)
+            self.runs_tree.column(col, width=width)
+        self.runs_tree.grid(row=4, column=0, columnspan=3)
+        self.month_var.trace_add('write', lambda *args: self.run_button.configure(state='disabled'))
+        workers.submit(billing.runs, callback=self.show_runs)
+
+    def show_runs(self, runs):
+        if not self.winfo_exists():
+            return
+        self.runs_tree.delete(*self.runs_tree.get_children())
+        for run in runs:
+            self.runs_tree.insert('', END, iid=run[0], values=run[1:])
+
+    def parse_month(self):
+        try:
+            return datetime.datetime.strptime(self.month_var.get().strip(), '%m/%Y').strftime('%Y-%m')
+        except ValueError:
+            messagebox.showerror('Erro', 'Competência inválida (use mm/aaaa)', parent=self)
+            return None
+
+    def preview(self):
+        competencia = self.parse_month()
+        if competencia is None:
+            return
+        self.status_var.set('Calculando...')
+        workers.submit(billing.preview, competencia, callback=lambda p: self.show_preview(competencia, p),
+                       errback=self.failed)
+
+    def show_preview(self, competencia, p):
+        if not self.winfo_exists():
+            return
+        self.competencia = competencia
+        self.status_var.set(f"{p['alunos']} alunos com plano, {p['ja_lancados']} já lançados\n"
+                            f"Serão gerados {p['novos']} lançamentos, total R$ {p['total']:.2f}\n"
+                            f"{p['sem_plano']} alunos sem plano de valor ficam de fora")
+        self.run_button.configure(state='normal' if p['novos'] else 'disabled')
+
+    def run(self):
+        if not messagebox.askyesno('Gerar mensalidades', f'Gerar as mensalidades de {self.month_var.get()}?',
+                                   parent=self):
+            return
+        self.run_button.configure(state='disabled')
+        self.status_var.set('Gerando...')
+        workers.submit(billing.run, self.competencia, self.user, callback=self.finished, errback=self.failed)
+
+    def finished(self, run):
+        run_id, competencia, _, _, count, total = run
+        log_action(self.user, 'billing', 'financeiro', f'{competencia}: {count} lançamentos (execução {run_id})')
+        if self.winfo_exists():
+            self.status_var.set(f'{count} lançamentos gerados, total R$ {total:.2f}')
+            workers.submit(billing.runs, callback=self.show_runs)
+        if self.on_done:
+            self.on_done()
+
+    def failed(self, e):
+        if self.winfo_exists():
+            self.status_var.set('')
+            messagebox.showerror('Erro', f'Falha ao gerar mensalidades: {e}', parent=self)
+
+
+class AttachmentWindow(Toplevel):
+    """Metadata and a thumbnail of a stored attachment; the thumbnail is
+    rendered on a worker the first time and cached on disk."""
+
+    def __init__(self, sha256):
+        super().__init__()
+        self.title('Anexo')
+        apply_basic_style(self)
+        self.sha256 = sha256
+        meta = store.fetch_attachment(sha256)
+        if meta is None:
+            messagebox.showerror('Erro', 'Anexo não encontrado', parent=self)
+            self.destroy()
+            return
+        _, nome, mime, tamanho, criado_em = meta
+        Label(self, text=nome).pack(padx=10, pady=5)
+        Label(self, text=f'{mime}, {tamanho / 1024:.0f} KB, anexado em {criado_em}').pack(padx=10)
+        self.preview_label = Label(self, text='Gerando miniatura...')
+        self.preview_label.pack(padx=10, pady=10)
+        Button(self, text='Abrir', command=self.open).pack(pady=5)
+        workers.submit(attachments.preview, sha256, mime, callback=self.show_preview, errback=self.preview_failed)
+
+    def show_preview(self, png):
+        if not self.winfo_exists():
+            return
+        if png is None:
+            self.preview_label.configure(text='Pré-visualização indisponível')
+            return
+        self.image = PhotoImage(file=png)
+        self.preview_label.configure(image=self.image, text='')
+
+    def preview_failed(self, exc):
+        if self.winfo_exists():
+            self.preview_label.configure(text=f'Pré-visualização indisponível: {exc}')
+
+    def open(self):
+        path = attachments.path_for(self.sha256)
+        if not os.path.isfile(path):
+            messagebox.showerror('Erro', f'Arquivo não encontrado: {path}', parent=self)
+            return
+        attachments.open_external(path)
+
+
+class DashboardTab(Frame):
+    """Month-end figures read from the summary tables kept by the triggers."""
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.totals_var = StringVar()
+        Label(self, textvariable=self.totals_var).grid(row=0, column=0, sticky=W)
+        Button(self, text='Atualizar', command=self.refresh).grid(row=0, column=1)
+        self.check_button = Button(self, text='Verificar consistência', command=self.check)
+        self.check_button.grid(row=0, column=2)
+        self.monthly_tree = self.make_tree(1, 0, 'Recebíveis por mês',
+                                           ('Mês', 'Lançamentos', 'Total', 'Recebido', 'Em aberto'))
+        self.overdue_tree = self.make_tree(1, 1, 'Em atraso por aluno', ('Matrícula', 'Nome', 'Em aberto'))
+        self.turma_tree = self.make_tree(3, 0, 'Receita por turma', ('Turma', 'Lançamentos', 'Recebido', 'Em aberto'))
+        self.curso_tree = self.make_tree(3, 1, 'Receita por curso', ('Curso', 'Lançamentos', 'Recebido', 'Em aberto'))
+        self.loader = workers.LatestOnly('dashboard')
+        self.indicator = LoadingIndicator.of(self)
+        # Cheap enough to re-read every time the tab is shown.
+        self.bind('<Map>', lambda e: self.refresh())
+
+    def make_tree(self, row, column, title, headings):
+        Label(self, text=title).grid(row=row, column=column, sticky=W)
+        cols = [f'c{i}' for i in range(len(headings))]
+        tree = ttk.Treeview(self, columns=cols, show='headings', height=12)
+        for col, text in zip(cols, headings):
+            tree.heading(col, text=text)
+            tree.column(col, width=110)
+        tree.grid(row=row + 1, column=column, padx=5, pady=5, sticky='nsew')
+        return tree
+
+    @staticmethod
+    def fill(tree, rows):
+        tree.delete(*tree.get_children())
+        for row in rows:
+            tree.insert('', 'end', values=[f'{v:.2f}' if isinstance(v, float) else v for v in row])
+
+    @staticmethod
+    def load(reports):
+        # Runs on the worker; takes the module so client mode's stand-in is used.
+        return (reports.totals(), reports.monthly(), reports.overdue(),
+                reports.revenue('turma'), reports.revenue('curso'))
+
+    @timed
+    def refresh(self):
+        self.indicator.set(self, True)
+        self.loader.submit(self.load, reports, callback=self.show, errback=self.load_failed)
+
+    @timed
+    def show(self, data):
+        self.indicator.set(self, False)
+        (total, received, open_), monthly, overdue, turmas, cursos = data
+        self.totals_var.set(f'Total lançado: {total:.2f}   Recebido: {received:.2f}   Em aberto: {open_:.2f}')
+        self.fill(self.monthly_tree, monthly)
+        self.fill(self.overdue_tree, overdue)
+        for dim, table, tree, rows in (('turma', 'turmas', self.turma_tree, turmas),
+                                       ('curso', 'cursos', self.curso_tree, cursos)):
+            self.fill(tree, [(refdata.cache.name(table, id_) or 'Sem ' + dim, *rest) for id_, *rest in rows])
+
+    def load_failed(self, exc):
+        self.indicator.set(self, False)
+        messagebox.showerror('Erro', f'Falha ao carregar o painel: {exc}')
+
+    def check(self):
+        self.check_button.configure(state='disabled')
+        workers.submit(reports.check, callback=self.checked, errback=self.check_failed)
+
+    def checked(self, differences):
+        self.check_button.configure(state='normal')
+        if not differences:
+            messagebox.showinfo('Painel financeiro', 'Os resumos conferem com os lançamentos.')
+            return
+        for table, key, stored, expected in differences:
+            log.warning('Resumo divergente %s %s: gravado %s, esperado %s', table, key, stored, expected)
+        if messagebox.askyesno('Painel financeiro', f'{len(differences)} divergências encontradas. Reconstruir os resumos?'):
+            self.check_button.configure(state='disabled')
+            workers.submit(reports.rebuild, callback=self.rebuilt, errback=self.check_failed)
+
+    def rebuilt(self, _):
+        self.check_button.configure(state='normal')
+        self.refresh()
+
+    def check_failed(self, exc):
+        self.check_button.configure(state='normal')
+        messagebox.showerror('Erro', f'Falha na verificação: {exc}')
+
+
+class DiagnosticsTab(Frame):
+    """Slowest SQL statements, handlers and event-loop stalls, by total time."""
+
+    COLUMNS = (('kind', 'Tipo', 70), ('count', 'Qtd', 60), ('total', 'Total ms', 90), ('mean', 'Média ms', 80),
+               ('p95', 'p95 ms', 80), ('max', 'Máx ms', 80))
+
+    def __init__(self, master):
+        super().__init__(master)
+        state = 'ativo' if diagnostics.ENABLED else 'desativado (inicie com SCHOOL_DIAGNOSTICS=1)'
+        Label(self, text=f'Diagnóstico {state} - registro em {diagnostics.LOG_PATH}').pack(anchor='w')
+        bar = Frame(self)
+        bar.pack(anchor='w')
+        Button(bar, text='Atualizar', command=self.refresh).pack(side=LEFT)
+        Button(bar, text='Zerar', command=self.reset).pack(side=LEFT)
+        Button(bar, text='Gravar histogramas', command=diagnostics.recorder.dump).pack(side=LEFT)
+        self.tree = ttk.Treeview(self, columns=[c for c, _, _ in self.COLUMNS])
+        self.tree.heading('#0', text='Nome')
+        self.tree.column('#0', width=500)
+        for col, text, width in self.COLUMNS:
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor='e')
+        self.tree.pack(fill='both', expand=True)
         self.refresh()
 
     def refresh(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT matricula, valor, vencimento, forma_pagamento, anexo FROM financeiro')
-        for row in cur.fetchall():
-            self.tree.insert('', 'end', values=row)
-        conn.close()
+        self.tree.delete(*self.tree.get_children())
+        for kind, name, count, total, mean, p95, max_ms in diagnostics.recorder.top():
+            self.tree.insert('', 'end', text=name,
+                             values=(kind, count, f'{total:.1f}', f'{mean:.2f}', f'{p95:.2f}', f'{max_ms:.2f}'))
+
+    def reset(self):
+        diagnostics.recorder.reset()
+        self.refresh()
 
 
 class UsersTab(Frame):
@@ -739,29 +1842,20 @@ class UsersTab(Frame):
         self.tree = ttk.Treeview(self, columns=('user',))
         self.tree.heading('user', text='Usuário')
         self.tree.grid(row=3, column=0, columnspan=2)
+        self.pager = TreePager(self.tree, 'users')
         self.refresh()
 
     def add(self):
         if not is_master(self.user):
             messagebox.showerror('Erro', 'Acesso negado')
             return
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('INSERT INTO users(username, password) VALUES (?, ?)', (self.user_var.get(), self.pass_var.get()))
-        conn.commit()
-        conn.close()
-        log_action(self.user, 'add', 'users', self.user_var.get())
-        self.refresh()
+        row = store.add_user(self.user_var.get(), self.pass_var.get())
+        log_action(self.user, 'add', 'users', row[0])
+        self.pager.upsert(row)
 
+    @timed
     def refresh(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('SELECT username FROM users')
-        for row in cur.fetchall():
-            self.tree.insert('', 'end', values=row)
-        conn.close()
+        self.pager.reload()
 
 
 class RecoveryWindow(Toplevel):
@@ -782,48 +1876,79 @@ class RecoveryWindow(Toplevel):
         Button(self, text='Confirmar', command=self.reset).pack(pady=10)
 
     def reset(self):
-        if self.code_var.get() != '587707':
-            messagebox.showerror('Erro', 'Código inválido')
-            return
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('UPDATE users SET password=? WHERE username=?', (self.pass_var.get(), self.user_var.get()))
-        if cur.rowcount:
-            conn.commit()
+        try:
+            changed = store.recover_password(self.user_var.get(), self.code_var.get(), self.pass_var.get())
+        except ValueError as e:
+            messagebox.showerror('Erro', str(e))
+            return
+        if changed:
             messagebox.showinfo('Sucesso', 'Senha atualizada')
             self.destroy()
         else:
             messagebox.showerror('Erro', 'Usuário não encontrado')
-        conn.close()
 
 
 class LogsTab(Frame):
+    # Filter label -> logs view column, all compared for equality.
+    FILTERS = (('Usuário', 'username'), ('Ação', 'action'), ('Tabela', 'table_name'), ('Registro', 'record_id'))
+
     def __init__(self, master):
         super().__init__(master)
-        Label(self, text='Filtrar por usuário').grid(row=0, column=0)
-        self.filter_var = StringVar()
-        Entry(self, textvariable=self.filter_var).grid(row=0, column=1)
-        Button(self, text='Buscar', command=self.refresh).grid(row=0, column=2)
+        self.filter_vars = {}
+        for i, (label, column) in enumerate(self.FILTERS):
+            Label(self, text=label).grid(row=0, column=2 * i)
+            self.filter_vars[column] = StringVar()
+            Entry(self, textvariable=self.filter_vars[column], width=15).grid(row=0, column=2 * i + 1)
+        Label(self, text='De (dd/mm/aaaa)').grid(row=1, column=0)
+        self.start_entry = Entry(self, width=12)
+        self.start_entry.grid(row=1, column=1, sticky=W)
+        Label(self, text='Até (dd/mm/aaaa)').grid(row=1, column=2)
+        self.end_entry = Entry(self, width=12)
+        self.end_entry.grid(row=1, column=3, sticky=W)
+        for entry in (self.start_entry, self.end_entry):
+            entry.bind('<KeyRelease>', lambda e: mask_date(e.widget))
+        Button(self, text='Buscar', command=self.refresh).grid(row=1, column=5)
         self.tree = ttk.Treeview(self, columns=('user','action','table','record','time'))
         for c, l in zip(('user','action','table','record','time'), ['Usuário','Ação','Tabela','Registro','Data']):
             self.tree.heading(c, text=l)
-        self.tree.grid(row=1, column=0, columnspan=3, sticky='nsew')
+        self.tree.grid(row=2, column=0, columnspan=8, sticky='nsew')
+        self.pager = TreePager(self.tree, 'logs')
         self.refresh()
 
+    def filters(self):
+        """Pager filters from the form; raises ValueError on a bad date."""
+        filters = [(column, '=', var.get().strip()) for column, var in self.filter_vars.items()
+                   if var.get().strip()]
+        start, end = self.start_entry.get(), self.end_entry.get()
+        # Timestamps are ISO text, so date bounds compare as strings.
+        if start:
+            filters.append(('timestamp', '>=', datetime.datetime.strptime(start, '%d/%m/%Y').date().isoformat()))
+        if end:
+            end = datetime.datetime.strptime(end, '%d/%m/%Y').date() + datetime.timedelta(days=1)
+            filters.append(('timestamp', '<', end.isoformat()))
+        return filters
+
+    @timed
     def refresh(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        if self.filter_var.get():
-            cur.execute('SELECT username, action, table_name, record_id, timestamp FROM logs WHERE username=?', (self.filter_var.get(),))
-        else:
-            cur.execute('SELECT username, action, table_name, record_id, timestamp FROM logs')
-        for row in cur.fetchall():
-            self.tree.insert('', 'end', values=row)
-        conn.close()
+        try:
+            filters = self.filters()
+        except ValueError:
+            messagebox.showerror('Erro', 'Data inválida')
+            return
+        self.pager.reload(filters)
 
 
 if __name__ == '__main__':
-    init_db()
-    LoginWindow().mainloop()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if diagnostics.REQUESTED:
+        diagnostics.enable()
+    if SERVER_ADDRESS:
+        use_server(SERVER_ADDRESS)
+    else:
+        init_db()
+    try:
+        LoginWindow().mainloop()
+    finally:
+        audit_writer.close()
+        diagnostics.shutdown()
+        close_all()
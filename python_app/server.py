@@ -0,0 +1,332 @@
+# Data server: owns the database and serves the app's operations over TCP
+#
+# Protocol: one JSON object per line in each direction. A request is
+# {"id": n, "op": "store.fetch_page", "args": [...], "kwargs": {...}} and the
+# reply is {"id": n, "result": ...} or {"id": n, "error": "...", "type": "ValueError"}.
+#
+# A connection must log in (session.login, or session.resume with the token
+# a login returned) before any other operation. The server then acts as
+# that user: master-only operations are refused to others and audit entries
+# carry the session's user, whatever the workstation sends.
+import asyncio
+import functools
+import json
+import logging
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import backup
+import billing
+import changes
+import db
+import dedupe
+import reports
+import retention
+import store
+from audit import BATCHED, AuditWriter
+from cep import CepService
+from importer import insert_records
+from refdata import cache as refcache, load_names
+
+log = logging.getLogger(__name__)
+
+HOST = '127.0.0.1'
+PORT = 8765
+READ_WORKERS = 4
+CEP_WORKERS = 4
+FAILED_LOGIN_DELAY = 1.0        # seconds, to slow down guessing passwords and the recovery code
+MAX_BATCH = 100
+MAX_LINE = 64 * 1024 * 1024     # an import sends every record in one request
+
+audit_writer = AuditWriter(BATCHED)
+cep_service = CepService()
+
+# Run concurrently on the reader threads, each with its own connection.
+READS = {
+    'store.fetch_page': store.fetch_page,
+    'store.fetch_row': store.fetch_row,
+    'store.fetch_cadastro': store.fetch_cadastro,
+    'store.search_matriculas': store.search_matriculas,
+    'store.fetch_attachment': store.fetch_attachment,
+    'refdata.names': load_names,
+    'reports.totals': reports.totals,
+    'reports.monthly': reports.monthly,
+    'reports.overdue': reports.overdue,
+    'reports.revenue': reports.revenue,
+    'reports.check': reports.check,
+    'changes.mark': changes.mark,
+    'changes.since': changes.since,
+    'billing.preview': billing.preview,
+    'billing.runs': billing.runs,
+    'dedupe.candidates': dedupe.candidates,
+    'dedupe.screen': dedupe.screen,
+    'dedupe.report': dedupe.report,
+    # Only queues the entry; the audit writer commits in batches.
+    'audit.log': audit_writer.log,
+}
+
+# Network calls, on their own threads so a slow CEP service never holds up
+# database reads.
+LOOKUPS = {
+    'cep.lookup': cep_service.lookup,
+}
+
+# Run one after another on the writer thread; whatever is queued together
+# shares a single commit (see db.batch).
+WRITES = {
+    'store.add_cadastro': store.add_cadastro,
+    'store.update_cadastro': store.update_cadastro,
+    'store.add_crud': store.add_crud,
+    'store.add_financeiro': store.add_financeiro,
+    'store.add_user': store.add_user,
+    'store.recover_password': store.recover_password,
+    'store.add_attachment': store.add_attachment,
+}
+
+# Writers that manage their own transaction; they run alone on the writer thread.
+EXCLUSIVE = {
+    'importer.insert_records': insert_records,
+    'reports.rebuild': reports.rebuild,
+    'billing.run': billing.run,
+}
+
+
+# Allowed before logging in; recover_password checks the recovery code itself.
+PUBLIC = {'ping', 'session.login', 'session.resume', 'store.recover_password'}
+
+# What the app only lets the master user do.
+MASTER_ONLY = {'store.add_user', 'store.add_crud', 'store.update_cadastro', 'reports.rebuild', 'billing.run'}
+
+# Operations taking the acting user as an argument (its position), which
+# the server fills in from the session.
+ACTOR_ARG = {'audit.log': 0, 'billing.run': 1}
+
+
+class DataServer:
+    def __init__(self, host=HOST, port=PORT, read_workers=READ_WORKERS, max_batch=MAX_BATCH):
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='server-read')
+        self.lookups = ThreadPoolExecutor(max_workers=CEP_WORKERS, thread_name_prefix='server-cep')
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='server-write')
+        self.server = None
+        self.writes = None
+        self._held = None
+        self._tasks = set()
+        self._clients = set()
+        self._tokens = {}       # session token -> user name
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def start(self):
+        self.writes = asyncio.Queue()
+        self._tasks.add(asyncio.create_task(self._write_loop()))
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_LINE)
+        log.info('Servidor de dados em %s:%d (%s)', *self.address, db.DB_PATH)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await self.server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        self.readers.shutdown()
+        self.lookups.shutdown()
+        self.writer.shutdown()
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        pending = set()
+        session = {'user': None}
+
+        async def answer(line):
+            reply = {'id': None}
+            try:
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f'Pedido inválido: {e}') from None
+                if not isinstance(request, dict):
+                    raise ValueError('Pedido inválido: esperado um objeto JSON')
+                reply['id'] = request.get('id')
+                reply['result'] = await self.dispatch(request['op'], request.get('args', ()),
+                                                      request.get('kwargs', {}), session)
+            except Exception as e:
+                reply.update(error=str(e), type=type(e).__name__)
+            data = json.dumps(reply, ensure_ascii=False, default=str).encode() + b'\n'
+            async with lock:
+                writer.write(data)
+                await writer.drain()
+
+        self._clients.add(writer)
+        try:
+            # Requests on one connection may be pipelined; replies carry the
+            # request id and go out as each one completes.
+            while line := await reader.readline():
+                task = asyncio.create_task(answer(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def dispatch(self, op, args, kwargs, session):
+        loop = asyncio.get_running_loop()
+        if op == 'ping':
+            return 'pong'
+        if op == 'session.login':
+            return await self._login(session, *args, **kwargs)
+        if op == 'session.resume':
+            user = self._tokens.get(*args, **kwargs)
+            if user is None:
+                raise PermissionError('Sessão expirada; entre novamente')
+            session['user'] = user
+            return user
+        if session['user'] is None and op not in PUBLIC:
+            raise PermissionError('Entre com usuário e senha antes de usar o servidor')
+        if op in MASTER_ONLY and session['user'] != store.MASTER_USER:
+            raise PermissionError('Acesso negado')
+        if op in ACTOR_ARG:
+            args = list(args)
+            args[ACTOR_ARG[op]:ACTOR_ARG[op] + 1] = [session['user']]
+        if op in READS:
+            return await loop.run_in_executor(self.readers, functools.partial(READS[op], *args, **kwargs))
+        if op in LOOKUPS:
+            return await loop.run_in_executor(self.lookups, functools.partial(LOOKUPS[op], *args, **kwargs))
+        if op in WRITES or op in EXCLUSIVE:
+            future = loop.create_future()
+            await self.writes.put((op, args, kwargs, future))
+            try:
+                return await future
+            except ValueError:
+                if op == 'store.recover_password':
+                    await asyncio.sleep(FAILED_LOGIN_DELAY)
+                raise
+        raise ValueError(f'Operação desconhecida: {op}')
+
+    async def _login(self, session, username, password):
+        """Bind ``username`` to the connection; returns a token other
+        connections of the same workstation resume the session with, or None."""
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self.readers, store.check_login, username, password):
+            await asyncio.sleep(FAILED_LOGIN_DELAY)
+            return None
+        token = secrets.token_urlsafe()
+        self._tokens[token] = username
+        session['user'] = username
+        return token
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = self._held or await self.writes.get()
+            self._held = None
+            jobs = [first]
+            if first[0] in EXCLUSIVE:
+                run = functools.partial(self._run_exclusive, first)
+            else:
+                while len(jobs) < self.max_batch and not self.writes.empty():
+                    job = self.writes.get_nowait()
+                    if job[0] in EXCLUSIVE:
+                        self._held = job
+                        break
+                    jobs.append(job)
+                run = functools.partial(self._run_batch, jobs)
+            try:
+                outcomes = await loop.run_in_executor(self.writer, run)
+            except Exception as e:
+                outcomes = [e] * len(jobs)
+            for (_, _, _, future), outcome in zip(jobs, outcomes):
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+    @staticmethod
+    def _run_exclusive(job):
+        op, args, kwargs, _ = job
+        try:
+            return [EXCLUSIVE[op](*args, **kwargs)]
+        except Exception as e:
+            return [e]
+
+    @staticmethod
+    def _run_batch(jobs):
+        """Run queued writes in one transaction; each gets a result or its error."""
+        outcomes = []
+        try:
+            with db.batch():
+                for op, args, kwargs, _ in jobs:
+                    try:
+                        outcomes.append(WRITES[op](*args, **kwargs))
+                    except Exception as e:
+                        outcomes.append(e)
+        except Exception:
+            # The commit failed, so names cached by add_crud may not exist.
+            refcache.invalidate()
+            raise
+        return outcomes
+
+
+def start_background(host=HOST, port=0):
+    """Run a DataServer on a daemon thread (port 0 = any free port).
+
+    Returns (server, loop) once it is listening; stop it with
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result().
+    """
+    server = DataServer(host, port)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name='data-server', daemon=True).start()
+    ready.wait()
+    return server, loop
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Servidor de dados do sistema escolar')
+    parser.add_argument('--db', help='arquivo do banco (padrão: school.db ao lado do programa)')
+    # Passwords and session tokens travel in clear text: only listen beyond localhost on a trusted network.
+    parser.add_argument('--host', default=HOST, help='use 0.0.0.0 para aceitar outras estações')
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.db:
+        db.set_db_path(args.db)
+    store.init_db()
+    retention.ArchiveService().start()
+    changes.prune()
+    backup.BackupService().start()
+    try:
+        asyncio.run(DataServer(args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        audit_writer.close()
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+# Read/write operations used by the school app tabs
+import datetime
+import hmac
+import os
+
+import dedupe
+import retention
+from db import get_conn, transaction
+from refdata import REFERENCE_TABLES, cache as refcache
+from schema import iso_date, iso_text, migrate
+
+PAGE_SIZE = 200
+MASTER_USER = 'master'
+MASTER_PASS = 'master'
+RECOVERY_CODE = os.environ.get('SCHOOL_RECOVERY_CODE', '587707')
+
+CADASTRO_COLUMNS = [
+    'matricula', 'data_matricula', 'nome', 'data_nascimento', 'idade',
+    'responsavel', 'cpf', 'rg', 'tel_principal', 'tel_recado', 'cep',
+    'logradouro', 'numero', 'complemento', 'bairro', 'cidade', 'email',
+    'instagram', 'turma_id', 'curso_id', 'material_id', 'vencimento', 'valor_id'
+]
+
+# Lookup tables edited through CrudTab, with their editable columns. Also acts
+# as the whitelist for table names interpolated into SQL.
+CRUD_TABLES = {
+    'turmas': ('nome', 'horario'),
+    'cursos': ('nome',),
+    'materiais': ('nome', 'valor'),
+    'valores': ('descricao', 'valor'),
+    'estoque': ('nome', 'quantidade'),
+}
+
+
+def init_db():
+    """Migrate the database and make sure the master user exists."""
+    conn = get_conn()
+    migrate(conn)
+    dedupe.backfill()
+    with transaction(conn):
+        conn.execute('INSERT OR IGNORE INTO users(username, password) VALUES (?, ?)', (MASTER_USER, MASTER_PASS))
+
+
+class View:
+    """A keyset-paginated listing: a FROM clause, display columns and a key.
+
+    Every row returned for a view starts with the key followed by one value
+    per display column. ``columns`` maps column names to SQL expressions so
+    callers can filter by name without touching SQL. ``lookups`` maps columns
+    holding reference-table ids to the table whose names should be shown,
+    which replaces a SQL join with a lookup in the reference cache.
+    ``dates`` names columns holding dates typed as dd/mm/yyyy or ISO; they
+    sort chronologically through schema.iso_date(). ``archived_by`` is set on
+    views whose older rows retention moved to monthly archive tables, naming
+    the timestamp column the months split on; their pages read the archived
+    months the filters reach as well.
+
+    Rows are ordered by the ``order`` columns and then by the key, all in the
+    same direction, unless a ``sort`` of (column name, descending) puts one
+    display column first. A row's position in that ordering is its cursor.
+    """
+
+    def __init__(self, source, columns, key, descending=False, lookups=None, order=(), dates=(),
+                 archived_by=None):
+        self.source = source
+        self.dates = frozenset(dates)
+        self.archived_by = archived_by
+        self.columns = columns
+        self.key = key
+        self.descending = descending
+        self.order = order
+        self.lookup_tables = lookups or {}
+        self.lookups = [(i + 1, self.lookup_tables[name]) for i, (name, _) in enumerate(columns)
+                        if name in self.lookup_tables]
+        self.index = {name: i + 1 for i, (name, _) in enumerate(columns)}
+
+    def ordering(self, sort=None):
+        """(column names, descending) the rows are ordered by before the key.
+
+        A sorted column is followed by the default order, so ties come out
+        the way the unsorted list shows them and can use the same indexes.
+        """
+        if sort is None:
+            return list(self.order), self.descending
+        name, descending = sort
+        if name not in self.index:
+            raise ValueError(f'Coluna desconhecida: {name}')
+        return [name] + [n for n in self.order if n != name], bool(descending)
+
+    def cursor(self, row, sort=None):
+        """Position of ``row`` in this view's ordering: sort values, then key."""
+        names, _ = self.ordering(sort)
+        return tuple(iso_text(row[self.index[name]]) if name in self.dates else row[self.index[name]]
+                     for name in names) + (row[0],)
+
+    def sort_expr(self, name):
+        """SQL a column sorts by: lookup columns sort by the name shown, dates by
+        their ISO form."""
+        expr = dict(self.columns)[name]
+        if name in self.dates:
+            return iso_date(expr)
+        table = self.lookup_tables.get(name)
+        if table is None:
+            return expr
+        return f'(SELECT {REFERENCE_TABLES[table]} FROM {table} WHERE id = {self.source}.{expr})'
+
+    def select(self, source=None):
+        exprs = ', '.join(expr for _, expr in self.columns)
+        return f'SELECT {self.key}, {exprs} FROM {source or self.source}'
+
+    def render(self, row):
+        if not self.lookups or row is None:
+            return row
+        row = list(row)
+        for index, table in self.lookups:
+            row[index] = refcache.name(table, row[index])
+        return tuple(row)
+
+
+VIEWS = {
+    'matriculas': View(
+        'cadastro',
+        (('matricula', 'matricula'), ('nome', 'nome'), ('turma', 'turma_id'), ('curso', 'curso_id')),
+        'matricula', lookups={'turma': 'turmas', 'curso': 'cursos'}),
+    'financeiro': View(
+        'financeiro',
+        (('matricula', 'matricula'), ('valor', 'valor'), ('vencimento', 'vencimento'),
+         ('forma_pagamento', 'forma_pagamento'),
+         ('anexo', 'ifnull((SELECT nome FROM anexos WHERE sha256 = financeiro.anexo), financeiro.anexo)'),
+         ('anexo_id', 'anexo')),
+        'id', dates=('vencimento',)),
+    'users': View('users', (('username', 'username'),), 'username'),
+    'logs': View(
+        'logs',
+        (('username', 'username'), ('action', 'action'), ('table_name', 'table_name'),
+         ('record_id', 'record_id'), ('timestamp', 'timestamp')),
+        'id', descending=True, order=('timestamp',), archived_by='timestamp'),
+}
+for _table, _cols in CRUD_TABLES.items():
+    VIEWS[_table] = View(_table, tuple((c, c) for c in _cols), 'id')
+
+
+# 'contains' is a case-insensitive substring match, as typed in the column
+# filters; on lookup columns it matches the names shown.
+FILTER_OPS = ('=', '>=', '<', 'contains')
+
+
+def _filter(view, name, op, value):
+    """(SQL condition, params) for one (column name, operator, value) filter."""
+    if op not in FILTER_OPS:
+        raise ValueError(f'Operador inválido: {op}')
+    expr = dict(view.columns)[name]
+    if op != 'contains':
+        return f'{expr} {op} ?', [value]
+    table = view.lookup_tables.get(name)
+    if table is not None:
+        # Resolve the names in the reference cache so the column's index is used.
+        ids = [id_ for id_, text in refcache.names(table).items() if value.lower() in str(text).lower()]
+        return f"{expr} IN ({', '.join('?' * len(ids)) or 'NULL'})", ids
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{expr} LIKE ? ESCAPE '\\'", [f'%{escaped}%']
+
+
+def _keyset(order, cursor, ascending):
+    """[(SQL condition, params)] selecting the rows past ``cursor``, in scan order.
+
+    Row-value comparisons never match NULL, so when the leading sort value
+    can be NULL the rows on the other side of the NULL group form a second
+    segment. SQLite sorts NULL first: ascending scans meet the NULL group
+    before the values, descending scans after them.
+    """
+    if cursor is None:
+        return [(None, [])]
+    op = '>' if ascending else '<'
+    if len(order) == 1:
+        return [(f'{order[0]} {op} ?', list(cursor))]
+    first, tail = order[0], order[1:]
+    tail_after = f"({', '.join(tail)}) {op} ({', '.join('?' * len(tail))})"
+    if cursor[0] is None:
+        segments = [(f'{first} IS NULL AND {tail_after}', list(cursor[1:]))]
+        return segments + [(f'{first} IS NOT NULL', [])] if ascending else segments
+    # Row-value comparison keeps the keyset condition index-friendly. SQLite
+    # does not turn it into an index range on an expression (a dates column),
+    # so the leading bound is repeated on its own.
+    segments = [(f"{first} {op}= ? AND ({', '.join(order)}) {op} ({', '.join('?' * len(order))})",
+                 [cursor[0], *cursor])]
+    return segments if ascending else segments + [(f'{first} IS NULL', [])]
+
+
+def fetch_page(view_name, after=None, before=None, limit=PAGE_SIZE, filters=(), sort=None):
+    """Return up to ``limit`` rows of a view in display order.
+
+    With ``after`` the page continues past that cursor (see View.cursor); with
+    ``before`` it is the page immediately preceding it, still returned in
+    display order. ``filters`` is a sequence of (column name, operator, value)
+    with operators from FILTER_OPS. ``sort`` is (column name, descending) to
+    order by a display column instead of the view's default order; cursors
+    must come from View.cursor with the same ``sort``.
+    """
+    view = VIEWS[view_name]
+    where, params = [], []
+    for name, op, value in filters:
+        condition, values = _filter(view, name, op, value)
+        where.append(condition)
+        params.extend(values)
+
+    names, descending = view.ordering(sort)
+    backwards = before is not None
+    ascending = descending == backwards
+    order = [view.sort_expr(name) for name in names] + [view.key]
+    direction = 'ASC' if ascending else 'DESC'
+    tail = ' ORDER BY ' + ', '.join(f'{expr} {direction}' for expr in order) + ' LIMIT ?'
+    segments = _keyset(order, before if backwards else after, ascending)
+    rows = _scan(view, None, where, params, segments, tail, limit)
+    months = _archived_months(view, filters)
+    if months:
+        # Each archived month is paged like the live table and the pages are
+        # merged. A month being archived can briefly sit in both, so rows are
+        # kept once by key.
+        for month in months:
+            rows += _scan(view, f'archive.{retention.month_table(month)}', where, params, segments, tail, limit)
+        rows = sorted({row[0]: row for row in rows}.values(),
+                      key=lambda row: [(v is not None, v) for v in view.cursor(row, sort)],
+                      reverse=not ascending)[:limit]
+    if backwards:
+        rows.reverse()
+    return rows
+
+
+def _scan(view, source, where, params, segments, tail, limit):
+    """Up to ``limit`` rendered rows of ``view`` read from ``source`` (the
+    view's own by default) through the keyset ``segments``."""
+    rows = []
+    for condition, values in segments:
+        clauses = where + [condition] if condition else where
+        sql = view.select(source)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        cur = get_conn().execute(sql + tail, params + values + [limit - len(rows)])
+        rows.extend(view.render(row) for row in cur)
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def _archived_months(view, filters):
+    """Archived months of ``view`` the timestamp filters reach, attached to
+    this thread's connection; [] for views without an archive."""
+    if view.archived_by is None:
+        return []
+    start = max((v for name, op, v in filters if name == view.archived_by and op == '>='), default=None)
+    end = min((v for name, op, v in filters if name == view.archived_by and op == '<'), default=None)
+    months = retention.archived_months(start, end)
+    if not months or not retention.attach_archive(get_conn()):
+        return []
+    return months
+
+
+def fetch_cadastro(matricula):
+    """The full cadastro row, in CADASTRO_COLUMNS order, or None."""
+    return get_conn().execute(f'SELECT {", ".join(CADASTRO_COLUMNS)} FROM cadastro WHERE matricula = ?',
+                              (matricula,)).fetchone()
+
+
+def fetch_row(view_name, key):
+    """Return the single row of a view with the given key, or None."""
+    view = VIEWS[view_name]
+    return view.render(get_conn().execute(f'{view.select()} WHERE {view.key} = ?', (key,)).fetchone())
+
+
+def _insert(table, record, after=None):
+    """Insert ``record``; ``after(conn, key)`` runs in the same transaction."""
+    cols = ', '.join(record)
+    placeholders = ', '.join('?' * len(record))
+    with transaction() as conn:
+        key = conn.execute(f'INSERT INTO {table}({cols}) VALUES ({placeholders})', list(record.values())).lastrowid
+        if after is not None:
+            after(conn, key)
+    return key
+
+
+# Writes return the affected row as it appears in the matching view, so the
+# UI can patch a single Treeview item instead of reloading the list.
+def add_cadastro(record):
+    """Insert a student; a CPF already registered raises IntegrityError."""
+    return fetch_row('matriculas', _insert('cadastro', record, lambda conn, key: dedupe.reindex(conn, [key])))
+
+
+def update_cadastro(matricula, record):
+    cols = ', '.join(f'{c}=?' for c in record)
+    with transaction() as conn:
+        conn.execute(f'UPDATE cadastro SET {cols} WHERE matricula=?', [*record.values(), matricula])
+        dedupe.reindex(conn, [matricula])
+    return fetch_row('matriculas', matricula)
+
+
+def add_crud(table, record):
+    if table not in CRUD_TABLES:
+        raise ValueError(f'Tabela desconhecida: {table}')
+    row = fetch_row(table, _insert(table, record))
+    if table in REFERENCE_TABLES:
+        refcache.update(table, row[0], row[1])
+    return row
+
+
+def add_financeiro(record):
+    return fetch_row('financeiro', _insert('financeiro', record))
+
+
+def add_attachment(meta):
+    """Record an attachment copied by attachments.ingest(); re-adding is a no-op."""
+    with transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO anexos(sha256, nome, mime, tamanho, criado_em) VALUES (?, ?, ?, ?, ?)',
+                     (meta['sha256'], meta['nome'], meta['mime'], meta['size'],
+                      datetime.datetime.now().isoformat(timespec='seconds')))
+    return fetch_attachment(meta['sha256'])
+
+
+def fetch_attachment(sha256):
+    """(sha256, nome, mime, tamanho, criado_em) or None."""
+    return get_conn().execute('SELECT sha256, nome, mime, tamanho, criado_em FROM anexos WHERE sha256 = ?',
+                              (sha256,)).fetchone()
+
+
+def add_user(username, password):
+    _insert('users', {'username': username, 'password': password})
+    return fetch_row('users', username)
+
+
+def set_password(username, password):
+    """Change a user's password; False if there is no such user."""
+    with transaction() as conn:
+        cur = conn.execute('UPDATE users SET password=? WHERE username=?', (password, username))
+    return cur.rowcount > 0
+
+
+def recover_password(username, code, password):
+    """set_password() for whoever knows the recovery code. The code is
+    checked here so a data server checks it rather than the workstation."""
+    if not hmac.compare_digest(str(code), RECOVERY_CODE):
+        raise ValueError('Código inválido')
+    return set_password(username, password)
+
+
+def check_login(username, password):
+    row = get_conn().execute('SELECT password FROM users WHERE username = ?', (username,)).fetchone()
+    return row is not None and row[0] == password
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = [''.join(ch for ch in word if ch.isalnum()) for word in text.split()]
+    return ' '.join(f'"{word}"*' for word in words if word)
+
+
+def search_matriculas(text, limit=PAGE_SIZE):
+    """Rank students matching ``text`` by relevance, in 'matriculas' row form."""
+    query = _fts_query(text)
+    if not query:
+        return []
+    view = VIEWS['matriculas']
+    exprs = ', '.join(expr for _, expr in view.columns)
+    # bm25 weights follow the FTS column order: nome and responsavel count most.
+    rows = get_conn().execute(f'''SELECT {view.key}, {exprs} FROM cadastro
+        JOIN (SELECT rowid, bm25(cadastro_fts, 10.0, 5.0, 2.0, 2.0, 2.0, 1.0, 2.0) AS score
+              FROM cadastro_fts WHERE cadastro_fts MATCH ? ORDER BY score LIMIT ?) f
+        ON cadastro.matricula = f.rowid
+        ORDER BY f.score''', (query, limit))
+    return [view.render(row) for row in rows]
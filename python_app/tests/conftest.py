@@ -0,0 +1,20 @@
+# The app's modules live one directory up and import each other by name.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import schema  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A migrated database file of the test's own, reached through db.get_conn()."""
+    previous = db.DB_PATH
+    db.set_db_path(str(tmp_path / 'school.db'))
+    schema.migrate(db.get_conn())
+    yield db.get_conn()
+    db.set_db_path(previous)
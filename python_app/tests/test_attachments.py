@@ -0,0 +1,83 @@
+import hashlib
+import os
+
+import pytest
+
+import attachments
+import store
+
+PDF = b'%PDF-1.4\n' + os.urandom(300_000)
+
+
+@pytest.fixture
+def receipts(database, tmp_path, monkeypatch):
+    monkeypatch.setenv('SCHOOL_ATTACHMENTS_DIR', str(tmp_path / 'anexos'))
+    folder = tmp_path / 'scans'
+    folder.mkdir()
+    return folder
+
+
+def stored_files():
+    return sorted(name for _, _, names in os.walk(attachments.store_dir()) for name in names)
+
+
+def test_ingest_hashes_in_chunks(receipts):
+    path = receipts / 'recibo.pdf'
+    path.write_bytes(PDF)
+    meta = attachments.ingest(str(path), chunk_size=4096)
+    sha256 = hashlib.sha256(PDF).hexdigest()
+    assert meta == {'sha256': sha256, 'size': len(PDF), 'mime': 'application/pdf', 'nome': 'recibo.pdf'}
+    with open(attachments.path_for(sha256), 'rb') as f:
+        assert f.read() == PDF
+    assert attachments.is_digest(sha256) and not attachments.is_digest(str(path))
+
+
+def test_same_content_is_stored_once(receipts, database):
+    first, second = receipts / 'recibo.pdf', receipts / 'copia.bin'
+    first.write_bytes(PDF)
+    second.write_bytes(PDF)
+    metas = [attachments.ingest(str(path)) for path in (first, second)]
+    assert metas[0]['sha256'] == metas[1]['sha256']
+    # Sniffed from the content, not the name.
+    assert metas[1]['mime'] == 'application/pdf'
+    assert stored_files() == [metas[0]['sha256']]
+
+    # Two charges referencing one stored file and one metadata row.
+    for meta in metas:
+        store.add_attachment(meta)
+        store.add_financeiro({'matricula': 1, 'valor': 10, 'anexo': meta['sha256']})
+    assert database.execute('SELECT count(*) FROM anexos').fetchone()[0] == 1
+    assert database.execute('SELECT anexo, count(*) FROM financeiro GROUP BY anexo').fetchall() == [
+        (metas[0]['sha256'], 2)]
+    assert [row[5] for row in store.fetch_page('financeiro')] == ['recibo.pdf', 'recibo.pdf']
+
+
+def test_import_legacy_paths(receipts, database):
+    path = receipts / 'antigo.pdf'
+    path.write_bytes(PDF)
+    with database:
+        database.executemany('INSERT INTO financeiro(matricula, valor, anexo) VALUES (1, 10, ?)',
+                             [(str(path),), (str(receipts / 'sumiu.pdf'),), ('',)])
+    assert attachments.import_legacy() == (1, [str(receipts / 'sumiu.pdf')])
+    sha256 = hashlib.sha256(PDF).hexdigest()
+    assert database.execute('SELECT anexo FROM financeiro WHERE id = 1').fetchone() == (sha256,)
+    assert store.fetch_attachment(sha256)[1:4] == ('antigo.pdf', 'application/pdf', len(PDF))
+    # A second run finds nothing left to move.
+    assert attachments.import_legacy() == (0, [str(receipts / 'sumiu.pdf')])
+
+
+def test_preview_is_cached(receipts):
+    Image = pytest.importorskip('PIL.Image')
+    path = receipts / 'foto.jpg'
+    Image.new('RGB', (1200, 800), 'white').save(path, 'JPEG')
+    meta = attachments.ingest(str(path))
+    assert meta['mime'] == 'image/jpeg'
+    preview = attachments.preview(meta['sha256'], meta['mime'])
+    with Image.open(preview) as im:
+        assert max(im.size) <= max(attachments.PREVIEW_SIZE)
+    assert attachments.preview(meta['sha256'], meta['mime']) == preview
+    other = receipts / 'dados.zip'
+    other.write_bytes(b'PK\x03\x04' + bytes(100))
+    meta = attachments.ingest(str(other))
+    assert meta['mime'] == 'application/zip'
+    assert attachments.preview(meta['sha256'], meta['mime']) is None
@@ -0,0 +1,72 @@
+import gzip
+import os
+import sqlite3
+import zlib
+
+import pytest
+
+import backup
+import db
+
+
+@pytest.fixture
+def backups(database, tmp_path, monkeypatch):
+    monkeypatch.setenv('SCHOOL_BACKUP_DIR', str(tmp_path / 'backups'))
+    with database:
+        database.executemany('INSERT INTO cadastro(nome) VALUES (?)', [(f'Aluno {i}',) for i in range(2000)])
+    return str(tmp_path / 'backups')
+
+
+def students(conn):
+    return conn.execute('SELECT matricula, nome FROM cadastro ORDER BY matricula').fetchall()
+
+
+def test_snapshot_is_a_verified_copy(backups, database, tmp_path):
+    stats = backup.snapshot(pages=16, pause=0)
+    assert stats['steps'] > 1 and stats['file'] == backup.snapshots()[0]
+    assert backup.verify(stats['file']) == 'ok'
+    raw = tmp_path / 'copia.db'
+    with gzip.open(stats['file']) as gz:
+        raw.write_bytes(gz.read())
+    copy = sqlite3.connect(str(raw))
+    assert students(copy) == students(database)
+    copy.close()
+    assert sorted(os.listdir(backups)) == [os.path.basename(stats['file'])]
+
+
+def test_restore_brings_back_the_snapshot(backups, database):
+    before = students(database)
+    taken = backup.snapshot()['file']
+    with database:
+        database.execute('DELETE FROM cadastro WHERE matricula > 10')
+    safety = backup.restore(taken)
+    # The connection opened before the restore sees the restored rows.
+    assert students(database) == before
+    assert students(db.connect()) == before
+    assert safety != taken and backup.verify(safety) == 'ok'
+    assert backup.snapshots() == sorted([taken, safety])
+
+
+def test_corrupt_snapshot_is_not_restored(backups, database):
+    taken = backup.snapshot()['file']
+    with open(taken, 'r+b') as f:
+        f.seek(os.path.getsize(taken) // 2)
+        f.write(b'\0' * 64)
+    # Depending on where it lands, the damage breaks the deflate stream or
+    # fails gzip's CRC check; either way before anything is written.
+    with pytest.raises((gzip.BadGzipFile, zlib.error)):
+        backup.restore(taken)
+    assert len(students(database)) == 2000
+
+
+def test_rotation_and_distinct_names(backups):
+    taken = [backup.snapshot(keep=3)['file'] for _ in range(5)]
+    assert len(set(taken)) == 5
+    assert backup.snapshots() == taken[-3:]
+
+
+def test_service_waits_for_the_interval(backups):
+    service = backup.BackupService(interval_hours=1)
+    assert service.due_in() == 0
+    backup.snapshot()
+    assert 3500 < service.due_in() <= 3600
@@ -0,0 +1,61 @@
+import pytest
+
+import billing
+import reports
+
+
+@pytest.fixture
+def students(database):
+    with database:
+        database.executemany('INSERT INTO valores(id, descricao, valor) VALUES (?, ?, ?)',
+                             [(1, 'Mensal', 150), (2, 'Bolsa', '75.5')])
+        database.executemany('INSERT INTO cadastro(matricula, nome, valor_id, vencimento, data_matricula) '
+                             'VALUES (?, ?, ?, ?, ?)', [
+                                 (1, 'Ana', 1, '5', '2024-01-10'),
+                                 (2, 'Bruno', 2, '31', '10/01/2024'),
+                                 (3, 'Carla', 1, '', '2024-02-20'),    # enrolled during February
+                                 (4, 'Davi', 1, '10', '2024-03-01'),   # not yet enrolled
+                                 (5, 'Eva', None, '10', '2024-01-01'),  # no plan
+                             ])
+    return database
+
+
+def charges(conn):
+    return conn.execute('SELECT matricula, valor, vencimento, forma_pagamento FROM financeiro '
+                        "WHERE competencia = '2024-02' ORDER BY matricula").fetchall()
+
+
+def test_run_bills_enrolled_students(students):
+    assert billing.preview('2024-02') == {'alunos': 3, 'ja_lancados': 0, 'novos': 3, 'total': 375.5,
+                                          'sem_plano': 1}
+    run = billing.run('2024-02', 'master')
+    assert run[1:3] == ('2024-02', 'master') and run[4:] == (3, 375.5)
+    # Due dates are written dd/mm/yyyy, moved back to the end of short months.
+    assert charges(students) == [(1, 150, '05/02/2024', ''), (2, 75.5, '29/02/2024', ''),
+                                 (3, 150, '10/02/2024', '')]
+    assert reports.check() == []
+
+
+def test_running_a_month_twice_adds_nothing(students):
+    first = billing.run('2024-02', 'master')
+    billed = charges(students)
+    second = billing.run('2024-02', 'master')
+    assert second[4:] == (0, 0)
+    assert charges(students) == billed
+    assert billing.preview('2024-02')['novos'] == 0
+    assert [run[0] for run in billing.runs()] == [second[0], first[0]]
+
+
+def test_rerun_adds_only_new_students(students):
+    billing.run('2024-02', 'master')
+    with students:
+        students.execute("INSERT INTO cadastro(matricula, nome, valor_id, data_matricula) "
+                         "VALUES (6, 'Fábio', 2, '15/02/2024')")
+    assert billing.run('2024-02', 'master')[4:] == (1, 75.5)
+    assert [row[0] for row in charges(students)] == [1, 2, 3, 6]
+
+
+@pytest.mark.parametrize('month', ['2024-13', '2024-2', '02/2024', None])
+def test_invalid_month(students, month):
+    with pytest.raises(ValueError):
+        billing.run(month, 'master')
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from cep import CepNotFound, CepService
+
+ADDRESS = {'cep': '01001-000', 'logradouro': 'Praça da Sé', 'bairro': 'Sé', 'localidade': 'São Paulo', 'uf': 'SP'}
+
+
+class ViaCep(BaseHTTPRequestHandler):
+    """Answers /ws/<cep>/json/ like viaCEP: 01001000 exists, 99999999 is slow,
+    anything else is unknown."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        cep = self.path.split('/')[2]
+        if cep == '99999999':
+            time.sleep(0.5)
+        body = json.dumps(ADDRESS if cep == '01001000' else {'erro': True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def viacep():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ViaCep)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def service(server, **kwargs):
+    return CepService(url=f'http://127.0.0.1:{server.server_port}/ws/{{cep}}/json/', **kwargs)
+
+
+def test_hit(database, viacep):
+    assert service(viacep).lookup('01001-000') == ADDRESS
+    assert viacep.requests == ['/ws/01001000/json/']
+
+
+def test_miss(database, viacep):
+    with pytest.raises(CepNotFound):
+        service(viacep).lookup('12345-678')
+
+
+def test_invalid_cep_is_not_fetched(database, viacep):
+    with pytest.raises(ValueError):
+        service(viacep).lookup('123')
+    assert viacep.requests == []
+
+
+def test_timeout(database, viacep):
+    # Read timeouts are retried; the last one surfaces as a ConnectionError.
+    with pytest.raises(requests.RequestException):
+        service(viacep, timeout=(1, 0.1)).lookup('99999-999')
+
+
+def test_cached_in_memory_and_database(database, viacep):
+    first = service(viacep)
+    first.lookup('01001000')
+    assert first.lookup('01001-000') == ADDRESS
+    # A new service (another workstation, or after a restart) reads cep_cache.
+    assert service(viacep).lookup('01001000') == ADDRESS
+    assert len(viacep.requests) == 1
+
+
+def test_stale_entry_refreshed_and_kept_when_offline(database, viacep):
+    service(viacep).lookup('01001000')
+    assert service(viacep, ttl=0).lookup('01001000') == ADDRESS
+    assert len(viacep.requests) == 2
+    offline = CepService(url='http://127.0.0.1:9/ws/{cep}/json/', timeout=(0.2, 0.2), ttl=0)
+    assert offline.lookup('01001000') == ADDRESS
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+import db
+import dedupe
+import store
+from test_schema import baseline
+
+ANA = {'nome': 'Ana Maria de Souza', 'data_nascimento': '05/02/2010', 'tel_principal': '(11) 98765-4321',
+       'cpf': '123.456.789-00'}
+
+
+@pytest.fixture
+def registered(database):
+    store.init_db()
+    rows = [store.add_cadastro(record) for record in (
+        ANA,
+        {'nome': 'Bruno Lima', 'data_nascimento': '10/10/2011', 'tel_principal': '', 'cpf': ''},
+        {'nome': 'Carla Dias', 'data_nascimento': '', 'tel_principal': '', 'cpf': ''},
+    )]
+    return [row[0] for row in rows]
+
+
+def test_blocking_keys():
+    student = dedupe.Student(None, 'José da Silva', '05/02/2010', '(11) 98765-4321', '')
+    assert dedupe.keys(student) == {'n:jose silva', 'd:jose:05022010', 'd:silva:05022010',
+                                    't:jose:87654321', 't:silva:87654321'}
+    assert dedupe.keys(dedupe.Student(None, 'de', '', '', '')) == set()
+
+
+def test_keys_follow_writes(registered, database):
+    ana = registered[0]
+    assert ('n:ana maria souza', ana) in database.execute('SELECT chave, matricula FROM cadastro_chaves').fetchall()
+    store.update_cadastro(ana, {'nome': 'Ana Souza Lima'})
+    keys = {k for k, in database.execute('SELECT chave FROM cadastro_chaves WHERE matricula = ?', (ana,))}
+    assert 'n:ana souza lima' in keys and 'n:ana maria souza' not in keys
+
+
+def test_candidates(registered):
+    ana = registered[0]
+    # Same person typed differently: no CPF, name order and phone prefix differ.
+    found = dedupe.candidates({'nome': 'Souza, Ana Maria', 'data_nascimento': '05/02/2010',
+                               'tel_principal': '8765-4321', 'cpf': ''})
+    assert [(c.matricula, c.score) for c in found] == [(ana, 1.0)]
+    assert dedupe.SAME_CPF not in found[0].motivos
+    found = dedupe.candidates({'nome': 'Outro Nome', 'cpf': '12345678900'})
+    assert [(c.matricula, c.motivos) for c in found] == [(ana, [dedupe.SAME_CPF])]
+    # A student is not a duplicate of itself.
+    assert dedupe.candidates(ANA, ana) == []
+    assert dedupe.candidates({'nome': 'Bruna Lins', 'cpf': ''}) == []
+
+
+def test_registered_cpf_is_refused(registered):
+    with pytest.raises(sqlite3.IntegrityError):
+        store.add_cadastro({'nome': 'Outra Ana', 'cpf': '123 456 789 00'})
+    with pytest.raises(sqlite3.IntegrityError):
+        store.update_cadastro(registered[1], {'cpf': '12345678900'})
+    # Blank CPFs never collide.
+    store.add_cadastro({'nome': 'Davi Melo', 'cpf': ''})
+
+
+def test_screen_import_rows(registered):
+    rejected, warnings = dedupe.screen([
+        ['Zeca Lopes', '', '', '123.456.789-00'],
+        ['Ana Maria Sousa', '05/02/2010', '', ''],
+        ['Eva Reis', '01/01/2012', '', '987.654.321-00'],
+        ['Eva Reis', '01/01/2012', '', '98765432100'],
+        ['Eva Reis', '01/01/2012', '', ''],
+    ])
+    assert [index for index, _ in rejected] == [0, 3]
+    assert [index for index, _ in warnings] == [1, 4]
+
+
+def test_report_and_legacy_shared_cpf(database, tmp_path):
+    # A database from before the unique index may hold a CPF twice: the
+    # first student keeps cpf_norm and the report lists the pair.
+    path = str(tmp_path / 'legacy.db')
+    baseline(path).close()
+    db.set_db_path(path)
+    store.init_db()
+    conn = db.get_conn()
+    assert conn.execute('SELECT matricula FROM cadastro WHERE cpf_norm IS NOT NULL').fetchall() == [(1,)]
+    assert conn.execute('SELECT count(DISTINCT matricula) FROM cadastro_chaves').fetchone()[0] == 3
+    assert [(a, b, reasons) for _, a, _, b, _, reasons in dedupe.report()] == [(1, 3, [dedupe.SAME_CPF])]
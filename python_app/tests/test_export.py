@@ -0,0 +1,77 @@
+import csv
+import datetime
+import json
+
+import pytest
+
+import db
+import export
+import importer
+import schema
+from refdata import cache as refcache
+from store import CADASTRO_COLUMNS
+
+STUDENTS = [
+    ['nome', 'data_nascimento', 'cpf', 'tel_principal', 'cidade', 'turma', 'data_matricula'],
+    ['Ana Souza', '05/02/2010', '12345678900', '11987654321', 'São Paulo', 'Manhã', '05/02/2024'],
+    ['Bruno Lima', '', '', '', 'Osasco; SP', '1', '2024-03-01'],
+    ['Carla "Cacá" Dias', '10/10/2011', '98765432100', '', '', '', '20/03/2024'],
+]
+
+
+def add_references(conn):
+    with conn:
+        conn.execute("INSERT INTO turmas(id, nome) VALUES (1, 'Manhã')")
+    refcache.invalidate()
+
+
+def import_into(conn, path):
+    add_references(conn)
+    return importer.import_file(path).inserted
+
+
+def students(conn):
+    # The importer writes '' for the columns a sheet leaves blank.
+    return [tuple('' if v is None else v for v in row)
+            for row in conn.execute(f'SELECT {", ".join(CADASTRO_COLUMNS)} FROM cadastro ORDER BY matricula')]
+
+
+@pytest.fixture
+def sheet(tmp_path):
+    path = tmp_path / 'alunos.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, delimiter=';').writerows(STUDENTS)
+    return str(path)
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.xlsx'])
+def test_export_import_round_trip(database, sheet, tmp_path, ext):
+    if ext == '.xlsx':
+        pytest.importorskip('openpyxl')
+    assert import_into(database, sheet) == 3
+    exported = students(database)
+    path = str(tmp_path / f'cadastro{ext}')
+    assert export.export('cadastro', path) == 3
+
+    db.set_db_path(str(tmp_path / 'outra.db'))
+    conn = db.get_conn()
+    schema.migrate(conn)
+    assert import_into(conn, path) == 3
+    assert students(conn) == exported
+
+
+def test_export_date_range_and_columns(database, sheet, tmp_path):
+    import_into(database, sheet)
+    path = str(tmp_path / 'cadastro.jsonl')
+    count = export.export('cadastro', path, columns=['nome', 'data_matricula'],
+                          start=datetime.date(2024, 3, 1), end=datetime.date(2024, 3, 19))
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [{'nome': 'Bruno Lima', 'data_matricula': '2024-03-01'}]
+    assert count == 1
+
+
+def test_unknown_column_leaves_no_file(database, tmp_path):
+    path = tmp_path / 'cadastro.csv'
+    with pytest.raises(ValueError):
+        export.export('cadastro', str(path), columns=['nome', 'senha'])
+    assert not path.exists() and not (tmp_path / 'cadastro.csv.part').exists()
@@ -0,0 +1,70 @@
+import csv
+import datetime
+
+import pytest
+
+import importer
+import store
+from refdata import cache as refcache
+
+TODAY = datetime.date(2024, 6, 1)
+
+
+@pytest.fixture
+def references(database):
+    with database:
+        database.executemany('INSERT INTO turmas(id, nome) VALUES (?, ?)', [(1, 'Manhã'), (2, '2024')])
+        database.execute("INSERT INTO cursos(id, nome) VALUES (1, 'Inglês')")
+    refcache.invalidate()
+    yield
+    refcache.invalidate()
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, delimiter=';').writerows(rows)
+    return str(path)
+
+
+def test_import_file(references, database, tmp_path):
+    path = write_csv(tmp_path / 'alunos.csv', [
+        ['Nome completo', 'Nascimento', 'CPF', 'Celular', 'Turma', 'Curso', 'Data matrícula', 'Coluna extra'],
+        ['Ana Souza', '05/02/2010', '12345678900', '11987654321', 'manhã', 'Inglês', '05/02/2024', 'x'],
+        ['Bruno Lima', '', '1234567890', '', '1', '', '2024-03-01', ''],
+        ['', '01/01/2010', '', '', '', '', '', ''],
+        ['Carla Dias', '', '', '', '7', '', '', ''],
+        ['Davi Melo', '', '', '', '2024', '', '31/02/2024', ''],
+        ['Eva Reis', '', '', '', '2024', '', '', ''],
+    ])
+    result = importer.import_file(path)
+    assert result.inserted == 3
+    assert result.errors == [
+        (4, 'nome em branco'),
+        (5, "'7' não encontrado em turmas"),
+        (6, "data de matrícula inválida: '31/02/2024' (use dd/mm/aaaa)"),
+    ]
+    rows = database.execute('SELECT nome, data_nascimento, cpf, tel_principal, turma_id, curso_id, data_matricula '
+                            'FROM cadastro ORDER BY matricula').fetchall()
+    assert rows[:2] == [
+        ('Ana Souza', '05/02/2010', '123.456.789-00', '(11) 98765-4321', 1, 1, '2024-02-05'),
+        ('Bruno Lima', '', '012.345.678-90', '', 1, None, '2024-03-01'),
+    ]
+    # A class named '2024' is matched by name; no row 2024 exists.
+    assert rows[2][0] == 'Eva Reis' and rows[2][4] == 2
+    assert rows[2][6] == datetime.date.today().isoformat()
+    # Imported rows are indexed for search in one pass at the end.
+    assert [row[2] for row in store.search_matriculas('souza')] == ['Ana Souza']
+
+
+def test_parse_file_computes_age(references, tmp_path):
+    path = write_csv(tmp_path / 'alunos.csv', [['nome', 'data_nascimento'], ['Ana', '06/02/2010']])
+    records, errors, lines = importer.parse_file(path, today=TODAY)
+    assert errors == [] and lines == [2]
+    assert records[0][importer.IMPORT_COLUMNS.index('idade')] == 14
+    assert records[0][importer.IMPORT_COLUMNS.index('data_matricula')] == TODAY.isoformat()
+
+
+def test_sheet_without_name_column(database, tmp_path):
+    path = write_csv(tmp_path / 'alunos.csv', [['cpf'], ['12345678900']])
+    with pytest.raises(ValueError, match='nome'):
+        importer.import_file(path)
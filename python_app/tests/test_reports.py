@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+import reports
+import schema
+from test_schema import at_version, baseline
+
+
+@pytest.fixture
+def charges(database):
+    with database:
+        database.executemany("INSERT INTO cadastro(matricula, nome, turma_id) VALUES (?, ?, ?)",
+                             [(1, 'Ana', 1), (2, 'Bruno', 2)])
+        database.executemany('INSERT INTO financeiro(matricula, valor, vencimento, forma_pagamento) VALUES (?, ?, ?, ?)',
+                             [(1, 100, '10/01/2024', 'pix'), (1, 100, '2024-02-10', ''),
+                              (2, 50, '10/02/2024', None), (2, 30, None, '')])
+    return database
+
+
+def test_dashboard_queries(charges):
+    assert reports.monthly() == [('2024-02', 2, 150, 0, 150), ('2024-01', 1, 100, 100, 0), ('', 1, 30, 0, 30)]
+    assert reports.totals() == (280, 100, 180)
+    # The charge without a due date is never overdue.
+    assert reports.overdue(datetime.date(2024, 3, 5)) == [(1, 'Ana', 100), (2, 'Bruno', 50)]
+    assert reports.revenue('turma') == [(1, 2, 100, 100), (2, 2, 0, 80)]
+    with pytest.raises(ValueError):
+        reports.revenue('professor')
+
+
+def test_triggers_follow_writes(charges):
+    with charges:
+        charges.execute("UPDATE financeiro SET forma_pagamento = 'pix' WHERE vencimento = '10/02/2024'")
+        charges.execute('UPDATE cadastro SET turma_id = 1 WHERE matricula = 2')
+        charges.execute("DELETE FROM financeiro WHERE vencimento = '2024-02-10'")
+        charges.execute('INSERT INTO financeiro(matricula, valor, vencimento) VALUES (3, 20, NULL)')
+        charges.execute("INSERT INTO cadastro(matricula, nome, turma_id) VALUES (3, 'Carla', 2)")
+    assert reports.check() == []
+    assert reports.revenue('turma') == [(1, 3, 150, 30), (2, 1, 0, 20)]
+
+
+def test_summaries_after_upgrade():
+    conn = baseline()
+    schema.migrate(conn)
+    assert reports.check(conn) == []
+
+
+def test_summaries_accept_charges_without_due_date():
+    conn = baseline()
+    schema.migrate(conn)
+    with conn:
+        conn.execute("INSERT INTO financeiro(matricula, valor, vencimento, forma_pagamento) VALUES (1, 10, NULL, '')")
+        conn.execute("UPDATE financeiro SET vencimento = NULL WHERE vencimento = '10/02/2024'")
+        conn.execute("UPDATE financeiro SET vencimento = '10/05/2024' WHERE id = 5")
+    assert reports.check(conn) == []
+
+
+@pytest.mark.parametrize('version', range(1, len(schema.MIGRATIONS)))
+def test_summaries_after_upgrade_from_each_version(version):
+    conn = at_version(version)
+    schema.migrate(conn)
+    assert reports.check(conn) == []
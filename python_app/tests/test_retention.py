@@ -0,0 +1,77 @@
+import datetime
+
+import pytest
+
+import export
+import retention
+import store
+
+TODAY = datetime.date(2024, 10, 17)
+START = datetime.datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def logs(database):
+    """One entry every 7 hours from January to early October 2024."""
+    with database:
+        database.executemany(
+            'INSERT INTO logs(username, action, table_name, record_id, timestamp) VALUES (?, ?, ?, ?, ?)',
+            [('abc'[i % 3], 'add', 'cadastro', str(i), (START + datetime.timedelta(hours=7 * i)).isoformat())
+             for i in range(1000)])
+    return store.fetch_page('logs', limit=1000)
+
+
+def pages(filters=(), size=37):
+    rows, cursor = [], None
+    while True:
+        page = store.fetch_page('logs', after=cursor, limit=size, filters=filters)
+        rows += page
+        if len(page) < size:
+            return rows
+        cursor = store.VIEWS['logs'].cursor(page[-1])
+
+
+def test_archive_moves_old_months(logs, database):
+    moved = retention.archive_logs(days=120, today=TODAY)
+    cutoff = (TODAY - datetime.timedelta(days=120)).isoformat()
+    assert sum(moved.values()) == sum(row[5] < cutoff for row in logs)
+    assert database.execute('SELECT min(timestamp) FROM logs').fetchone()[0] >= cutoff
+    assert retention.archived_months() == sorted(moved, reverse=True)
+    assert retention.archived_months('2024-03-15', '2024-05-01') == ['2024-04', '2024-03']
+    # Running again moves nothing.
+    assert retention.archive_logs(days=120, today=TODAY) == {}
+
+
+def test_pages_read_the_archive(logs):
+    retention.archive_logs(days=120, today=TODAY)
+    assert pages() == logs
+    in_range = [row for row in logs if '2024-03-15' <= row[5] < '2024-05-01']
+    assert pages([('timestamp', '>=', '2024-03-15'), ('timestamp', '<', '2024-05-01')]) == in_range
+    assert pages([('username', '=', 'b')]) == [row for row in logs if row[1] == 'b']
+
+
+def test_interrupted_archive_shows_rows_once(logs, database):
+    retention.archive_logs(days=120, today=TODAY)
+    # As if the copy committed but the delete from logs never ran.
+    retention.attach_archive(database)
+    with database:
+        database.execute('INSERT INTO logs SELECT * FROM archive.logs_2024_01')
+    assert pages() == logs
+    assert sum(len(chunk) for chunk in export.iter_rows('logs')) == len(logs)
+
+
+def test_export_reads_the_archive(logs):
+    retention.archive_logs(days=120, today=TODAY)
+    rows = [row for chunk in export.iter_rows('logs') for row in chunk]
+    assert sorted(row[0] for row in rows) == sorted(row[0] for row in logs)
+    rows = [row for chunk in export.iter_rows('logs', start=datetime.date(2024, 3, 15),
+                                               end=datetime.date(2024, 4, 30)) for row in chunk]
+    assert len(rows) == sum('2024-03-15' <= row[5] < '2024-05-01' for row in logs)
+
+
+def test_service_runs_once_a_day(logs):
+    service = retention.ArchiveService()
+    assert service.due_in() == 0
+    retention.archive_logs()
+    assert retention.last_run() == datetime.date.today()
+    assert 0 < service.due_in() <= 24 * 3600
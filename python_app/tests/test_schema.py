@@ -0,0 +1,93 @@
+import sqlite3
+
+import pytest
+
+import schema
+
+# Databases created before versioning hold the tables of migration 1 and
+# user_version 0.
+BASELINE = schema.MIGRATIONS[0]
+
+STUDENTS = [
+    # matricula, data_matricula, nome, cpf, turma_id, curso_id
+    (1, '05/02/2024', 'Ana Souza', '123.456.789-00', 1, 1),
+    (2, '2024-03-01', 'Bruno Lima', '', 1, 2),
+    (3, '10/03/2024', 'Ana Souza', '12345678900', 2, None),      # same CPF as 1, typed differently
+]
+
+CHARGES = [
+    # matricula, valor, vencimento, forma_pagamento
+    (1, 150.0, '10/02/2024', 'pix'),
+    (1, 150.0, '2024-03-10', ''),
+    (2, '120,00', '10/03/2024', None),
+    (9, 80.0, '15/04/2024', 'dinheiro'),     # student not registered
+    (2, 60.0, None, ''),                     # no due date
+]
+
+
+def baseline(path=':memory:'):
+    conn = sqlite3.connect(path)
+    for sql in BASELINE:
+        conn.execute(sql)
+    conn.executemany('INSERT INTO cadastro(matricula, data_matricula, nome, cpf, turma_id, curso_id) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', STUDENTS)
+    conn.executemany('INSERT INTO financeiro(matricula, valor, vencimento, forma_pagamento) VALUES (?, ?, ?, ?)',
+                     CHARGES)
+    conn.commit()
+    return conn
+
+
+def test_baseline_is_version_zero():
+    assert schema.user_version(baseline()) == 0
+
+
+def test_migrate_from_baseline():
+    conn = baseline()
+    schema.migrate(conn)
+    assert schema.user_version(conn) == schema.SCHEMA_VERSION
+    assert conn.execute('SELECT count(*) FROM cadastro').fetchone()[0] == len(STUDENTS)
+    assert conn.execute('SELECT count(*) FROM financeiro').fetchone()[0] == len(CHARGES)
+
+
+def test_query_plans():
+    conn = baseline()
+    schema.migrate(conn)
+    schema.check_query_plans(conn)
+
+
+def test_migrate_is_idempotent():
+    conn = baseline()
+    schema.migrate(conn)
+    before = conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY name').fetchall()
+    schema.migrate(conn)
+    assert schema.user_version(conn) == schema.SCHEMA_VERSION
+    assert conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY name').fetchall() == before
+
+
+def at_version(version):
+    """The baseline database upgraded by hand to ``version``."""
+    conn = baseline()
+    for number, statements in enumerate(schema.MIGRATIONS[:version], start=1):
+        for sql in statements:
+            conn.execute(sql)
+        conn.execute(f'PRAGMA user_version = {number}')
+    conn.commit()
+    return conn
+
+
+@pytest.mark.parametrize('version', range(1, len(schema.MIGRATIONS)))
+def test_migrate_from_each_version(version):
+    """A database left at any version finishes the upgrade like a fresh one."""
+    conn = at_version(version)
+    schema.migrate(conn)
+    assert schema.user_version(conn) == schema.SCHEMA_VERSION
+    schema.check_query_plans(conn)
+
+
+def test_new_database_matches_upgraded_one():
+    fresh = sqlite3.connect(':memory:')
+    schema.migrate(fresh)
+    upgraded = baseline()
+    schema.migrate(upgraded)
+    query = "SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY name"
+    assert fresh.execute(query).fetchall() == upgraded.execute(query).fetchall()
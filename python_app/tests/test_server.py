@@ -0,0 +1,105 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+import client
+import reports
+import server
+import store
+from refdata import cache as refcache
+
+STUDENT = {'nome': 'Ana Souza', 'cpf': '123.456.789-00', 'data_matricula': '2024-02-05'}
+
+
+@pytest.fixture
+def address(database, monkeypatch):
+    monkeypatch.setattr(server, 'FAILED_LOGIN_DELAY', 0)
+    store.init_db()
+    refcache.invalidate()
+    data_server, loop = server.start_background('127.0.0.1')
+    yield data_server.address
+    asyncio.run_coroutine_threadsafe(data_server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    refcache.invalidate()
+
+
+def connect(address, username=None, password=None):
+    remote = client.Client(*address)
+    if username is not None:
+        assert remote.login(username, password)
+    return remote
+
+
+def test_round_trip(address, database):
+    remote = connect(address, 'master', 'master')
+    remote_store = client.RemoteStore(remote)
+    row = remote_store.add_cadastro(STUDENT)
+    assert row[2] == 'Ana Souza'
+    assert remote_store.fetch_page('matriculas') == [row]
+    assert remote_store.fetch_cadastro(row[0])[store.CADASTRO_COLUMNS.index('cpf')] == '123.456.789-00'
+    remote_store.add_financeiro({'matricula': row[0], 'valor': 100, 'vencimento': '10/03/2024',
+                                 'forma_pagamento': 'pix'})
+    remote_reports = client.RemoteModule(remote, 'reports', reports, ('totals', 'monthly'))
+    assert remote_reports.totals() == [100, 100, 0]
+    assert remote_reports.SUMMARY_KEYS is reports.SUMMARY_KEYS
+    # Writes made through the server are in the database file.
+    assert database.execute('SELECT nome FROM cadastro').fetchall() == [('Ana Souza',)]
+    remote.close()
+
+
+def test_requires_login(address):
+    remote = connect(address)
+    assert remote.call('ping') == 'pong'
+    with pytest.raises(PermissionError):
+        remote.call('store.fetch_page', 'users')
+    assert not client.RemoteStore(remote).check_login('master', 'errada')
+    assert client.RemoteStore(remote).check_login('master', 'master')
+    # Passwords only change through recover_password, which checks the code.
+    with pytest.raises(ValueError, match='Operação desconhecida'):
+        remote.call('store.set_password', 'master', 'x')
+    remote.close()
+
+
+def test_session_is_shared_by_the_client_threads(address):
+    remote = connect(address, 'master', 'master')
+    pages = []
+    thread = threading.Thread(target=lambda: pages.append(remote.call('store.fetch_page', 'users')))
+    thread.start()
+    thread.join()
+    assert pages == [[['master', 'master']]]
+    remote.close()
+
+
+def test_master_only_operations(address, database):
+    master = connect(address, 'master', 'master')
+    client.RemoteStore(master).add_user('recepcao', '123')
+    user = connect(address, 'recepcao', '123')
+    with pytest.raises(PermissionError):
+        client.RemoteStore(user).add_user('outro', '1')
+    # Audit entries are recorded under the session's user, whatever is sent.
+    user.call('audit.log', 'master', 'add', 'cadastro', '1')
+    server.audit_writer.flush()
+    assert database.execute('SELECT username FROM logs').fetchall() == [('recepcao',)]
+    master.close()
+    user.close()
+
+
+def test_recover_password(address):
+    remote_store = client.RemoteStore(connect(address))
+    with pytest.raises(ValueError):
+        remote_store.recover_password('master', '000000', 'nova')
+    assert remote_store.recover_password('master', store.RECOVERY_CODE, 'nova')
+    assert remote_store.check_login('master', 'nova')
+
+
+def test_malformed_request_keeps_the_connection(address):
+    with socket.create_connection(address) as sock:
+        stream = sock.makefile('rwb')
+        stream.write(b'{not json\n[1]\n{"id": 7, "op": "ping"}\n')
+        stream.flush()
+        replies = [json.loads(stream.readline()) for _ in range(3)]
+    assert [reply.get('type') for reply in replies[:2]] == ['ValueError', 'ValueError']
+    assert replies[2] == {'id': 7, 'result': 'pong'}
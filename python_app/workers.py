@@ -0,0 +1,106 @@
+# Runs blocking work off the Tk thread and hands results back to it
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_conn
+
+log = logging.getLogger(__name__)
+
+POLL_MS = 25
+
+pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='school-worker')
+_callbacks = queue.SimpleQueue()
+
+
+def install(root):
+    """Run queued callbacks on ``root``'s event loop, polling with after().
+
+    Tk widgets must only be touched from the thread running mainloop, so
+    worker threads never call into Tk directly; they queue a callback here.
+    """
+    def drain():
+        while True:
+            try:
+                fn, args = _callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception:
+                log.exception('Erro em callback de tarefa em segundo plano')
+        root.after(POLL_MS, drain)
+    root.after(POLL_MS, drain)
+
+
+def call_soon(fn, *args):
+    """Schedule ``fn(*args)`` on the Tk thread. Safe to call from any thread."""
+    _callbacks.put((fn, args))
+
+
+def submit(fn, *args, callback=None, errback=None, executor=None):
+    """Run ``fn(*args)`` on a worker and deliver the outcome on the Tk thread.
+
+    ``callback`` receives the result and ``errback`` the exception. Nothing is
+    delivered for a future that was cancelled.
+    """
+    future = (executor or pool).submit(fn, *args)
+
+    def done(f):
+        if f.cancelled():
+            return
+        exc = f.exception()
+        if exc is None:
+            if callback is not None:
+                call_soon(callback, f.result())
+        elif errback is not None:
+            call_soon(errback, exc)
+        else:
+            log.error('Tarefa em segundo plano falhou', exc_info=exc)
+
+    future.add_done_callback(done)
+    return future
+
+
+class LatestOnly:
+    """Runs jobs one at a time on a private thread, keeping only the newest.
+
+    Submitting a job cancels the previous one: if it has not started it never
+    runs, and if it is running its SQLite query is interrupted. Either way its
+    callbacks are never delivered, so the UI only ever sees the latest result.
+    """
+
+    # Returns a callable that aborts the query running on the calling thread,
+    # or None when there is nothing local to abort (client mode).
+    interrupter = staticmethod(lambda: get_conn().interrupt)
+
+    def __init__(self, name='latest'):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.generation = 0
+        self.future = None
+        self._interrupt = None
+
+    def submit(self, fn, *args, callback=None, errback=None):
+        self.cancel()
+        generation = self.generation
+
+        def run():
+            self._interrupt = self.interrupter()
+            return fn(*args)
+
+        def current(handler):
+            def deliver(value):
+                if generation == self.generation and handler is not None:
+                    handler(value)
+            return deliver
+
+        self.future = submit(run, callback=current(callback), errback=current(errback),
+                             executor=self.executor)
+        return self.future
+
+    def cancel(self):
+        self.generation += 1
+        future = self.future
+        if future is not None and not future.cancel() and not future.done() and self._interrupt is not None:
+            self._interrupt()
+        self.future = None